@@ -2,4 +2,5 @@
 source /opt/envs/olse/bin/activate
 # sleep 20
 # flask run
+flask upgrade-graph
 exec gunicorn -b :19033 --access-logfile - --error-logfile - fromflask:app &
@@ -1,7 +1,7 @@
 # import logging
 # import os
 from config import Config
-from flask import Flask
+from flask import Flask, g
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from competition.lib import my_env, neostore
@@ -25,6 +25,8 @@ def create_app(config_class=Config):
 
     # Configure Logger
     my_env.init_loghandler(__name__, app.config.get('LOGDIR'), app.config.get('LOGLEVEL'))
+    my_env.init_loghandler(neostore.slow_logger, app.config.get('LOGDIR'), app.config.get('SLOW_LOG_LEVEL'),
+                           logger_name=neostore.slow_logger)
 
     # initialize extensions
     bootstrap.init_app(app)
@@ -36,5 +38,51 @@ def create_app(config_class=Config):
     # import blueprints
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint)
+
+    @app.before_request
+    def db_stats_reset():
+        """
+        Start the database statistics of the request at zero. A request shares an application context that is pushed
+        already, e.g. in a test, so the statistics on g can contain the statements of earlier requests.
+        """
+        g.db_stats = dict(queries=0, time=0.0)
+
+    @app.after_request
+    def db_stats_headers(response):
+        """
+        Add the number of database statements and the total database time of the request to the response headers.
+        """
+        stats = g.get("db_stats", dict(queries=0, time=0.0))
+        response.headers["X-DB-Queries"] = str(stats["queries"])
+        response.headers["X-DB-Time"] = "{ms:.1f}ms".format(ms=stats["time"] * 1000)
+        return response
+
+    @app.teardown_appcontext
+    def flush_graph_changes(exc):
+        """
+        Record the changes of the request in the graph version and the change feed, in a single statement.
+        """
+        from competition.lib.models_graph import ns
+        try:
+            ns.flush_request_changes()
+        except Exception:
+            app.logger.exception("Recording the graph changes failed.")
+
+    @app.cli.command("upgrade-graph")
+    def upgrade_graph_command():
+        """
+        Set the constraints, indexes and reference nodes and upgrade an existing graph to the schema version of the
+        application, e.g. set the sequence of arrival and the standings.
+        """
+        from competition.lib.models_graph import init_graph
+        init_graph()
+
+    # Start the orphan sweeper, not for test runs since every test case creates an application.
+    if app.config.get("ORPHAN_SWEEP_INTERVAL") and not app.testing:
+        from competition.lib.models_graph import start_orphan_sweeper
+        start_orphan_sweeper(app, app.config["ORPHAN_SWEEP_INTERVAL"])
+
     # configure production logging of errors
     return app
@@ -0,0 +1,4 @@
+from flask import Blueprint
+api = Blueprint('api', __name__, url_prefix='/api')
+
+from . import routes
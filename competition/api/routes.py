@@ -0,0 +1,117 @@
+"""
+Read-only JSON API. Payloads are column oriented: a table is a dictionary with key column name and value the list of
+values for the column, so the column names are sent only once. Payloads are kept in the fragment cache and support
+conditional GET, in the same way as the HTML pages.
+"""
+
+import json
+from competition.lib import models_graph as mg
+from competition.lib.neostructure import lbl_race
+from competition.lib.webcache import cached, conditional
+from flask import abort, current_app
+from . import api
+
+
+def columns(rows, names):
+    """
+    This function converts a list of rows to a column oriented table.
+
+    :param rows: List of rows, each row is a dictionary.
+    :param names: Column names.
+    :return: Dictionary with key column name and value the list of values for the column.
+    """
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def json_response(render, *key):
+    """
+    This function returns the JSON payload from the fragment cache as a response.
+
+    :param render: Function without arguments that returns the payload as a dictionary.
+    :param key: Key of the payload in the fragment cache.
+    :return: Response with mimetype application/json.
+    """
+    payload = cached(lambda: json.dumps(render(), separators=(",", ":")), *key)
+    return current_app.response_class(payload, mimetype="application/json")
+
+
+@api.route('/organizations')
+@conditional
+def organizations():
+    """
+    This method returns the organizations of the season, in date sequence.
+
+    :return: Columns id, date, organization, city and type.
+    """
+    def render():
+        return dict(organizations=columns(mg.organization_list(), ["id", "date", "organization", "city", "type"]))
+    return json_response(render, "api_organizations")
+
+
+@api.route('/standings/<mf>')
+@conditional
+def standings(mf):
+    """
+    This method returns the standings for Dames or Heren, sorted on points.
+
+    :param mf: Dames / Heren
+    :return: Columns nid, name, points and nr (number of races).
+    """
+    def render():
+        rows = [dict(nid=nid, name=name, points=points, nr=nr) for (name, points, nr, nid) in mg.results_for_mf(mf)]
+        return dict(mf=mf, standings=columns(rows, ["nid", "name", "points", "nr"]))
+    return json_response(render, "api_standings", mf)
+
+
+@api.route('/overview/<mf>')
+@conditional
+def overview(mf):
+    """
+    This method returns the overview matrix for Dames or Heren. Persons are in the sequence of the standings. For
+    every organization there is a list of positions and a list of points, in the sequence of the persons. The value is
+    null if the person did not participate.
+
+    :param mf: Dames / Heren
+    :return: Organizations columns, persons columns and dictionaries pos and points with key organization id.
+    """
+    def render():
+        result_seq = mg.results_for_mf(mf)
+        season = mg.season_matrix(mf)
+        org_list = mg.organization_list()
+        person_nids = [person_res[3] for person_res in result_seq]
+        pos = {}
+        points = {}
+        for org in org_list:
+            parts = [season[nid].get(org["id"], {}).get("part", {}) for nid in person_nids]
+            pos[org["id"]] = [part.get("pos") for part in parts]
+            points[org["id"]] = [part.get("points") for part in parts]
+        rows = [dict(nid=nid, name=name, points=pnts, nr=nr) for (name, pnts, nr, nid) in result_seq]
+        return dict(
+            mf=mf,
+            organizations=columns(org_list, ["id", "date", "organization"]),
+            persons=columns(rows, ["nid", "name", "points", "nr"]),
+            pos=pos,
+            points=points
+        )
+    return json_response(render, "api_overview", mf)
+
+
+@api.route('/race/<race_id>/results')
+@conditional
+def race_results(race_id):
+    """
+    This method returns the finishers of a race in sequence of arrival.
+
+    :param race_id: nid of the race.
+    :return: Columns nid (person), name, pos, points and rel_pos.
+    """
+    def render():
+        if not mg.ns.node(race_id, lbl_race):
+            abort(404)
+        race = mg.Race(race_id=race_id)
+        rows = [dict(nid=person["nid"], name=person["label"], pos=part.get("pos"), points=part.get("points"),
+                     rel_pos=part.get("rel_pos"))
+                for (person, part) in race.part_person_seq_list()]
+        return dict(race_id=race_id, race=race.get_label(),
+                    results=columns(rows, ["nid", "name", "pos", "points", "rel_pos"]))
+    return json_response(render, "api_race_results", race_id)
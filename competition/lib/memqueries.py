@@ -0,0 +1,497 @@
+"""
+This module has the queries of the application for the in-memory store. Every function has the name of the query in
+models_graph and returns the same result as the Cypher query: a list of dictionaries with the keys of the RETURN
+clause. The functions walk the graph with the adjacency lists of the store. Statements that modify the graph set the
+properties on the nodes with the set_props method of the store, the store records the change.
+"""
+
+from competition.lib.neostructure import *
+
+# Query functions by name of the query in models_graph, see the query decorator.
+queries = {}
+
+
+def query(func):
+    """
+    This decorator registers the function as the in-memory version of the query with the name of the function. Helper
+    functions are not registered, so a query name that is not in models_graph cannot be called by accident.
+
+    :param func: Function with parameters store and the parameters of the query.
+    :return: The function.
+    """
+    queries[func.__name__] = func
+    return func
+
+
+def nodes(store, label):
+    """
+    This function returns all nodes with label.
+
+    :param store: MemStore object.
+    :param label: Label of the nodes.
+    :return: List of nodes, empty list if there are no nodes.
+    """
+    return store.get_nodes(label) or []
+
+
+def ends(store, node, rel_type, label=None):
+    """
+    This function returns the end nodes of the relations of type rel_type from node, (node)-[:rel_type]->(end).
+
+    :param store: MemStore object.
+    :param node: Start node.
+    :param rel_type: Relation type.
+    :param label: Label of the end nodes, or None for any label.
+    :return: List of end nodes.
+    """
+    return [end for end in store.adjacent(node["nid"], rel_type, "end") if not label or end.has_label(label)]
+
+
+def starts(store, node, rel_type, label=None):
+    """
+    This function returns the start nodes of the relations of type rel_type to node, (start)-[:rel_type]->(node).
+
+    :param store: MemStore object.
+    :param node: End node.
+    :param rel_type: Relation type.
+    :param label: Label of the start nodes, or None for any label.
+    :return: List of start nodes.
+    """
+    return [start for start in store.adjacent(node["nid"], rel_type, "start") if not label or start.has_label(label)]
+
+
+def first(node_list):
+    """
+    This function returns the first node of the list, as for an OPTIONAL MATCH on a single node.
+
+    :param node_list: List of nodes.
+    :return: First node, or None if the list is empty.
+    """
+    return node_list[0] if node_list else None
+
+
+def null_last(value):
+    """
+    This function returns the sort key for ORDER BY: null values are sorted after all other values.
+
+    :param value: Property value, or None.
+    :return: Sort key.
+    """
+    return value is None, value
+
+
+def race_parts(store, race_id):
+    """
+    This function returns the participant nodes of the race.
+
+    :param store: MemStore object.
+    :param race_id: nid of the race.
+    :return: List of participant nodes, empty list if the race does not exist.
+    """
+    race = store.node(race_id, lbl_race)
+    if not race:
+        return []
+    return starts(store, race, participant2race, lbl_participant)
+
+
+@query
+def race_seq_parts(store, race_id):
+    """
+    Participants of the race that have a seq property, in sequence of arrival.
+    """
+    parts = [part for part in race_parts(store, race_id) if part["seq"] is not None]
+    return [dict(part=part) for part in sorted(parts, key=lambda part: part["seq"])]
+
+
+@query
+def race_person_nids(store, race_id):
+    """
+    Nids of the persons that participate in the race.
+    """
+    return [dict(nid=person["nid"])
+            for part in race_parts(store, race_id) for person in starts(store, part, person2participant)]
+
+
+@query
+def race_finishers(store, race_id):
+    """
+    Persons and participants of the race in sequence of arrival.
+    """
+    return [dict(nid=person["nid"], label=person["name"], part=rec["part"])
+            for rec in race_seq_parts(store, race_id) for person in starts(store, rec["part"], person2participant)]
+
+
+@query
+def race_set_seq(store, race_id, person_nids):
+    """
+    Set the sequence of arrival from the list of person nids.
+    """
+    seq4person = {nid: idx + 1 for idx, nid in enumerate(person_nids)}
+    for part in race_parts(store, race_id):
+        for person in starts(store, part, person2participant, lbl_person):
+            if person["nid"] in seq4person:
+                store.set_props(part, seq=seq4person[person["nid"]])
+    return []
+
+
+@query
+def race_mf_count(store, race_nid, cat):
+    """
+    Number of participants in the race for mf cat.
+    """
+    cnt = len([person for part in race_parts(store, race_nid)
+               for person in starts(store, part, person2participant, lbl_person)
+               for mf in ends(store, person, person2mf, lbl_mf) if mf["name"] == cat])
+    return [dict(cnt=cnt)]
+
+
+@query
+def participant_insert(store, race_id, part_id, seq):
+    """
+    Insert the participant at position seq, the participants from that position on move one position down.
+    """
+    for part in race_parts(store, race_id):
+        if part["nid"] == part_id:
+            store.set_props(part, seq=seq)
+        elif part["seq"] is not None and part["seq"] >= seq:
+            store.set_props(part, seq=part["seq"] + 1)
+    return []
+
+
+@query
+def participant_remove_seq(store, race_id, seq):
+    """
+    The participants after position seq move one position up.
+    """
+    for part in race_parts(store, race_id):
+        if part["seq"] is not None and part["seq"] > seq:
+            store.set_props(part, seq=part["seq"] - 1)
+    return []
+
+
+@query
+def participant_swap(store, race_id, seq, new_seq):
+    """
+    Swap the participants on positions seq and new_seq, if both positions exist.
+    """
+    parts = [part for part in race_parts(store, race_id) if part["seq"] in [seq, new_seq]]
+    if len(parts) != 2:
+        return []
+    for part in parts:
+        store.set_props(part, seq=new_seq if part["seq"] == seq else seq)
+    return [dict(cnt=2)]
+
+
+@query
+def participant_at(store, race_id, seq):
+    """
+    Participant on position seq in the race.
+    """
+    return [dict(nid=part["nid"]) for part in race_parts(store, race_id) if part["seq"] == seq]
+
+
+@query
+def participant_node(store, pers_id, race_id):
+    """
+    Participant node for the person in the race.
+    """
+    person = store.node(pers_id, lbl_person)
+    if not person:
+        return []
+    return [dict(part=part) for part in ends(store, person, person2participant, lbl_participant)
+            if race_id in [race["nid"] for race in ends(store, part, participant2race, lbl_race)]]
+
+
+@query
+def participant_load(store, part_id):
+    """
+    Participant with person, mf, race, race type, organization and organization type.
+    """
+    part = store.node(part_id, lbl_participant)
+    if not part:
+        return []
+    res = []
+    for person in starts(store, part, person2participant, lbl_person):
+        for race in ends(store, part, participant2race, lbl_race):
+            for org in starts(store, race, organization2race, lbl_organization):
+                res.append(dict(part=part, person=person, mf=first(ends(store, person, person2mf, lbl_mf)),
+                                race=race, rt=first(ends(store, race, race2type, lbl_raceType)),
+                                org=org, ot=first(ends(store, org, organization2type, lbl_organizationType))))
+    return res
+
+
+@query
+def person_races(store, pers_id):
+    """
+    Participations of the person with race, date, organization, organization type and location, in date sequence.
+    """
+    person = store.node(pers_id, lbl_person)
+    if not person:
+        return []
+    res = []
+    for part in ends(store, person, person2participant, lbl_participant):
+        for race in ends(store, part, participant2race, lbl_race):
+            for org in starts(store, race, organization2race, lbl_organization):
+                for day in ends(store, org, organization2date, lbl_day):
+                    for orgtype in ends(store, org, organization2type):
+                        for loc in ends(store, org, organization2location, lbl_location):
+                            res.append(dict(race=race, part=part, day=day, org=org, orgtype=orgtype, loc=loc))
+    return sorted(res, key=lambda rec: rec["day"]["key"])
+
+
+def org_races(store, org_id):
+    """
+    This function returns the race nodes of the organization.
+
+    :param store: MemStore object.
+    :param org_id: nid of the organization.
+    :return: List of race nodes, empty list if the organization does not exist.
+    """
+    org = store.node(org_id, lbl_organization)
+    if not org:
+        return []
+    return ends(store, org, organization2race, lbl_race)
+
+
+@query
+def org_participants(store, org_id):
+    """
+    Persons that participate in a race of the organization.
+    """
+    return [dict(p=person) for race in org_races(store, org_id)
+            for part in starts(store, race, participant2race, lbl_participant)
+            for person in starts(store, part, person2participant, lbl_person)]
+
+
+@query
+def race_main(store, nid, def_hoofd):
+    """
+    Main race of the organization.
+    """
+    return [dict(race=race) for race in org_races(store, nid)
+            for rt in ends(store, race, race2type, lbl_raceType) if rt["name"] == def_hoofd]
+
+
+@query
+def race_types(store, nid):
+    """
+    Races of the organization with the race type.
+    """
+    return [dict(race=race, rt=rt)
+            for race in org_races(store, nid) for rt in ends(store, race, race2type, lbl_raceType)]
+
+
+@query
+def race_list(store, org_id):
+    """
+    Races of the organization with the race type (None if not set), sorted on race type then race name.
+    """
+    res = [dict(race=race, type=first(ends(store, race, race2type, lbl_raceType))) for race in org_races(store, org_id)]
+    return sorted(res, key=lambda rec: (null_last(rec["type"]["name"] if rec["type"] else None),
+                                        null_last(rec["race"]["name"])))
+
+
+@query
+def persons_available(store, org_nid, prefix, limit):
+    """
+    Persons with a lower case name starting with prefix that do not participate in a race of the organization yet.
+    """
+    if not store.node(org_nid, lbl_organization):
+        return []
+    done = set(rec["p"]["nid"] for rec in org_participants(store, org_nid))
+    persons = [person for person in nodes(store, lbl_person)
+               if person["name_lc"] is not None and person["name_lc"].startswith(prefix) and person["nid"] not in done]
+    persons = sorted(persons, key=lambda person: null_last(person["name"]))[:limit]
+    return [dict(nid=person["nid"], name=person["name"]) for person in persons]
+
+
+@query
+def organization_list(store):
+    """
+    Organizations with date, location and organization type, sorted on date and nid.
+    """
+    res = [dict(date=day["key"], organization=org["name"], city=loc["city"], id=org["nid"], type=ot["name"])
+           for org in nodes(store, lbl_organization)
+           for day in ends(store, org, organization2date, lbl_day)
+           for loc in ends(store, org, organization2location, lbl_location)
+           for ot in ends(store, org, organization2type, lbl_organizationType)]
+    return sorted(res, key=lambda rec: (rec["date"], rec["id"]))
+
+
+@query
+def organization_page(store, start, end, after_date, after_id, limit):
+    """
+    Page of the organization list in the date window, after the organization with after_date and after_id.
+    """
+    res = organization_list(store)
+    if start:
+        res = [rec for rec in res if rec["date"] >= start]
+    if end:
+        res = [rec for rec in res if rec["date"] <= end]
+    if after_date:
+        res = [rec for rec in res if (rec["date"], rec["id"]) > (after_date, after_id)]
+    return res[:limit]
+
+
+@query
+def arrival_chains(store):
+    """
+    Participants of every (participant)-[:after]->(participant) chain, from the first arrival to the last arrival.
+    """
+    res = []
+    for first_part in nodes(store, lbl_participant):
+        if ends(store, first_part, participant2participant) or not starts(store, first_part, participant2participant):
+            continue
+        if not ends(store, first_part, participant2race, lbl_race):
+            continue
+        parts = [first_part]
+        after = starts(store, first_part, participant2participant)
+        while after and after[0] not in parts:
+            parts.append(after[0])
+            after = starts(store, after[0], participant2participant)
+        res.append(dict(parts=parts))
+    return res
+
+
+@query
+def arrival_single(store):
+    """
+    Participants without seq that are the only participant in the race.
+    """
+    res = []
+    for race in nodes(store, lbl_race):
+        parts = starts(store, race, participant2race, lbl_participant)
+        if len(parts) == 1 and parts[0]["seq"] is None:
+            res.append(dict(nid=parts[0]["nid"]))
+    return res
+
+
+@query
+def arrival_chains_remove(store):
+    """
+    Remove all (participant)-[:after]->(participant) relations.
+    """
+    for part in nodes(store, lbl_participant):
+        for prev_part in ends(store, part, participant2participant, lbl_participant):
+            store.remove_relation(start_node=part, end_node=prev_part, rel_type=participant2participant)
+    return []
+
+
+@query
+def persons_without_name_lc(store):
+    """
+    Persons that do not have a lower case name.
+    """
+    return [dict(nid=person["nid"], name=person["name"]) for person in nodes(store, lbl_person)
+            if person["name_lc"] is None]
+
+
+@query
+def season_matrix(store, mf):
+    """
+    Race and participant for every participation of the persons in mf.
+    """
+    return [dict(person_nid=person["nid"], org_nid=org["nid"], race=race, part=part)
+            for mf_node in store.get_nodes(lbl_mf, name=mf) or []
+            for person in starts(store, mf_node, person2mf, lbl_person)
+            for part in ends(store, person, person2participant, lbl_participant)
+            for race in ends(store, part, participant2race, lbl_race)
+            for org in starts(store, race, organization2race, lbl_organization)]
+
+
+@query
+def person_list(store):
+    """
+    Persons with mf and number of races, sorted on mf and name.
+    """
+    res = [dict(nid=person["nid"], name=person["name"], mf=mf["name"],
+                races=len([race for part in ends(store, person, person2participant, lbl_participant)
+                           for race in ends(store, part, participant2race, lbl_race)]))
+           for person in nodes(store, lbl_person)
+           for mf in ends(store, person, person2mf, lbl_mf)]
+    return sorted(res, key=lambda rec: (null_last(rec["mf"]), null_last(rec["name"])))
+
+
+@query
+def person_page(store, after_mf, after_name, limit):
+    """
+    Page of the person list, after the person with after_mf and after_name.
+    """
+    res = person_list(store)
+    if after_mf:
+        res = [rec for rec in res if (rec["mf"], rec["name"]) > (after_mf, after_name)]
+    return res[:limit]
+
+
+@query
+def location_list(store):
+    """
+    Locations sorted on city.
+    """
+    return [dict(n=loc) for loc in sorted(nodes(store, lbl_location), key=lambda loc: null_last(loc["city"]))]
+
+
+@query
+def results_for_mf(store, mf):
+    """
+    Standings of the persons in mf with at least one race, sorted on points.
+    """
+    res = [dict(name=person["name"], points=person["points"], nr=person["nr"], nid=person["nid"])
+           for mf_node in store.get_nodes(lbl_mf, name=mf) or []
+           for person in starts(store, mf_node, person2mf, lbl_person)
+           if person["nr"] is not None and person["nr"] > 0]
+    return sorted(res, key=lambda rec: rec["points"] or 0, reverse=True)
+
+
+@query
+def standings_points(store, nids):
+    """
+    Points of the participations for every person, per organization type.
+    """
+    res = []
+    for nid in nids:
+        person = store.node(nid, lbl_person)
+        if not person:
+            continue
+        points4type = {}
+        for part in ends(store, person, person2participant, lbl_participant):
+            for race in ends(store, part, participant2race, lbl_race):
+                for org in starts(store, race, organization2race, lbl_organization):
+                    for orgtype in ends(store, org, organization2type, lbl_organizationType):
+                        points4type.setdefault(orgtype["name"], []).append(part["points"] or 0)
+        if points4type:
+            res += [dict(nid=nid, orgtype=orgtype, points=points) for orgtype, points in points4type.items()]
+        else:
+            # As the OPTIONAL MATCH without a match.
+            res.append(dict(nid=nid, orgtype=None, points=[0]))
+    return res
+
+
+@query
+def person_nids(store):
+    """
+    Nids of all persons.
+    """
+    return [dict(nid=person["nid"]) for person in nodes(store, lbl_person)]
+
+
+@query
+def persons_without_standings(store):
+    """
+    Nids of the persons that do not have standings.
+    """
+    return [dict(nid=person["nid"]) for person in nodes(store, lbl_person) if person["nr"] is None]
+
+
+@query
+def participation_points(store, mf, orgtype):
+    """
+    Points of every participation of the persons in mf for organizations of type orgtype.
+    """
+    return [dict(person_nid=person["nid"], points=part["points"])
+            for mf_node in store.get_nodes(lbl_mf, name=mf) or []
+            for person in starts(store, mf_node, person2mf, lbl_person)
+            for part in ends(store, person, person2participant)
+            for race in ends(store, part, participant2race, lbl_race)
+            for org in starts(store, race, organization2race, lbl_organization)
+            for ot in ends(store, org, organization2type, lbl_organizationType) if ot["name"] == orgtype]
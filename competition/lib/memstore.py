@@ -0,0 +1,590 @@
+"""
+This class implements the NeoStore interface on an in-memory graph. It does not need a Neo4J server, so tests and
+benchmarks can run without an external service. Select it with NEO4J_BACKEND=memory in the environment.
+
+Nodes are py2neo Node objects, so model code that checks on isinstance(node, Node) works unchanged. Cypher queries
+cannot run on the in-memory graph. The application queries go through model_query, model_iter and model_update, these
+run the function with the name of the query from module memqueries.
+"""
+
+import threading
+import time
+import uuid
+from competition.lib import memqueries
+from competition.lib.neostore import NeoStore, cypher_name, node_labels
+from competition.lib.neostructure import *
+from contextlib import contextmanager
+from flask import current_app
+from py2neo import Node
+
+
+class MemStore(NeoStore):
+
+    def __init__(self):
+        """
+        Method to instantiate the class in an object for the in-memory store.
+
+        :return: Object to handle neostore commands.
+        """
+        # Dictionary with key nid and value node.
+        self.nodes = {}
+        # Set of relations, each relation is a tuple (start nid, relation type, end nid).
+        self.rels = set()
+        # Adjacency lists, built from the relations when required. Key is (direction, nid), value is a list of
+        # (relation type, nid of the node on the other end). Set to None when the relations change.
+        self.adjacency = None
+        # Graph version, version for every label and the change feed.
+        self.version = 0
+        self.versions = {}
+        self.changes = []
+        self.ts = 0
+        self.change_count = 0
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        return
+
+    def adjacent(self, nid, rel_type=None, direction="end"):
+        """
+        This method returns the nodes on the other end of the relations of the node, from the adjacency lists.
+
+        :param nid: nid of the node.
+        :param rel_type: Relation type, or None for any relation type.
+        :param direction: 'end' for the end nodes of relations from the node, 'start' for the start nodes of relations
+        to the node.
+        :return: List of nodes, without duplicates.
+        """
+        with self.lock:
+            if self.adjacency is None:
+                adjacency = {}
+                for (sn, rel, en) in self.rels:
+                    adjacency.setdefault(("end", sn), []).append((rel, en))
+                    adjacency.setdefault(("start", en), []).append((rel, sn))
+                self.adjacency = adjacency
+            neighbours = self.adjacency.get((direction, nid), [])
+        nids = {other for (rel, other) in neighbours if not rel_type or rel == rel_type}
+        return [self.nodes[other] for other in nids]
+
+    def changes_since(self, version):
+        """
+        This method returns the change feed: all changes after version, in order of version.
+
+        :param version: Graph version, as returned by graph_version.
+        :return: List of dictionaries with keys version, labels (list of labels) and nids (list of nids).
+        """
+        return [change for change in self.changes if change["version"] > version]
+
+    def create_constraint(self, label, prop):
+        """
+        There is no schema in the in-memory store. Uniqueness of the key properties is handled by get_or_create.
+        """
+        return
+
+    def create_index(self, label, prop):
+        """
+        There is no schema in the in-memory store.
+        """
+        return
+
+    def create_node(self, *labels, **props):
+        """
+        Function to create node. The function will return the node object. Note that a 'nid' attribute will be added to
+        the node. This is a UUID4 unique identifier.
+
+        :param labels: Labels for the node
+        :param props: Value dictionary with values for the node.
+        :return: Node that has been created.
+        """
+        props['nid'] = str(uuid.uuid4())
+        component = Node(*labels, **props)
+        self.nodes[props['nid']] = component
+        self.log_undo(lambda nid=props['nid']: self.nodes.pop(nid, None))
+        self.modified(labels, [props['nid']])
+        return component
+
+    def create_relation(self, from_node=None, rel=None, to_node=None):
+        """
+        Function to create relationship between nodes. As for the Neo4J store the relation is merged, so it is created
+        only once.
+
+        :param from_node: Start node for the relation
+        :param rel: Relation type
+        :param to_node: End node for the relation
+        :return:
+        """
+        rel = (from_node["nid"], cypher_name(rel), to_node["nid"])
+        with self.lock:
+            if rel not in self.rels:
+                self.rels.add(rel)
+                self.log_undo(lambda: self.rels.discard(rel))
+            self.adjacency = None
+        self.modified(node_labels(from_node) + node_labels(to_node), [from_node["nid"], to_node["nid"]])
+        return
+
+    def flush_changes(self, labels, nids):
+        """
+        This method increments the version of the graph and the version of the labels, and adds the change to the
+        change feed.
+
+        :param labels: Set of labels of the nodes that have been changed.
+        :param nids: Set of nids of the nodes that have been changed.
+        :return: The new version of the graph.
+        """
+        with self.lock:
+            self.version += 1
+            self.ts = int(time.time() * 1000)
+            for label in labels:
+                self.versions[label] = self.version
+            self.changes.append(dict(version=self.version, labels=sorted(labels), nids=sorted(nids)))
+        return self.version
+
+    def get_endnodes(self, start_node=None, rel_type=None):
+        """
+        This method will calculate all end nodes from a start Node and a relation type. If relation type is not
+        specified then any relation type will do.
+
+        :param start_node: Start node.
+        :param rel_type: Relation type
+        :return: List with End Nodes.
+        """
+        if not isinstance(start_node, Node):
+            current_app.logger.error("Attribute not type Node (instead type {t})".format(t=type(start_node)))
+            return False
+        return self.adjacent(start_node["nid"], rel_type, "end")
+
+    def get_node(self, *labels, **props):
+        """
+        This method will select a single (or first) node that have labels and properties
+
+        :param labels: List of labels that are required for node match.
+        :param props: Property dictionary required to match.
+        :return: node that fulfills the criteria, or False if there is no node
+        """
+        nodes = self.get_nodes(*labels, **props)
+        if not isinstance(nodes, list):
+            return False
+        return nodes[0]
+
+    def get_endnodes_many(self, nids, rel_type=None, label=None):
+        """
+        This method is the batch version of get_endnodes.
+
+        :param nids: List of nids of the start nodes.
+        :param rel_type: Relation type
+        :param label: Label of the start nodes.
+        :return: Dictionary with key start node nid and value list of end nodes.
+        """
+        return {nid: self.get_endnodes(self.node(nid, label), rel_type) or [] for nid in nids}
+
+    def get_nodes(self, *labels, **props):
+        """
+        This method will select all nodes that have labels and properties
+
+        :param labels: List of labels that are required for node match
+        :param props: Property dictionary required to match.
+        :return: list of nodes that fulfill the criteria, or False if no nodes are found.
+        """
+        nodelist = [node for node in self.nodes.values()
+                    if all(node.has_label(lbl) for lbl in labels)
+                    and all(node[key] == value for key, value in props.items())]
+        if len(nodelist) == 0:
+            # No nodes found that fulfil the criteria
+            return False
+        else:
+            return nodelist
+
+    def get_nodes_no_nid(self):
+        """
+        Nodes in the in-memory store always have a nid.
+
+        :return: count of number of nodes that have been updated.
+        """
+        return 0
+
+    def get_nr_relations(self):
+        """
+        This method will return the number of relations. As for Neo4J store, the relations are counted in both
+        directions.
+
+        :return: Number of relations in the graph.
+        """
+        return 2 * len(self.rels)
+
+    def graph_state(self):
+        """
+        This method returns the version of the graph and the time of the last change.
+
+        :return: Dictionary with keys version and ts (milliseconds since epoch).
+        """
+        return dict(version=self.version, ts=self.ts)
+
+    def graph_version(self, label=None):
+        """
+        This method returns the version of the graph, or the version of a label.
+
+        :param label: Label, or None for the version of the graph.
+        :return: Version, 0 if there have been no changes.
+        """
+        if label:
+            return max(self.versions.get(label, 0), self.versions.get(def_any_label, 0))
+        return self.version
+
+    def get_startnodes(self, end_node=None, rel_type=None):
+        """
+        This method will calculate all start nodes from an end Node and a relation type. If relation type is not
+        specified then any relation type will do.
+
+        :param end_node: The end node.
+        :param rel_type: Relation type
+        :return: List with start nodes, or False.
+        """
+        if not isinstance(end_node, Node):
+            current_app.logger.error("Attribute not type Node (instead type {t})".format(t=type(end_node)))
+            return False
+        return self.adjacent(end_node["nid"], rel_type, "start")
+
+    def get_startnodes_many(self, nids, rel_type=None, label=None):
+        """
+        This method is the batch version of get_startnodes.
+
+        :param nids: List of nids of the end nodes.
+        :param rel_type: Relation type
+        :param label: Label of the end nodes.
+        :return: Dictionary with key end node nid and value list of start nodes.
+        """
+        return {nid: self.get_startnodes(self.node(nid, label), rel_type) or [] for nid in nids}
+
+    def log_undo(self, action):
+        """
+        This method keeps the action that reverts a change, if a transaction is open for this thread. The actions are
+        run in reverse order when the transaction fails.
+
+        :param action: Function without parameters that reverts the change.
+        :return:
+        """
+        undo = getattr(self.local, "undo", None)
+        if undo is not None:
+            undo.append(action)
+        return
+
+    def merge_node(self, label, key_props, extra_props=None):
+        """
+        This method will return the node with label and key properties, and if the node has been created. If the node
+        does not exist, then it is created with the key properties and the extra properties.
+
+        :param label: Label of the node.
+        :param key_props: Property dictionary that identifies the node.
+        :param extra_props: Property dictionary that is set on the node only if the node is created.
+        :return: Tuple with the node that has been found or created, and True if the node has been created.
+        """
+        with self.lock:
+            node = self.get_node(label, **key_props)
+            if isinstance(node, Node):
+                return node, False
+            props = dict(extra_props or {})
+            props.update(key_props)
+            return self.create_node(label, **props), True
+
+    def model_iter(self, query_name, query, batch_size=1000, **kwargs):
+        """
+        This method runs query query_name from module memqueries and returns a generator over the result, in lists of
+        at most batch_size records.
+
+        :param query_name: Name of the query in module memqueries.
+        :param query: Cypher Query, not used.
+        :param batch_size: Maximum number of records in a batch.
+        :param kwargs: Optional Keyword parameters for the query.
+        :return: Generator of lists of dictionaries.
+        """
+        res = self.model_query(query_name, query, **kwargs)
+        for pos in range(0, len(res), batch_size):
+            yield res[pos:pos + batch_size]
+
+    def model_query(self, query_name, query, **kwargs):
+        """
+        This method runs query query_name from module memqueries. The query is recorded in the statistics of the
+        request, as for the Neo4J store.
+
+        :param query_name: Name of the query in module memqueries.
+        :param query: Cypher Query, not used.
+        :param kwargs: Optional Keyword parameters for the query.
+        :return: Result of the query as a list of dictionaries.
+        """
+        try:
+            query_func = memqueries.queries[query_name]
+        except KeyError:
+            current_app.logger.fatal("No in-memory version for query {q}".format(q=query_name))
+            raise ValueError("UnknownQuery")
+        start = time.perf_counter()
+        res = query_func(self, **kwargs)
+        self.record_query(query, time.perf_counter() - start, len(res))
+        return res
+
+    def model_update(self, query_name, query, **kwargs):
+        """
+        This method runs statement query_name from module memqueries and records the change.
+
+        :param query_name: Name of the statement in module memqueries.
+        :param query: Cypher statement, not used.
+        :param kwargs: Optional Keyword parameters for the statement.
+        :return: Result of the statement as a list of dictionaries.
+        """
+        res = self.model_query(query_name, query, **kwargs)
+        self.modified(None, [])
+        return res
+
+    def node(self, nid, label=None):
+        """
+        This method will get a node ID and return a node.
+
+        :param nid: ID of the node to be found.
+        :param label: Label of the node.
+        :return: Node, or None in case the node could not be found.
+        """
+        node = self.nodes.get(nid)
+        if label and isinstance(node, Node) and not node.has_label(label):
+            return None
+        return node
+
+    def node_cache(self):
+        """
+        Lookups are in memory already, so there is no node cache.
+
+        :return: Empty dictionary.
+        """
+        return {}
+
+    def node_set_attribs(self, label=None, **properties):
+        """
+        This method will set specified properties on the node. Modified properties will be updated and new properties
+        will be added. Properties not in the dictionary will be left unchanged.
+
+        :param label: Label of the node.
+        :param properties: Dictionary of the property set for the node. 'nid' property is mandatory.
+        :return: True if successful update, False otherwise.
+        """
+        try:
+            my_node = self.node(properties["nid"], label)
+        except KeyError:
+            current_app.logger.error("Attribute 'nid' missing, required in dictionary.")
+            return False
+        if isinstance(my_node, Node):
+            self.set_props(my_node, **properties)
+            self.modified(node_labels(my_node), [my_node["nid"]])
+            return True
+        else:
+            current_app.logger.error("No node found for NID {nid}".format(nid=properties["nid"]))
+            return False
+
+    def nodes_set_attribs(self, rows, label=None):
+        """
+        This method is the bulk version of node_set_attribs.
+
+        :param rows: List of property dictionaries. 'nid' property is mandatory in each dictionary.
+        :param label: Label of the nodes.
+        :return: Number of nodes that have been updated.
+        """
+        cnt = 0
+        for row in rows:
+            my_node = self.node(row["nid"], label)
+            if isinstance(my_node, Node):
+                self.node_set_attribs(**row)
+                cnt += 1
+        if cnt != len(rows):
+            current_app.logger.error("Expected to update {r} nodes, but {c} nodes updated.".format(r=len(rows), c=cnt))
+        return cnt
+
+    def node_update(self, label=None, **properties):
+        """
+        This method will update the node's properties with the properties specified. Modified properties will be
+        updated, new properties will be added and removed properties will be deleted.
+
+        :param label: Label of the node.
+        :param properties: Dictionary of the property set for the node. 'nid' property is mandatory.
+        :return: Updated node if successful, False otherwise.
+        """
+        try:
+            my_node = self.node(properties["nid"], label)
+        except KeyError:
+            current_app.logger.error("Attribute 'nid' missing, required in dictionary.")
+            return False
+        if isinstance(my_node, Node):
+            self.set_props(my_node, **{prop: None for prop in my_node if prop not in properties})
+            self.set_props(my_node, **properties)
+            self.modified(node_labels(my_node), [my_node["nid"]])
+            return my_node
+        else:
+            current_app.logger.error("No node found for NID {nid}".format(nid=properties["nid"]))
+            return False
+
+    def pending_changes(self):
+        """
+        This method returns the changes of the open transaction of this thread. These are recorded when the transaction
+        is committed. Outside of a transaction a change does not need a statement, so it is recorded immediately.
+
+        :return: Dictionary with keys labels and nids (sets), or None if the change must be recorded immediately.
+        """
+        return getattr(self.local, "changes", None)
+
+    def prune_changes(self, keep):
+        """
+        This method removes old changes from the change feed.
+
+        :param keep: Number of most recent versions to keep in the change feed.
+        :return: Number of changes removed.
+        """
+        with self.lock:
+            cnt = len(self.changes)
+            self.changes = [change for change in self.changes if change["version"] > self.version - keep]
+        return cnt - len(self.changes)
+
+    def relations(self, nid, label=None):
+        """
+        This method will return the number of relations for the node.
+
+        :param nid: ID of the object to check relations
+        :param label: Label of the node, not used.
+        :return: Number of relations - if there are relations, False - there are no relations.
+        """
+        return len([rel for rel in self.rels if nid in (rel[0], rel[2])])
+
+    def remove_node(self, node):
+        """
+        This method will remove the node on condition that no relations are attached to the node.
+
+        :param node: Node to be removed.
+        :return: True if node is deleted, False otherwise
+        """
+        if not isinstance(node, Node):
+            current_app.logger.error("Node expected, but got type {t} Input: {n}".format(t=type(node), n=node))
+            return False
+        degree = self.relations(node["nid"])
+        if degree:
+            msg = "Request to delete node nid {node_id}, but {x} relations found. Node not deleted"\
+                .format(node_id=node["nid"], x=degree)
+            current_app.logger.warning(msg)
+            return False
+        else:
+            if self.nodes.pop(node["nid"], None) is not None:
+                self.log_undo(lambda nid=node["nid"]: self.nodes.__setitem__(nid, node))
+            self.modified(node_labels(node), [node["nid"]])
+            return True
+
+    def remove_node_force(self, nid, label=None):
+        """
+        This method will remove node with ID nid. The node and the relations to/from the node will also be deleted.
+
+        :param nid: nid of the node
+        :param label: Label of the node. The node is not removed if it does not have the label.
+        :return:
+        """
+        if label and not self.node(nid, label):
+            return
+        with self.lock:
+            removed = {rel for rel in self.rels if nid in (rel[0], rel[2])}
+            self.rels -= removed
+            self.adjacency = None
+        node = self.nodes.pop(nid, None)
+        if node is not None:
+            self.log_undo(lambda: self.nodes.__setitem__(nid, node))
+        self.log_undo(lambda: self.rels.update(removed))
+        self.modified(node_labels(node), [nid])
+        return
+
+    def remove_orphan_nodes(self, label):
+        """
+        This method removes orphan nodes of a specific Type (Location, Date). Orphan nodes have no relation to other
+        nodes.
+
+        :param label: Label of the nodes to check.
+        :return: Number of nodes removed.
+        """
+        cnt = 0
+        for node in self.get_nodes(label) or []:
+            if self.remove_node(node):
+                cnt += 1
+        if cnt:
+            current_app.logger.info("Removed {cnt} orphan nodes type {lbl}".format(cnt=cnt, lbl=label))
+        return cnt
+
+    def remove_relation(self, start_node=None, end_node=None, rel_type=None):
+        """
+        This method will remove the relation rel_type between start_node and end_node where relation is type rel_type.
+
+        :param start_node:
+        :param end_node:
+        :param rel_type:
+        :return:
+        """
+        rel = (start_node["nid"], rel_type, end_node["nid"])
+        with self.lock:
+            if rel in self.rels:
+                self.rels.discard(rel)
+                self.log_undo(lambda: self.rels.add(rel))
+            self.adjacency = None
+        self.modified(node_labels(start_node) + node_labels(end_node), [start_node["nid"], end_node["nid"]])
+        return
+
+    @contextmanager
+    def transaction(self):
+        """
+        This method returns a context manager that runs the block as one transaction. The graph is locked for other
+        threads during the block. Every change in the block keeps the action to revert it (see log_undo), so the cost
+        of the transaction depends on the changes, not on the size of the graph. If the block raises an exception, then
+        the actions are run in reverse order. The changes are recorded in the version and the change feed when the
+        block ends without exception, so a failed transaction does not change the version. A nested call joins the
+        transaction that is already open.
+
+        :return: The store object.
+        """
+        if getattr(self.local, "undo", None) is not None:
+            yield self
+            return
+        with self.lock:
+            self.local.undo = []
+            self.local.changes = dict(labels=set(), nids=set())
+            try:
+                yield self
+                changes = self.local.changes
+                if changes["labels"] or changes["nids"]:
+                    self.flush_changes(changes["labels"], changes["nids"])
+            except Exception:
+                current_app.logger.error("Transaction failed, rolling back.")
+                for action in reversed(self.local.undo):
+                    action()
+                self.adjacency = None
+                raise
+            finally:
+                self.local.undo = None
+                self.local.changes = None
+
+    def set_props(self, node, **props):
+        """
+        This method sets the properties on the node. A property with value None is removed, as in Cypher. The change is
+        not recorded, the caller must call modified.
+
+        :param node: Node to update.
+        :param props: Dictionary of the properties to set.
+        :return:
+        """
+        old_props = dict(node)
+
+        def restore():
+            for prop in list(node):
+                del node[prop]
+            for prop in old_props:
+                node[prop] = old_props[prop]
+
+        self.log_undo(restore)
+        for prop in props:
+            if props[prop] is None:
+                if prop in node:
+                    del node[prop]
+            else:
+                node[prop] = props[prop]
+        return
+
+    def set_node_nid(self, node_id):
+        """
+        Nodes in the in-memory store always have a nid.
+        """
+        return
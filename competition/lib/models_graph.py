@@ -1,14 +1,17 @@
 import datetime
+import threading
+import time
 from collections import defaultdict
 from competition import lm
 from competition.lib import my_env, neostore
 from competition.lib.neostructure import *
+from config import Config
 from flask import current_app
 from flask_login import UserMixin
 from py2neo.data import Node
 from werkzeug.security import generate_password_hash, check_password_hash
 
-ns = neostore.NeoStore()
+ns = neostore.store_factory(Config.NEO4J_BACKEND)
 
 # mf_tx translates from man/vrouw (form value to Node name).
 mf_tx = dict(
@@ -21,6 +24,68 @@ mf_tx_inv = {y: x for x, y in mf_tx.items()}
 # Calculate points
 points_deelname = 20
 
+# Version of the graph structure. Increase the version when a step is added to upgrade_graph.
+schema_version = 1
+
+
+class ReferenceData:
+    """
+    The reference data class keeps the MF, OrgType and RaceType nodes in memory. These nodes are created by init_graph
+    and are never modified, so they are loaded once on first use and served from memory for all requests. Method
+    refresh reloads the nodes, it is called at the end of init_graph.
+    """
+    labels = [lbl_mf, lbl_organizationType, lbl_raceType]
+
+    def __init__(self):
+        # Dictionary with key (label, name) and value the node. None if not loaded.
+        self.nodes = None
+
+    def get(self, label, name):
+        """
+        This method returns the reference node for label and name.
+
+        :param label: lbl_mf, lbl_organizationType or lbl_raceType
+        :param name: Name of the reference node, e.g. Dames or Wedstrijd.
+        :return: Reference node, or False if the node does not exist.
+        """
+        if self.nodes is None:
+            self.refresh()
+        try:
+            return self.nodes[(label, name)]
+        except KeyError:
+            current_app.logger.error("No reference node {lbl} with name {n}".format(lbl=label, n=name))
+            return False
+
+    def get_nid(self, label, name):
+        """
+        This method returns the nid of the reference node for label and name.
+
+        :param label: lbl_mf, lbl_organizationType or lbl_raceType
+        :param name: Name of the reference node.
+        :return: nid of the reference node, or False if the node does not exist.
+        """
+        node = self.get(label, name)
+        if isinstance(node, Node):
+            return node["nid"]
+        return False
+
+    def refresh(self):
+        """
+        This method (re-)loads the reference nodes from the graph.
+
+        :return:
+        """
+        nodes = {}
+        for label in self.labels:
+            for node in ns.get_nodes(label) or []:
+                nodes[(label, node["name"])] = node
+        # Replace the dictionary at once, so that other threads never see a partial dictionary.
+        self.nodes = nodes
+        return
+
+
+refdata = ReferenceData()
+
 
 class User(UserMixin):
     """
@@ -29,7 +94,7 @@ class User(UserMixin):
     """
     def __init__(self, user_id=None):
         if user_id:
-            self.user_node = ns.node(user_id)
+            self.user_node = ns.node(user_id, "User")
         else:
             self.user_node = None
 
@@ -83,7 +148,7 @@ class User(UserMixin):
             nid=self.get_id(),
             pwd=generate_password_hash(password)
         )
-        ns.node_set_attribs(**props)
+        ns.node_set_attribs(label="User", **props)
         return
 
     def validate_password(self, name, pwd):
@@ -116,7 +181,7 @@ def load_user(user_id):
 class Participant:
 
     # List of calculated properties for the participant node.
-    calc_props = ["nid", "points", "rel_pos"]
+    calc_props = ["nid", "points", "rel_pos", "seq"]
 
     def __init__(self, part_id=None, race_id=None, person_id=None):
         """
@@ -135,11 +200,7 @@ class Participant:
         self.part_node = None
         if part_id:
             # I have a participant ID, find race and person information
-            self.part_node = ns.node(part_id)
-            race_node = ns.get_endnode(start_node=self.part_node, rel_type=participant2race)
-            self.race = Race(race_id=race_node["nid"])
-            person_node = ns.get_startnode(end_node=self.part_node, rel_type=person2participant)
-            self.person = Person(person_id=person_node["nid"])
+            self.load(part_id)
         elif person_id and race_id:
             self.race = Race(race_id=race_id)
             self.person = Person(person_id=person_id)
@@ -151,107 +212,142 @@ class Participant:
 
     def add(self, prev_person_id=None):
         """
-        This method will add the participant in the chain of arrivals.
-        If there is no previous person, then check for first arrival in race. If found, add first arrival with previous
-        runner this participant.
-        If there is previous person, check if there is next person. If so, remove link and add next person with previous
-        runner  this participant.
-        Create relation between previous person and this participant.
-        Note that I cannot use a race.part_person method, since the current participant is in an invalid state.
+        This method will add the participant in the sequence of arrivals. Arrival order is the seq property of the
+        participant nodes in the race (1 for the first arrival). The participant gets the position after the previous
+        person, all participants from that position on move one position down. This is done in a single statement.
+        Call the method in the transaction that creates the participant and calculates the points, so that a failure
+        does not leave a participant without position (see participant_add in the routes).
 
         :param prev_person_id: nid of previous arrival, or -1 if current participant is first arrival
         :return:
         """
-        if prev_person_id == '-1':
-            # First arrival - was there another first arrival that needs to become second?
-            next_person_id = self.race.part_person_first_id(excl_part_nid=self.get_nid())
-            if isinstance(next_person_id, str):
-                next_part = Participant(race_id=self.race.get_nid(), person_id=next_person_id)
-                next_part.add(prev_person_id=self.get_person_nid())
-        else:
-            prev_part = Participant(race_id=self.race.get_nid(), person_id=prev_person_id)
-            next_part_id = prev_part.next_runner()
-            # Is previous runner not last? Add current runner in-between.
-            if isinstance(next_part_id, str):
-                next_part = Participant(part_id=next_part_id)
-                next_part.remove()
-                next_part.add(prev_person_id=self.get_person_nid())
-            ns.create_relation(from_node=self.get_node(), rel=participant2participant, to_node=prev_part.get_node())
+        with ns.transaction():
+            if prev_person_id == '-1':
+                seq = 1
+            else:
+                prev_part = Participant(race_id=self.race.get_nid(), person_id=prev_person_id)
+                seq = prev_part.get_seq() + 1
+            query = """
+                MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part})
+                WHERE part.seq >= $seq OR part.nid = $part_id
+                SET part.seq = CASE WHEN part.nid = $part_id THEN $seq ELSE part.seq + 1 END
+            """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+            ns.model_update("participant_insert", query, race_id=self.race.get_nid(), part_id=self.get_nid(), seq=seq)
+        # Keep the participant node in line with the database, set_props will write all properties.
+        self.part_node["seq"] = seq
         return
 
-    def delete(self):
+    def load(self, part_id):
         """
-        This method will delete the participant node from the race. If there was a previous runner and a next runner,
-        then connect next runner (arrival) to previous runner.
-        Force remove the current participation node.
+        This method will set the participant node, the race object (with organization object) and the person object
+        from a single query. The person MF node, the race type and the organization type are loaded with it, so that
+        the points calculation does not need to query for these. These are optional, a missing link does not prevent
+        loading the participant.
 
-        :return:
+        :param part_id: nid of the participant
+        :return: (nothing, participant node, race object and person object are set.)
         """
-        prev_part_id = self.prev_runner()
-        next_part_id = self.next_runner()
-        ns.remove_node_force(self.get_nid())
-        if isinstance(prev_part_id, str) and isinstance(next_part_id, str):
-            prev_part = Participant(part_id=prev_part_id)
-            next_part = Participant(part_id=next_part_id)
-            next_part.add(prev_person_id=prev_part.get_person_nid())
+        query = """
+            MATCH (person:{lbl_person})-[:{person2part}]->(part:{lbl_part} {{nid: $part_id}})
+                  -[:{part2race}]->(race:{lbl_race})<-[:{org2race}]-(org:{lbl_org})
+            OPTIONAL MATCH (person)-[:{person2mf}]->(mf:{lbl_mf})
+            OPTIONAL MATCH (race)-[:{race2type}]->(rt:{lbl_rt})
+            OPTIONAL MATCH (org)-[:{org2type}]->(ot:{lbl_ot})
+            RETURN part, person, mf, race, rt, org, ot
+        """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_org=lbl_organization,
+                   lbl_mf=lbl_mf, lbl_rt=lbl_raceType, lbl_ot=lbl_organizationType,
+                   person2part=person2participant, part2race=participant2race, org2race=organization2race,
+                   person2mf=person2mf, race2type=race2type, org2type=organization2type)
+        res = ns.model_query("participant_load", query, part_id=part_id)
+        if len(res) == 0:
+            current_app.logger.fatal("Participant {nid} not found.".format(nid=part_id))
+            raise ValueError("CannotCreateObject")
+        rec = res[0]
+        self.part_node = rec["part"]
+        self.person = Person()
+        self.person.person_node = rec["person"]
+        self.person.mf_node = rec["mf"]
+        org = Organization()
+        org.org_node = rec["org"]
+        org.org_type = type_name(rec["ot"])
+        self.race = Race()
+        self.race.race_node = rec["race"]
+        self.race.org = org
+        self.race.race_type = type_name(rec["rt"])
         return
 
-    def remove(self):
+    def delete(self):
         """
-        This method breaks the connection between the participant and the previous runner. It is an method that should
-        only be called when a previous runner can be removed.
+        This method will delete the participant node from the race. All participants that arrived later move one
+        position up.
+        Force remove the current participation node.
 
         :return:
         """
-        prev_part_id = self.prev_runner()
-        prev_part = Participant(part_id=prev_part_id)
-        ns.remove_relation(start_node=self.get_node(), rel_type=participant2participant, end_node=prev_part.get_node())
+        with ns.transaction():
+            seq = self.get_seq()
+            ns.remove_node_force(self.get_nid(), lbl_participant)
+            standings_update([self.get_person_nid()])
+            if seq:
+                query = """
+                    MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part})
+                    WHERE part.seq > $seq
+                    SET part.seq = part.seq - 1
+                """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+                ns.model_update("participant_remove_seq", query, race_id=self.race.get_nid(), seq=seq)
         return
 
     def down(self):
         """
         This method will move the runner one position down in the race. Participant P start position:
-        A<--P<--B<--C, end position A<--B<--P<--C.
+        A, P, B, C, end position A, B, P, C.
         A and C are optional, B must exist.
-        Find B, call up for B.
 
         :return:
         """
-        next_part_nid = self.next_runner()
-        if not isinstance(next_part_nid, str):
+        if not self.move(1):
             current_app.logger.error("Method DOWN not possible because no next runner")
-            return
-        next_part = Participant(part_id=next_part_nid)
-        next_part.up()
         return
 
     def up(self):
         """
         This method will move the runner one position up in the race. Participant P start position:
-        A<--B<--P<--C, end position A<--P<--B<--C.
+        A, B, P, C, end position A, P, B, C.
         A and C are optional, B must exist.
 
         :return:
         """
-        prev_part_nid = self.prev_runner()
-        if not isinstance(prev_part_nid, str):
+        if not self.move(-1):
             current_app.logger.error("Method UP not possible because no previous runner")
-            return
-        prev_part = Participant(part_id=prev_part_nid)
-        prev2_part_nid = prev_part.prev_runner()
-        next_part_nid = self.next_runner()
-        self.remove()
-        if isinstance(next_part_nid, str):
-            next_part = Participant(part_id=next_part_nid)
-            next_part.remove()
-            next_part.add(prev_person_id=prev_part.get_person_nid())
-        if isinstance(prev2_part_nid, str):
-            prev_part.remove()
-            prev2_part = Participant(part_id=prev2_part_nid)
-            self.add(prev_person_id=prev2_part.get_person_nid())
-        prev_part.add(prev_person_id=self.get_person_nid())
         return
 
+    def move(self, offset):
+        """
+        This method swaps the position of the participant with the participant offset positions away, in a single
+        statement.
+
+        :param offset: -1 to swap with the previous runner, 1 to swap with the next runner.
+        :return: True if the positions are swapped, False if there is no runner to swap with.
+        """
+        seq = self.get_seq()
+        if not seq:
+            current_app.logger.error("Participant {nid} has no position in the race".format(nid=self.get_nid()))
+            return False
+        query = """
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part})
+            WHERE part.seq IN [$seq, $new_seq]
+            WITH collect(part) AS parts
+            WHERE size(parts) = 2
+            UNWIND parts AS part
+            SET part.seq = CASE WHEN part.seq = $seq THEN $new_seq ELSE $seq END
+            RETURN count(part) AS cnt
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+        res = ns.model_update("participant_swap", query, race_id=self.race.get_nid(), seq=seq, new_seq=seq + offset)
+        if len(res) > 0 and res[0]["cnt"] == 2:
+            self.part_node["seq"] = seq + offset
+            return True
+        return False
+
     def create_node(self):
         """
         This method will create a participant node and link it to the person and the race.
@@ -287,11 +383,12 @@ class Participant:
         :return: Participant node, or False if participant node does not exist.
         """
         query = """
-            MATCH (pers:Person)-[:is]->(part:Participant)-[:participates]->(race:Race)
-            WHERE pers.nid='{pers_id}' AND race.nid='{race_id}'
+            MATCH (pers:{lbl_person} {{nid: $pers_id}})-[:{person2part}]->(part:{lbl_part})
+                  -[:{part2race}]->(race:{lbl_race} {{nid: $race_id}})
             RETURN part
-        """.format(pers_id=self.person.get_nid(), race_id=self.race.get_nid())
-        res = ns.get_query_data(query)
+        """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race,
+                   person2part=person2participant, part2race=participant2race)
+        res = ns.model_query("participant_node", query, pers_id=self.person.get_nid(), race_id=self.race.get_nid())
         if len(res) > 1:
             current_app.logger.error("More than one ({nr}) Participant node for Person {pnid} and Race {rnid}"
                                      .format(pnid=self.person.get_nid(), rnid=self.race.get_nid(), nr=len(res)))
@@ -349,7 +446,15 @@ class Participant:
                 props[attrib] = part_dict[attrib]
             except KeyError:
                 pass
-        return ns.node_update(**props)
+        return ns.node_update(label=lbl_participant, **props)
+
+    def get_seq(self):
+        """
+        This method will return the position of arrival of the participant in the race.
+
+        :return: Position in sequence of arrival (1 for first arrival), or None if the participant has no position.
+        """
+        return self.part_node["seq"]
 
     def prev_runner(self):
         """
@@ -358,14 +463,7 @@ class Participant:
 
         :return: ID of previous runner participant Node, False if there is no previous runner.
         """
-        if not neostore.validate_node(self.part_node, "Participant"):       # pragma: no cover
-            current_app.logger.error("Participant node expected, got {t}".format(t=type(self.part_node)))
-            return False
-        prev_part = ns.get_endnode(start_node=self.part_node, rel_type=participant2participant)
-        if isinstance(prev_part, Node):
-            return prev_part["nid"]
-        else:
-            return False
+        return self.runner_at(-1)
 
     def next_runner(self):
         """
@@ -374,12 +472,28 @@ class Participant:
 
         :return: ID of next runner participant Node, False if there is no next runner.
         """
+        return self.runner_at(1)
+
+    def runner_at(self, offset):
+        """
+        This method will get the node ID for the runner offset positions away from this Participant.
+
+        :param offset: -1 for previous runner, 1 for next runner.
+        :return: ID of the participant Node, False if there is no such runner.
+        """
         if not neostore.validate_node(self.part_node, "Participant"):       # pragma: no cover
             current_app.logger.error("Participant node expected, got {t}".format(t=type(self.part_node)))
             return False
-        next_part = ns.get_startnode(end_node=self.part_node, rel_type=participant2participant)
-        if isinstance(next_part, Node):
-            return next_part["nid"]
+        seq = self.get_seq()
+        if not seq:
+            return False
+        query = """
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part} {{seq: $seq}})
+            RETURN part.nid AS nid
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+        res = ns.model_query("participant_at", query, race_id=self.race.get_nid(), seq=seq + offset)
+        if len(res) > 0:
+            return res[0]["nid"]
         else:
             return False
 
@@ -393,6 +507,8 @@ class Person:
     # Todo: add voornaam/familienaam
 
     def __init__(self, person_id=None):
+        # MF node, if it has been loaded with the person node.
+        self.mf_node = None
         if person_id:
             self.person_node = self.get_node(person_id)
         else:
@@ -410,7 +526,7 @@ class Person:
         props = {
             "name": name
         }
-        person_node = ns.get_node("Person", **props)
+        person_node = ns.get_node(lbl_person, **props)
         if isinstance(person_node, Node):
             return True
         else:
@@ -430,7 +546,8 @@ class Person:
         else:
             # Person not found, register participant.
             person_props = dict(
-                name=props["name"]
+                name=props["name"],
+                name_lc=props["name"].lower()
             )
             self.person_node = ns.create_node(lbl_person, **person_props)
             # Link to MF
@@ -455,6 +572,7 @@ class Person:
             else:
                 self.set_name(props["name"])
         link_mf(props["mf"], self.person_node, person2mf)
+        self.mf_node = None
         return True
 
     def get_name(self):
@@ -484,6 +602,8 @@ class Person:
 
         :return: mf node
         """
+        if self.mf_node:
+            return self.mf_node
         return ns.get_endnode(start_node=self.person_node, rel_type=person2mf)
 
     def get_mf_value(self):
@@ -492,7 +612,7 @@ class Person:
 
         :return: mf value (man/vrouw)
         """
-        return get_mf_value(node=self.person_node, rel=person2mf)
+        return mf_tx_inv[self.get_mf()["name"]]
 
     def get_node(self, person_id=None):
         """
@@ -503,7 +623,7 @@ class Person:
         :return: Person node.
         """
         if person_id:
-            self.person_node = ns.node(person_id)
+            self.person_node = ns.node(person_id, lbl_person)
         return self.person_node
 
     def active(self):
@@ -530,17 +650,18 @@ class Person:
         """
         race4person = []
         query = """
-            MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race),
-                  (race)<-[:has]-(org:Organization)-[:On]->(day:Day),
-                  (org)-[:type]->(orgtype),
-                  (org)-[:In]->(loc:Location)
-            WHERE person.nid='{pers_id}'
+            MATCH (person:{lbl_person} {{nid: $pers_id}})-[:{person2part}]->(part:{lbl_part})
+                  -[:{part2race}]->(race:{lbl_race}),
+                  (race)<-[:{org2race}]-(org:{lbl_org})-[:{org2date}]->(day:{lbl_day}),
+                  (org)-[:{org2type}]->(orgtype),
+                  (org)-[:{org2loc}]->(loc:{lbl_loc})
             RETURN race, part, day, org, orgtype, loc
             ORDER BY day.key ASC
-        """.format(pers_id=self.get_nid())
-        cursor = ns.get_query(query)
-        while cursor.forward():
-            rec = cursor.current
+        """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_org=lbl_organization,
+                   lbl_day=lbl_day, lbl_loc=lbl_location,
+                   person2part=person2participant, part2race=participant2race, org2race=organization2race,
+                   org2date=organization2date, org2type=organization2type, org2loc=organization2location)
+        for rec in ns.model_query("person_races", query, pers_id=self.get_nid()):
             res_dict = dict(part=dict(rec['part']),
                             race=dict(rec['race']),
                             date=dict(rec['day']),
@@ -559,7 +680,7 @@ class Person:
         if self.active():
             current_app.logger.warning("Cannot remove {name}, still active!".format(name=self.get_name()))
         else:
-            ns.remove_node_force(self.get_nid())
+            ns.remove_node_force(self.get_nid(), lbl_person)
         return
 
     def set_name(self, name):
@@ -575,9 +696,10 @@ class Person:
                                      .format(cn=cn, nn=name))
             return False
         else:
-            props = ns.node_props(self.person_node["nid"])
+            props = ns.node_props(self.person_node["nid"], lbl_person)
             props["name"] = name
-            ns.node_update(**props)
+            props["name_lc"] = name.lower()
+            ns.node_update(label=lbl_person, **props)
             return True
 
 
@@ -593,10 +715,12 @@ class Organization:
     """
     def __init__(self, org_id=None, race_id=None):
         self.org_node = None
+        # Organization type name, if it has been loaded with the organization node. None if not loaded.
+        self.org_type = None
         if org_id:
             self.org_node = self.get_node(org_id)
         if race_id:
-            race_node = self.get_node(race_id)
+            race_node = ns.node(race_id, lbl_race)
             self.org_node = ns.get_startnode(end_node=race_node, rel_type=organization2race)
 
     def add(self, **org_dict):
@@ -611,17 +735,18 @@ class Organization:
          org_type. Datestamp needs to be of the form 'YYYY-MM-DD'. if org_type True then deelname otherwise Wedstrijd.
         :return: True if the organization has been registered, False if it existed already.
         """
-        # Create the Organization node.
-        self.org_node = ns.create_node("Organization", name=org_dict["name"])
-        # Organization node known, now I can link it with the Location.
-        self.set_location(org_dict["location"])
-        # Set Date  for Organization
-        self.set_date(org_dict["datestamp"])
-        # Set Organization Type
-        if org_dict['org_type']:
-            self.set_type(def_deelname)
-        else:
-            self.set_type(def_wedstrijd)
+        with ns.transaction():
+            # Create the Organization node.
+            self.org_node = ns.create_node("Organization", name=org_dict["name"])
+            # Organization node known, now I can link it with the Location.
+            self.set_location(org_dict["location"])
+            # Set Date  for Organization
+            self.set_date(org_dict["datestamp"])
+            # Set Organization Type
+            if org_dict['org_type']:
+                self.set_type(def_deelname)
+            else:
+                self.set_type(def_wedstrijd)
         return True
 
     def edit(self, **properties):
@@ -653,9 +778,9 @@ class Organization:
         """
         # Check Organization name.
         if properties['name'] != self.get_name():
-            node_prop = ns.node_props(nid=self.get_nid())
+            node_prop = ns.node_props(nid=self.get_nid(), label=lbl_organization)
             node_prop["name"] = properties["name"]
-            ns.node_update(**node_prop)
+            ns.node_update(label=lbl_organization, **node_prop)
         # Check location
         curr_loc_node = self.get_location()
         if properties['location'] != curr_loc_node['city']:
@@ -743,7 +868,7 @@ class Organization:
         :return: Organization node.
         """
         if org_id:
-            self.org_node = ns.node(org_id)
+            self.org_node = ns.node(org_id, lbl_organization)
         return self.org_node
 
     def get_participants(self):
@@ -753,11 +878,12 @@ class Organization:
         :return: list of person nodes for persons that do participate in a race for this organization.
         """
         query = """
-            MATCH (n:Organization)-[:has]->(m:Race)<-[:participates]-(d:Participant)<-[:is]-(p:Person)
-            WHERE n.nid = '{org_id}'
+            MATCH (n:{lbl_org} {{nid: $org_id}})-[:{org2race}]->(m:{lbl_race})<-[:{part2race}]-(d:{lbl_part})
+                  <-[:{person2part}]-(p:{lbl_person})
             RETURN p
-        """.format(org_id=self.get_nid())
-        return ns.get_query(query)
+        """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_org=lbl_organization,
+                   person2part=person2participant, part2race=participant2race, org2race=organization2race)
+        return [rec["p"] for rec in ns.model_query("org_participants", query, org_id=self.get_nid())]
 
     def get_race_main(self):
         """
@@ -769,16 +895,13 @@ class Organization:
             return False
         else:
             query = """
-                    MATCH (org:{lbl_org})-[:{org2race}]->(race:{lbl_race})-[:{race2type}]->(rt:{lbl_rt})
-                    WHERE org.nid='{nid}'
-                      AND rt.name='{def_hoofd}'
+                    MATCH (org:{lbl_org} {{nid: $nid}})-[:{org2race}]->(race:{lbl_race})
+                          -[:{race2type}]->(rt:{lbl_rt} {{name: $def_hoofd}})
                     RETURN race
-                    """.format(nid=self.org_node["nid"],
-                               lbl_org=lbl_organization, lbl_race=lbl_race, lbl_rt=lbl_raceType,
-                               org2race=organization2race, race2type=race2type,
-                               def_hoofd=def_hoofdwedstrijd)
+                    """.format(lbl_org=lbl_organization, lbl_race=lbl_race, lbl_rt=lbl_raceType,
+                               org2race=organization2race, race2type=race2type)
             current_app.logger.debug(query)
-            res = ns.get_query_data(query)
+            res = ns.model_query("race_main", query, nid=self.org_node["nid"], def_hoofd=def_hoofdwedstrijd)
             if len(res) > 0:
                 return res[0]["race"]
             else:
@@ -790,12 +913,10 @@ class Organization:
 
         :return: Organization Type. Wedstrijd (Default) or Deelname, or False if not set.
         """
+        if self.org_type is not None:
+            return self.org_type
         org_type = ns.get_endnode(self.org_node, organization2type)
-        if isinstance(org_type, Node):
-            return org_type["name"]
-        else:
-            # org_type not yet defined for organization.
-            return False
+        return type_name(org_type)
 
     def set_date(self, ds=None):
         """
@@ -814,10 +935,8 @@ class Organization:
                 current_app.logger.debug("Trying to set date from {curr_ds} to {ds}".format(curr_ds=curr_ds, ds=ds))
                 # Remove current link from organization to date
                 ns.remove_relation(start_node=self.org_node, end_node=curr_ds_node, rel_type=organization2date)
-                # Check if date (day, month, year) can be removed.
-                # Don't remove single date, clear all dates that can be removed. This avoids the handling of key
-                # because date nodes don't have a nid.
-                ns.remove_orphan_nodes(lbl_day)
+                # The date node may be an orphan now. Orphan dates are removed by the orphan sweeper, not in the
+                # request.
             else:
                 # Link organization to date exists and no need to change
                 return True
@@ -848,6 +967,7 @@ class Organization:
         :return: True if org_type is set (or changed), False if org_type is not changed.
         """
         # Todo: Add link to recalculate points in the races (this link is in org edit!)
+        self.org_type = None
         if self.get_type():
             if self.get_type == org_type:
                 # All set, return
@@ -885,33 +1005,32 @@ class Organization:
         if self.get_type() == def_deelname:
             # Make sure there are no race->raceType links
             query = """
-            MATCH (org:{lbl_org})-[:{org2race}]->(race:{lbl_race})-[:{race2type}]->(rt:{lbl_rt})
+            MATCH (org:{lbl_org} {{nid: $nid}})-[:{org2race}]->(race:{lbl_race})-[:{race2type}]->(rt:{lbl_rt})
             RETURN race, rt
             """.format(lbl_org=lbl_organization, lbl_race=lbl_race, lbl_rt=lbl_raceType,
                        org2race=organization2race, race2type=race2type)
-            res = ns.get_query_data(query)
+            res = ns.model_query("race_types", query, nid=self.get_nid())
             for rec in res:
                 ns.remove_relation(start_node=rec["race"], end_node=rec["rt"], rel_type=race2type)
         else:
             # Organization type is Wedstrijd
             if isinstance(race_nid, str):
                 # Remove current relation - then set new relation
-                current_type = ns.get_endnode(start_node=ns.node(race_nid), rel_type=race2type)
+                race_node = ns.node(race_nid, lbl_race)
+                current_type = ns.get_endnode(start_node=race_node, rel_type=race2type)
                 if isinstance(current_type, Node):
-                    ns.remove_relation(start_node=ns.node(race_nid), rel_type=race2type, end_node=current_type)
+                    ns.remove_relation(start_node=race_node, rel_type=race2type, end_node=current_type)
                 if race_type == def_hoofdwedstrijd:
                     # If another hoofdwedstrijd was defined, set other race to nevenwedstrijd
                     main_race = self.get_race_main()
                     if isinstance(main_race, Node):
                         self.set_race_type(race_nid=main_race["nid"], race_type=def_nevenwedstrijd)
                     # No hoofdwedstrijd OR hoofdwedstrijd already set to current race
-                    props = dict(name=def_hoofdwedstrijd)
-                    hoofd_node = ns.get_node(lbl_raceType, **props)
-                    ns.create_relation(from_node=ns.node(race_nid), rel=race2type, to_node=hoofd_node)
+                    hoofd_node = refdata.get(lbl_raceType, def_hoofdwedstrijd)
+                    ns.create_relation(from_node=race_node, rel=race2type, to_node=hoofd_node)
                 else:
-                    props = dict(name=def_nevenwedstrijd)
-                    neven_node = ns.get_node(lbl_raceType, **props)
-                    ns.create_relation(from_node=ns.node(race_nid), rel=race2type, to_node=neven_node)
+                    neven_node = refdata.get(lbl_raceType, def_nevenwedstrijd)
+                    ns.create_relation(from_node=race_node, rel=race2type, to_node=neven_node)
             else:
                 # Set all race_types to Nevenwedstrijd - make sure there is no Hoofdwedstrijd defined
                 main_race = self.get_race_main()
@@ -919,8 +1038,7 @@ class Organization:
                     self.set_race_type(race_nid=main_race["nid"], race_type=def_deelname)
                 # For all races merge with Nevenwedstrijd racetype.
                 races = ns.get_endnodes(start_node=self.org_node, rel_type=organization2race)
-                props = dict(name=def_nevenwedstrijd)
-                neven_node = ns.get_node(lbl_raceType, **props)
+                neven_node = refdata.get(lbl_raceType, def_nevenwedstrijd)
                 for race in races:
                     ns.create_relation(from_node=race, rel=race2type, to_node=neven_node)
         return
@@ -945,10 +1063,12 @@ class Race:
         """
         self.org = None
         self.race_node = None
+        # Race type name, if it has been loaded with the race node. None if not loaded.
+        self.race_type = None
         if org_id:
             self.org = Organization(org_id=org_id)
         elif race_id:
-            self.race_node = ns.node(nid=race_id)
+            self.race_node = ns.node(race_id, lbl_race)
             self.set_org()
 
     def add(self, **props):
@@ -962,15 +1082,17 @@ class Race:
         :param props: Dictionary with race properties, including name (mandatory) and type (of Organization Wedstrijd).
         :return: racename
         """
-        # Create Race Node with attribute name and label
-        race_props = dict(name=props["name"])
-        self.race_node = ns.create_node(lbl_race, **race_props)
-        # Add Race Node to Organization
-        ns.create_relation(from_node=self.org.get_node(), rel=organization2race, to_node=self.race_node)
-        # If organization is Wedstrijd, then set race type
-        if self.org.get_type() == def_wedstrijd:
-            self.org.set_race_type(race_nid=self.get_nid(), race_type=props["type"])
-            self.org.calculate_points()
+        with ns.transaction():
+            # Create Race Node with attribute name and label
+            race_props = dict(name=props["name"])
+            self.race_node = ns.create_node(lbl_race, **race_props)
+            # Add Race Node to Organization
+            ns.create_relation(from_node=self.org.get_node(), rel=organization2race, to_node=self.race_node)
+            # If organization is Wedstrijd, then set race type
+            if self.org.get_type() == def_wedstrijd:
+                self.race_type = None
+                self.org.set_race_type(race_nid=self.get_nid(), race_type=props["type"])
+                self.org.calculate_points()
         return self.race_node["name"]
 
     def edit(self, **props):
@@ -987,12 +1109,13 @@ class Race:
                 nid=self.race_node["nid"],
                 name=props["name"]
             )
-            self.race_node = ns.node_update(**race_props)
+            self.race_node = ns.node_update(label=lbl_race, **race_props)
         # Check if type needs to be updated if organization type is Wedstrijd. In case of Deelname, then racetype has
         # been removed already.
         if self.org.get_type() == def_wedstrijd:
             if props["type"] != self.get_racetype():
                 # Change in race type - handled by organization object.
+                self.race_type = None
                 self.org.set_race_type(race_nid=self.get_nid(), race_type=props["type"])
                 self.org.calculate_points()
         return self.race_node["name"]
@@ -1004,17 +1127,18 @@ class Race:
         :return:
         """
         cnt = dict(vrouw=0, man=0)
+        rows = []
         node_list = self.get_participant_seq_list()
         if node_list:
+            mf4part = participant_mf_values([part_node["nid"] for part_node in node_list])
             for part_node in node_list:
-                part = Participant(part_id=part_node["nid"])
-                mf = part.get_mf_value()
+                mf = mf4part[part_node["nid"]]
                 cnt[mf] += 1
                 points = points_race(cnt[mf])
                 rel_pos = cnt[mf]
-                # Set points for participant
-                props = dict(nid=part.get_nid(), points=points, rel_pos=rel_pos)
-                ns.node_set_attribs(**props)
+                # Collect points for participant
+                rows.append(dict(nid=part_node["nid"], points=points, rel_pos=rel_pos))
+        ns.nodes_set_attribs(rows, label=lbl_participant)
         return
 
     def calculate_nevenwedstrijd(self):
@@ -1035,20 +1159,21 @@ class Race:
         m_rel_pos = m_parts + 1
         d_points = points_race(d_rel_pos)
         m_points = points_race(m_rel_pos)
+        rows = []
         node_list = self.get_participant_seq_list()
         if node_list:
+            mf4part = participant_mf_values([part_node["nid"] for part_node in node_list])
             for part_node in node_list:
-                part = Participant(part_id=part_node["nid"])
-                mf = part.get_mf_value()
+                mf = mf4part[part_node["nid"]]
                 if mf == "man":
                     points = m_points
                     rel_pos = m_rel_pos
                 else:
                     points = d_points
                     rel_pos = d_rel_pos
-                # Set points for participant
-                props = dict(nid=part.get_nid(), points=points, rel_pos=rel_pos)
-                ns.node_set_attribs(**props)
+                # Collect points for participant
+                rows.append(dict(nid=part_node["nid"], points=points, rel_pos=rel_pos))
+        ns.nodes_set_attribs(rows, label=lbl_participant)
         return
 
     def calculate_deelname(self):
@@ -1059,21 +1184,22 @@ class Race:
         """
         node_list = self.get_participant_seq_list()
         cnt = 0
+        rows = []
         if node_list:
             for part_node in node_list:
-                part = Participant(part_id=part_node["nid"])
                 cnt += 1
                 points = points_deelname
                 rel_pos = cnt
-                props = dict(nid=part.get_nid(), points=points, rel_pos=rel_pos)
-                ns.node_set_attribs(**props)
+                rows.append(dict(nid=part_node["nid"], points=points, rel_pos=rel_pos))
+        ns.nodes_set_attribs(rows, label=lbl_participant)
         return
 
     def calculate_points(self):
         """
         This method will call the function to calculate the points for the race depending on the race type.
 
-        :return: All participants in the race have the correct points and position.
+        :return: All participants in the race have the correct points and position. The standings for the participants
+        are updated.
         """
         race_type = self.get_racetype()
         if race_type == def_hoofdwedstrijd:
@@ -1082,25 +1208,33 @@ class Race:
             self.calculate_nevenwedstrijd()
         else:
             self.calculate_deelname()
+        standings_update(self.get_person_nids())
         return
 
-    def get_next_part(self):
+    def get_next_part(self, prefix, limit=10):
         """
-        This method will get the list of people that can be added as participant to the race. So these are people not
-        listed as participant yet.
+        This method will get the people that can be added as participant to the race and that have a name starting with
+        prefix. These are people not listed as participant in a race of the organization yet. The persons of the
+        organization are collected first, then the names are found on the index of the lower case name (name_lc), so
+        the query does not check every person in the database.
 
-        :return: list of possible next participants
+        :param prefix: Start of the name, not case sensitive.
+        :param limit: Maximum number of persons to return.
+        :return: list of possible next participants, as dictionaries with nid and name, in sequence of name.
         """
         query = """
-          MATCH (person:{lbl_person}), (org:{lbl_org} {{nid: '{org_nid}'}})
-          WHERE NOT EXISTS ((person)-[:{person2part}]->(:{lbl_part})-[:{part2race}]->(:{lbl_race})<-[:{org2race}]-(org))
-          RETURN person 
+          MATCH (org:{lbl_org} {{nid: $org_nid}})
+          OPTIONAL MATCH (org)-[:{org2race}]->(:{lbl_race})<-[:{part2race}]-(:{lbl_part})<-[:{person2part}]-(done)
+          WITH collect(done) as done
+          MATCH (person:{lbl_person})
+          WHERE person.name_lc STARTS WITH $prefix
+            AND NOT person IN done
+          RETURN person.nid as nid, person.name as name
           ORDER BY person.name
+          LIMIT $limit
         """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_org=lbl_organization,
-                   person2part=person2participant, part2race=participant2race, org2race=organization2race,
-                   org_nid=self.get_org_id())
-        current_app.logger.debug(query)
-        res = ns.get_query_data(query)
+                   person2part=person2participant, part2race=participant2race, org2race=organization2race)
+        res = ns.model_query("persons_available", query, org_nid=self.get_org_id(), prefix=prefix.lower(), limit=limit)
         return res
 
     def get_label(self):
@@ -1160,52 +1294,43 @@ class Race:
         :return: Number of participants for this category.
         """
         query = """
-            MATCH (race:Race)<-[:participates]-(:Participant)<-[:is]-(person:Person)-[:mf]->(mf:MF)
-            WHERE race.nid = '{race_nid}'
-              AND mf.name = '{cat}'
+            MATCH (race:{lbl_race} {{nid: $race_nid}})<-[:{part2race}]-(:{lbl_part})
+                  <-[:{person2part}]-(person:{lbl_person})-[:{person2mf}]->(mf:{lbl_mf} {{name: $cat}})
             RETURN count(person) as cnt
-        """.format(race_nid=self.get_nid(), cat=cat)
+        """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_mf=lbl_mf,
+                   person2part=person2participant, part2race=participant2race, person2mf=person2mf)
         current_app.logger.info(query)
-        res = ns.get_query_data(query)
+        res = ns.model_query("race_mf_count", query, race_nid=self.get_nid(), cat=cat)
         return res[0]["cnt"]
 
-    def get_participant_seq_list(self, excl_part_nid=None):
+    def get_participant_seq_list(self):
         """
-        This method returns the participants for the race in sequence of arrival.
+        This method returns the participants for the race in sequence of arrival. Participants that are not (yet) in
+        the sequence of arrival have no seq property and are not returned.
 
-        :param excl_part_nid: Participant nid that needs to be excluded from query, since it is in orphan state.
         :return: List of participant nodes for the race in sequence of arrival.
         """
-        # Todo: Remove cypher query below if this is working.
+        query = """
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part})
+            WHERE EXISTS(part.seq)
+            RETURN part
+            ORDER BY part.seq
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+        res = ns.model_query("race_seq_parts", query, race_id=self.get_nid())
+        return [rec["part"] for rec in res]
+
+    def get_person_nids(self):
         """
-                    MATCH race_ptn = (race)<-[:participates]-(participant),
-                  participants = (participant)<-[:after*0..]-()
-            WHERE race.nid = '{race_id}' {excl_str}
-            WITH COLLECT(participants) AS results, MAX(length(participants)) AS maxLength
-            WITH FILTER(result IN results WHERE length(result) = maxLength) AS result_coll
-            UNWIND result_coll as result
-            RETURN nodes(result)
+        This method returns the nids of the persons that participate in the race.
 
+        :return: List of person nids.
         """
-        if isinstance(excl_part_nid, str):
-            excl_str = "AND NOT first_part.nid = '{part_nid}'".format(part_nid=excl_part_nid)
-        else:
-            excl_str = ""
         query = """
-                MATCH race_ptn = (race)<-[:participates]-(first_part),
-                      participants = (first_part)<-[:after*0..]-(last_part)
-                WHERE race.nid = '{race_id}' {excl_str}
-                  AND NOT (first_part)-[:after]->()
-                  AND NOT ()-[:after]->(last_part)
-                RETURN nodes(participants)
-        """.format(race_id=self.get_nid(), excl_str=excl_str)
-        current_app.logger.info(query)
-        # Get the result of the query in a recordlist
-        res = ns.get_query_data(query)
-        if len(res) > 0:
-            return res[0]["nodes(participants)"]
-        else:
-            return []
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(:{lbl_part})<-[:{person2part}]-(person)
+            RETURN person.nid AS nid
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race,
+                   person2part=person2participant)
+        return [rec["nid"] for rec in ns.model_query("race_person_nids", query, race_id=self.get_nid())]
 
     def get_racetype(self):
         """
@@ -1214,35 +1339,68 @@ class Race:
 
         :return: Race Type: Hoofdwedstrijd, Nevenwedstrijd or False if not available.
         """
+        if self.race_type is not None:
+            return self.race_type
         race_type = ns.get_endnode(self.get_node(), race2type)
-        if isinstance(race_type, Node):
-            return race_type["name"]
-        else:
-            # race_type not defined for race, so it must be 'Deelname'.
-            return False
+        # If race_type not defined for race, then it must be 'Deelname'.
+        return type_name(race_type)
 
-    def part_person_seq_list(self, excl_part_nid=None):
+    def part_person_seq_list(self):
         """
         This method add person information to the participant sequence list.
 
-        :param excl_part_nid: Participant nid that needs to be excluded from query, since it is in orphan state.
-        :return: List of participant items in the race. Each item is a tuple of the person dictionary (from the person
-        object) and the participant dictionary (the properties of the participant node). False if there are no
-        participants in the list.
-        """
-        node_list = self.get_participant_seq_list(excl_part_nid)
-        if isinstance(node_list, list):
-            finisher_list = []
-            # If there are finishers, then recordlist has one element, which is a nodelist
-            for part in node_list:
-                part_obj = Participant(part_id=part["nid"])
-                person_obj = Person(person_id=part_obj.get_person_nid())
-                person_dict = person_obj.get_dict()
-                pers_part_tuple = (person_dict, dict(part))
-                finisher_list.append(pers_part_tuple)
-            return finisher_list
-        else:
-            return False
+        :return: List of participant items in the race. Each item is a tuple of the person dictionary (as from the
+        person object) and the participant dictionary (the properties of the participant node). Empty list if there are
+        no participants in the list.
+        """
+        query = """
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(part:{lbl_part})<-[:{person2part}]-(person)
+            WHERE EXISTS(part.seq)
+            RETURN person.nid AS nid, person.name AS label, part
+            ORDER BY part.seq
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race,
+                   person2part=person2participant)
+        finisher_list = []
+        for rec in ns.model_query("race_finishers", query, race_id=self.get_nid()):
+            # Same dictionary as Person.get_dict(). A finisher participates in this race, so the person is active.
+            person_dict = dict(
+                nid=rec["nid"],
+                label=rec["label"],
+                active=True
+            )
+            finisher_list.append((person_dict, dict(rec["part"])))
+        return finisher_list
+
+    def set_finish_order(self, person_nids):
+        """
+        This method sets the sequence of arrival for all participants in the race, in a single transaction. The list
+        must have every participant of the race exactly once, else nothing is changed. Points are not calculated, the
+        caller must calculate the points for the organization once the sequence is set.
+
+        :param person_nids: List of person nids in sequence of arrival.
+        :return: True if the sequence is set, False if the list does not match the participants of the race.
+        """
+        query = """
+            MATCH (race:{lbl_race} {{nid: $race_id}})<-[:{part2race}]-(:{lbl_part})<-[:{person2part}]-(person)
+            RETURN person.nid AS nid
+        """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race,
+                   person2part=person2participant)
+        with ns.transaction():
+            current = [rec["nid"] for rec in ns.model_query("race_person_nids", query, race_id=self.get_nid())]
+            if len(set(person_nids)) != len(person_nids) or set(person_nids) != set(current):
+                current_app.logger.error("Finish order for race {nid} does not match the participants"
+                                         .format(nid=self.get_nid()))
+                return False
+            query = """
+                MATCH (race:{lbl_race} {{nid: $race_id}})
+                UNWIND range(0, size($person_nids) - 1) AS idx
+                MATCH (race)<-[:{part2race}]-(part:{lbl_part})<-[:{person2part}]-(person:{lbl_person})
+                WHERE person.nid = $person_nids[idx]
+                SET part.seq = idx + 1
+            """.format(lbl_race=lbl_race, lbl_part=lbl_participant, lbl_person=lbl_person,
+                       part2race=participant2race, person2part=person2participant)
+            ns.model_update("race_set_seq", query, race_id=self.get_nid(), person_nids=person_nids)
+        return True
 
     def part_person_after_list(self):
         """
@@ -1261,14 +1419,13 @@ class Race:
             finisher_list = [eerste]
         return finisher_list
 
-    def part_person_first_id(self, excl_part_nid=None):
+    def part_person_first_id(self):
         """
         This method will get the ID of the first person in the race.
 
-        :param excl_part_nid: Participant nid that needs to be excluded from query, since it is in orphan state.
         :return: Node ID of the first person so far in the race, False if no participant registered for this race.
         """
-        finisher_tuple = self.part_person_seq_list(excl_part_nid)
+        finisher_tuple = self.part_person_seq_list()
         if finisher_tuple:
             (person, part) = finisher_tuple[0]
             person_id = person['nid']
@@ -1319,15 +1476,18 @@ class Location:
         props = {
             "city": self.loc
         }
-        loc = ns.get_node("Location", **props)
+        loc = ns.get_node(lbl_location, **props)
         return loc
 
     def add(self):
-        if not self.find():
-            ns.create_node("Location", city=self.loc)
-            return True
-        else:
-            return False
+        """
+        This method will add the location. Find and create are done in a single statement, so concurrent requests
+        cannot create the same location twice.
+
+        :return: True if the location has been created, False if the location exists already.
+        """
+        (_, created) = ns.merge_node(lbl_location, dict(city=self.loc))
+        return created
 
     def get_node(self):
         """
@@ -1336,9 +1496,7 @@ class Location:
 
         :return:
         """
-        self.add()    # Register if required, ignore else
-        node = self.find()
-        return node
+        return ns.get_or_create(lbl_location, dict(city=self.loc))
 
 
 def organization_list():
@@ -1349,18 +1507,66 @@ def organization_list():
     :return: List of dictionaries containing fields date, organization, city, id (organization nid) and type.
     """
     query = """
-        MATCH (day:Day)<-[:On]-(org:Organization)-[:In]->(loc:Location),
-              (org)-[:type]->(ot:OrgType)
+        MATCH (day:{lbl_day})<-[:{org2date}]-(org:{lbl_org})-[:{org2loc}]->(loc:{lbl_loc}),
+              (org)-[:{org2type}]->(ot:{lbl_ot})
         RETURN day.key as date, org.name as organization, loc.city as city, org.nid as id, ot.name as type
-        ORDER BY day.key ASC
-    """
-    res = ns.get_query_data(query)
+        ORDER BY day.key ASC, org.nid ASC
+    """.format(lbl_day=lbl_day, lbl_org=lbl_organization, lbl_loc=lbl_location, lbl_ot=lbl_organizationType,
+               org2date=organization2date, org2loc=organization2location, org2type=organization2type)
+    res = ns.model_query("organization_list", query)
     # Convert date key from YYYY-MM-DD to DD-MM-YYYY
     for rec in res:
         rec["date"] = datetime.datetime.strptime(rec["date"], "%Y-%m-%d").strftime("%d-%m-%Y")
     return res
 
 
+def organization_page(start=None, end=None, after_date=None, after_id=None, limit=50):
+    """
+    This function will return a page of the organization list, in sequence of date and organization nid. Organizations
+    can be selected on a date window. The page starts after the organization with date after_date and nid after_id
+    (keyset pagination), so the cost of a page does not depend on the number of organizations before the page.
+
+    :param start: First date (YYYY-MM-DD) of the window, or None.
+    :param end: Last date (YYYY-MM-DD) of the window, or None.
+    :param after_date: Date key (YYYY-MM-DD) of the last organization on the previous page, or None for first page.
+    :param after_id: nid of the last organization on the previous page.
+    :param limit: Number of organizations on a page.
+    :return: List of dictionaries as in organization_list, and dictionary with after_date and after_id for the next
+    page (None if this is the last page).
+    """
+    day_cond = []
+    if start:
+        day_cond.append("day.key >= $start")
+    if end:
+        day_cond.append("day.key <= $end")
+    if after_date:
+        day_cond.append("day.key >= $after_date")
+    query = """
+        MATCH (day:{lbl_day})
+        {day_where}
+        MATCH (day)<-[:{org2date}]-(org:{lbl_org})-[:{org2loc}]->(loc:{lbl_loc}),
+              (org)-[:{org2type}]->(ot:{lbl_ot})
+        {org_where}
+        RETURN day.key as date, org.name as organization, loc.city as city, org.nid as id, ot.name as type
+        ORDER BY day.key ASC, org.nid ASC
+        LIMIT $limit
+    """.format(lbl_day=lbl_day, lbl_org=lbl_organization, lbl_loc=lbl_location, lbl_ot=lbl_organizationType,
+               org2date=organization2date, org2loc=organization2location, org2type=organization2type,
+               day_where="WHERE " + " AND ".join(day_cond) if day_cond else "",
+               org_where="WHERE day.key > $after_date OR org.nid > $after_id" if after_date else "")
+    # Get one more row to know if there is a next page.
+    res = ns.model_query("organization_page", query, start=start, end=end, after_date=after_date, after_id=after_id,
+                         limit=limit + 1)
+    next_page = None
+    if len(res) > limit:
+        res = res[:limit]
+        next_page = dict(after_date=res[-1]["date"], after_id=res[-1]["id"])
+    # Convert date key from YYYY-MM-DD to DD-MM-YYYY
+    for rec in res:
+        rec["date"] = datetime.datetime.strptime(rec["date"], "%Y-%m-%d").strftime("%d-%m-%Y")
+    return res, next_page
+
+
 def organization_delete(org_id=None):
     """
     This method will delete an organization. This can be done only if there are no more races attached to the
@@ -1373,19 +1579,16 @@ def organization_delete(org_id=None):
     org = Organization(org_id=org_id)
     org_node = org.get_node()
     org_label = org.get_label()
-    if ns.get_endnodes(start_node=org_node, rel_type="has"):
+    if ns.get_endnodes(start_node=org_node, rel_type=organization2race):
         current_app.logger.info("Organization {label} cannot be removed, races are attached.".format(label=org_label))
         return False
     else:
         # Remove Organization
         current_app.logger.debug("Trying to remove organization {lbl}".format(lbl=org_label))
-        ns.remove_node_force(nid=org_id)
-        # Check if this results in orphan dates, remove these dates
-        current_app.logger.debug("Then remove all orphan dates")
-        ns.remove_orphan_nodes(lbl_day)
-        # Check if this results in orphan locations, remove these locations.
-        current_app.logger.debug("Trying to delete orphan organizations.")
-        ns.remove_orphan_nodes(lbl_location)
+        ns.remove_node_force(nid=org_id, label=lbl_organization)
+        # Check if this results in orphan dates and locations, remove these nodes.
+        current_app.logger.debug("Then remove all orphan dates and locations")
+        remove_orphans()
         current_app.logger.debug("All done")
         current_app.logger.info("Organization {lbl} removed.".format(lbl=org_label))
         return True
@@ -1398,10 +1601,20 @@ def get_org_type_node(org_type):
     :param org_type: "Deelname" or "Wedstrijd".
     :return: Organization Type Node, "Wedstrijd" or "Deelname".
     """
-    props = {
-        "name": org_type
-    }
-    return ns.get_node("OrgType", **props)
+    return refdata.get(lbl_organizationType, org_type)
+
+
+def type_name(type_node):
+    """
+    This method will return the name of an Organization Type or Race Type node.
+
+    :param type_node: OrgType or RaceType node, or None if the type is not defined.
+    :return: Name of the type, or False if the type is not defined.
+    """
+    if isinstance(type_node, Node):
+        return type_node["name"]
+    else:
+        return False
 
 
 def get_race_list_attribs(org_id):
@@ -1438,7 +1651,9 @@ def initialize_neo():
     """
     nodes = ns.get_nodes()
     if isinstance(nodes, list):
-        current_app.logger.info("Nodes found, no need to initialize.")
+        current_app.logger.info("Nodes found, no need to initialize. Update graph structure.")
+        init_graph()
+        standings_rebuild()
         return
     else:
         current_app.logger.info("Initialize environment.")
@@ -1455,35 +1670,124 @@ def init_graph():
 
     :return:
     """
-    stmt = "CREATE CONSTRAINT ON (n:{0}) ASSERT n.{1} IS UNIQUE"
-    ns.get_query(stmt.format(lbl_location, 'city'))
-    ns.get_query(stmt.format(lbl_person, 'name'))
-    ns.get_query(stmt.format(lbl_raceType, 'name'))
-    ns.get_query(stmt.format(lbl_organizationType, 'name'))
-    nid_labels = [lbl_day, lbl_location, lbl_mf, lbl_organization, lbl_organization, lbl_participant, lbl_person,
-                  lbl_race, lbl_raceType]
-    stmt = "CREATE CONSTRAINT ON (n:{nid_label}) ASSERT n.nid IS UNIQUE"
+    ns.create_constraint(lbl_location, 'city')
+    # The unique constraint comes with an index on Person(name), used by person_page. Neo4J refuses a second index on
+    # a property with a unique constraint, so no separate index is created.
+    ns.create_constraint(lbl_person, 'name')
+    ns.create_constraint(lbl_raceType, 'name')
+    ns.create_constraint(lbl_organizationType, 'name')
+    # Key constraints make MERGE in get_or_create safe for concurrent requests.
+    ns.create_constraint(lbl_day, 'key')
+    ns.create_constraint(lbl_mf, 'name')
+    ns.create_constraint(lbl_graphVersion, 'name')
+    ns.create_constraint(lbl_schemaVersion, 'name')
+    nid_labels = [lbl_day, lbl_location, lbl_mf, lbl_organization, lbl_organizationType, lbl_participant, lbl_person,
+                  lbl_race, lbl_raceType, "User"]
     for nid_label in nid_labels:
-        ns.get_query(stmt.format(nid_label=nid_label))
+        ns.create_constraint(nid_label, 'nid')
+    # Sequence of arrival
+    ns.create_index(lbl_participant, 'seq')
+    # Standings
+    ns.create_index(lbl_person, 'points')
+    # Person search
+    ns.create_index(lbl_person, 'name_lc')
+    # Change feed
+    ns.create_index(lbl_graphChange, 'version')
     # Organization type nodes and Race type nodes are required for empty database
     # Organization
     for name in [def_wedstrijd, def_deelname]:
-        props = dict(name=name)
-        if not ns.get_node(lbl_organizationType, **props):
-            ns.create_node(lbl_organizationType, **props)
+        ns.get_or_create(lbl_organizationType, dict(name=name))
     # Race
     for name in [def_hoofdwedstrijd, def_nevenwedstrijd]:
-        props = dict(name=name)
-        if not ns.get_node(lbl_raceType, **props):
-            ns.create_node(lbl_raceType, **props)
+        ns.get_or_create(lbl_raceType, dict(name=name))
     # mf
     for name in ["Dames", "Heren"]:
-        props = dict(name=name)
-        if not ns.get_node(lbl_mf, **props):
-            ns.create_node(lbl_mf, **props)
+        ns.get_or_create(lbl_mf, dict(name=name))
+    refdata.refresh()
+    upgrade_graph()
     return
 
 
+def upgrade_graph():
+    """
+    This method brings an existing graph up to date with the current version of the application. It is called from
+    init_graph, so from /initenv and from the flask command upgrade-graph. The steps scan the full graph, so they only
+    run if the schema version on the SchemaVersion node is lower than the schema version of the application. Every step
+    checks if it is required, so an interrupted upgrade can run again.
+
+    :return: True if the graph is upgraded, False if the graph has the schema version of the application already.
+    """
+    schema_node = ns.get_or_create(lbl_schemaVersion, dict(name=def_graph), dict(version=0))
+    if schema_node["version"] >= schema_version:
+        current_app.logger.debug("Graph has schema version {v}, no upgrade required.".format(v=schema_node["version"]))
+        return False
+    current_app.logger.info("Upgrade graph from schema version {f} to {t}".format(f=schema_node["version"],
+                                                                                   t=schema_version))
+    migrate_arrival_seq()
+    migrate_person_name_lc()
+    standings_missing()
+    ns.node_set_attribs(label=lbl_schemaVersion, nid=schema_node["nid"], version=schema_version)
+    return True
+
+
+def migrate_arrival_seq():
+    """
+    This method will convert the sequence of arrival from the (participant)-[:after]->(participant) chain to the seq
+    property on the participant nodes. The after relations are removed when the seq properties are set. Races without
+    after relations are not touched, so the method can run on every initialization.
+
+    :return: Number of participant nodes that got a seq property.
+    """
+    query = """
+        MATCH (race:{lbl_race})<-[:{part2race}]-(first_part:{lbl_part})<-[:{part2part}]-()
+        WHERE NOT (first_part)-[:{part2part}]->()
+        MATCH participants = (first_part)<-[:{part2part}*0..]-(last_part)
+        WHERE NOT ()-[:{part2part}]->(last_part)
+        RETURN nodes(participants) AS parts
+    """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race,
+               part2part=participant2participant)
+    rows = []
+    for rec in ns.model_query("arrival_chains", query):
+        rows += [dict(nid=part["nid"], seq=seq) for seq, part in enumerate(rec["parts"], start=1)]
+    # Races with a single participant have no after relation.
+    query = """
+        MATCH (race:{lbl_race})<-[:{part2race}]-(part:{lbl_part})
+        WITH race, collect(part) AS parts
+        WHERE size(parts) = 1
+        WITH parts[0] AS part
+        WHERE NOT EXISTS(part.seq)
+        RETURN part.nid AS nid
+    """.format(lbl_race=lbl_race, lbl_part=lbl_participant, part2race=participant2race)
+    rows += [dict(nid=rec["nid"], seq=1) for rec in ns.model_query("arrival_single", query)]
+    if rows:
+        current_app.logger.info("Migrate sequence of arrival for {cnt} participants".format(cnt=len(rows)))
+        with ns.transaction():
+            ns.nodes_set_attribs(rows, label=lbl_participant)
+            query = "MATCH (:{lbl_part})-[rel:{part2part}]->(:{lbl_part}) DELETE rel"\
+                .format(lbl_part=lbl_participant, part2part=participant2participant)
+            ns.model_update("arrival_chains_remove", query)
+    return len(rows)
+
+
+def migrate_person_name_lc():
+    """
+    This method will set the lower case name (name_lc) for the persons that do not have it yet. The lower case name is
+    used for the person search.
+
+    :return: Number of person nodes updated.
+    """
+    query = """
+        MATCH (person:{lbl_person})
+        WHERE NOT EXISTS(person.name_lc)
+        RETURN person.nid AS nid, person.name AS name
+    """.format(lbl_person=lbl_person)
+    rows = [dict(nid=rec["nid"], name_lc=rec["name"].lower())
+            for batch in ns.model_iter("persons_without_name_lc", query) for rec in batch]
+    if rows:
+        current_app.logger.info("Set lower case name for {cnt} persons".format(cnt=len(rows)))
+    return ns.nodes_set_attribs(rows, label=lbl_person)
+
+
 def link_mf(mf, node, rel):
     """
     This method will link the node to current mf. If Link does not exist, it will be created. If link is to other
@@ -1524,16 +1828,14 @@ def get_race_list(org_id):
     evaluates to False.
     """
     query = """
-        MATCH (org:{lbl_org})-[:{org2race}]->(race:{lbl_race})
-        WHERE org.nid = '{org_id}'
+        MATCH (org:{lbl_org} {{nid: $org_id}})-[:{org2race}]->(race:{lbl_race})
         OPTIONAL MATCH (race)-[:{race2type}]->(type:{lbl_rt})
         RETURN race, type
         ORDER BY type.name, race.name
-    """.format(org_id=org_id,
-               lbl_org=lbl_organization, lbl_race=lbl_race, lbl_rt=lbl_raceType,
+    """.format(lbl_org=lbl_organization, lbl_race=lbl_race, lbl_rt=lbl_raceType,
                org2race=organization2race, race2type=race2type)
     current_app.logger.debug(query)
-    res = ns.get_query_data(query)
+    res = ns.model_query("race_list", query, org_id=org_id)
     return res
 
 
@@ -1552,23 +1854,31 @@ def races4person(pers_id):
     return recordlist
 
 
-def races4person_org(pers_id):
+def season_matrix(mf):
     """
-    This method gets the result of races4person method, then converts the result in a dictionary with key org_nid and
-    value race dictionary.
+    This method gets the race results for all persons in mf in a single query, then pivots the result to a dictionary
+    with key person nid.
 
-    :param pers_id:
-    :return: Dictionary with key org_nid and value dictionary of node race attributes for the person. This can be used
-    for the Results Overview page.
-    """
-    races = races4person(pers_id=pers_id)
-    race_org = {}
-    for race in races:
-        race_org[race["org"]["nid"]] = dict(
-            race=race["race"],
-            part=race["part"]
-        )
-    return race_org
+    :param mf: Dames / Heren
+    :return: Dictionary with key person nid and value dictionary with key org_nid and value dictionary with race and
+    part (participant) node attributes for the person. This can be used for the Results Overview page.
+    """
+    query = """
+        MATCH (person:{lbl_person})-[:{person2mf}]->(:{lbl_mf} {{name: $mf}}),
+              (person)-[:{person2part}]->(part:{lbl_part})-[:{part2race}]->(race:{lbl_race})
+              <-[:{org2race}]-(org:{lbl_org})
+        RETURN person.nid AS person_nid, org.nid AS org_nid, race, part
+    """.format(lbl_person=lbl_person, lbl_mf=lbl_mf, lbl_part=lbl_participant, lbl_race=lbl_race,
+               lbl_org=lbl_organization, person2mf=person2mf, person2part=person2participant,
+               part2race=participant2race, org2race=organization2race)
+    result4person = defaultdict(dict)
+    for batch in ns.model_iter("season_matrix", query, mf=mf):
+        for rec in batch:
+            result4person[rec["person_nid"]][rec["org_nid"]] = dict(
+                race=dict(rec["race"]),
+                part=dict(rec["part"])
+            )
+    return result4person
 
 
 def race_delete(race_id=None):
@@ -1581,13 +1891,13 @@ def race_delete(race_id=None):
     """
     race = Race(race_id=race_id)
     rl = race.get_label()
-    if ns.get_startnodes(end_node=race.get_node(), rel_type="participates"):
+    if ns.get_startnodes(end_node=race.get_node(), rel_type=participant2race):
         msg = "Race {rl} cannot be removed, participants are attached.".format(rl=rl)
         current_app.logger.error(msg)
         return False
     else:
         # Remove Organization
-        ns.remove_node_force(race_id)
+        ns.remove_node_force(race_id, lbl_race)
         msg = "Race {rl} removed.".format(rl=rl)
         current_app.logger.info(msg)
         return True
@@ -1595,27 +1905,57 @@ def race_delete(race_id=None):
 
 def person_list():
     """
-    Return the list of persons as person objects.
+    Return the list of persons, with the number of races for each person, from a single query.
 
-    :return: List of persons objects. Each person is represented as a dictionary with person nid, name, category,
-    category sequence (cat_seq), mf and number of races (races). The list is sorted on Category, MF and name.
+    :return: List of persons. Each person is represented as a dictionary with person nid, name, mf and number of races
+    (races). The list is sorted on MF and name.
     """
-    res = ns.get_nodes(lbl_person)
-    person_arr = []
-    if isinstance(res, list):
-        for node in res:
-            person_obj = Person(person_id=node["nid"])
-            person_dict = dict(
-                nid=person_obj.get_node()["nid"],
-                name=person_obj.get_name(),
-                mf=person_obj.get_mf()["name"],
-                races=len(person_obj.get_races4person())
-            )
-            person_arr.append(person_dict)
-        persons_sorted = sorted(person_arr, key=lambda x: (x["mf"], x["name"]))
+    query = """
+        MATCH (person:{lbl_person})-[:{person2mf}]->(mf:{lbl_mf})
+        OPTIONAL MATCH (person)-[:{person2part}]->(:{lbl_part})-[:{part2race}]->(race:{lbl_race})
+        RETURN person.nid AS nid, person.name AS name, mf.name AS mf, count(race) AS races
+        ORDER BY mf, name
+    """.format(lbl_person=lbl_person, lbl_mf=lbl_mf, lbl_part=lbl_participant, lbl_race=lbl_race,
+               person2mf=person2mf, person2part=person2participant, part2race=participant2race)
+    return ns.model_query("person_list", query)
+
+
+def person_page(after_mf=None, after_name=None, limit=50):
+    """
+    Return a page of the person list, with the number of races for each person. The page starts after the person with
+    mf after_mf and name after_name (keyset pagination). The races are counted for the persons on the page only.
+    The name condition uses the index of the unique constraint on Person(name). The sort on mf.name, then person.name
+    cannot be served from that index, since mf is another node: the persons after the start of the page are sorted
+    before the limit applies. This is a cost per page in the number of persons, not in the number of races.
+
+    :param after_mf: MF of the last person on the previous page, or None for the first page.
+    :param after_name: Name of the last person on the previous page.
+    :param limit: Number of persons on a page.
+    :return: List of persons as in person_list, and dictionary with after_mf and after_name for the next page (None if
+    this is the last page).
+    """
+    if after_mf:
+        where = "WHERE mf.name > $after_mf OR (mf.name = $after_mf AND person.name > $after_name)"
     else:
-        persons_sorted = []
-    return persons_sorted
+        where = ""
+    query = """
+        MATCH (person:{lbl_person})-[:{person2mf}]->(mf:{lbl_mf})
+        {where}
+        WITH person, mf
+        ORDER BY mf.name, person.name
+        LIMIT $limit
+        OPTIONAL MATCH (person)-[:{person2part}]->(:{lbl_part})-[:{part2race}]->(race:{lbl_race})
+        RETURN person.nid AS nid, person.name AS name, mf.name AS mf, count(race) AS races
+        ORDER BY mf, name
+    """.format(lbl_person=lbl_person, lbl_mf=lbl_mf, lbl_part=lbl_participant, lbl_race=lbl_race,
+               person2mf=person2mf, person2part=person2participant, part2race=participant2race, where=where)
+    # Get one more row to know if there is a next page.
+    res = ns.model_query("person_page", query, after_mf=after_mf, after_name=after_name, limit=limit + 1)
+    next_page = None
+    if len(res) > limit:
+        res = res[:limit]
+        next_page = dict(after_mf=res[-1]["mf"], after_name=res[-1]["name"])
+    return res, next_page
 
 
 def get_location(nid):
@@ -1642,7 +1982,7 @@ def get_location_list():
     :return: List of tuples containing nid and city sorted by City name.
     """
     query = "MATCH (n:{lbl}) RETURN n ORDER BY n.city".format(lbl=lbl_location)
-    return [(loc["n"]["nid"], loc["n"]["city"]) for loc in ns.get_query_data(query)]
+    return [(loc["n"]["nid"], loc["n"]["city"]) for loc in ns.model_query("location_list", query)]
 
 
 def get_mf_node(prop):
@@ -1652,8 +1992,7 @@ def get_mf_node(prop):
     :param prop: Heren / Dames
     :return: Corresponding node
     """
-    props = dict(name=prop)
-    return ns.get_node(lbl_mf, **props)
+    return refdata.get(lbl_mf, prop)
 
 
 def get_mf_value(node, rel):
@@ -1669,6 +2008,24 @@ def get_mf_value(node, rel):
     return mf_tx_inv[mf]
 
 
+def participant_mf_values(part_nids):
+    """
+    This method will get the mf value (man/vrouw) of the person for a list of participants. The persons and the mf
+    nodes are loaded in batch, so two queries are required irrespective of the number of participants.
+
+    :param part_nids: List of participant nids.
+    :return: Dictionary with key participant nid and value man/vrouw.
+    """
+    persons = ns.get_startnodes_many(part_nids, rel_type=person2participant, label=lbl_participant)
+    person_nids = set(node["nid"] for nodes in persons.values() for node in nodes)
+    mf_nodes = ns.get_endnodes_many(list(person_nids), rel_type=person2mf, label=lbl_person)
+    mf4part = {}
+    for part_nid, nodes in persons.items():
+        mf_node = mf_nodes[nodes[0]["nid"]][0]
+        mf4part[part_nid] = mf_tx_inv[mf_node["name"]]
+    return mf4part
+
+
 def points_race(pos):
     """
     This method will return points for a specific position in a regular race.
@@ -1711,58 +2068,92 @@ def points_sum(point_list):
 
 def results_for_mf(mf):
     """
-    This method will calculate the points for all participants in mf. Split up in points for wedstrijd and points for
-    deelname at this point.
+    This method will return the standings for all participants in mf. The standings are kept on the person nodes by
+    standings_update, so this is a single read.
 
     :param mf: Dames / Heren
     :return: Sorted list with tuples (name, points, number of races, nid for person).
     """
-    # Wedstrijden
-    result_list = participation_points(mf=mf, orgtype=def_wedstrijd)
-    wedstrijd_total = {}
-    for nid in result_list:
-        params = dict(
-            wedstrijd_nr=len(result_list[nid]),
-            wedstrijd_points=points_sum(result_list[nid])
-        )
-        wedstrijd_total[nid] = params
-    # Deelname
-    result_list = participation_points(mf=mf, orgtype=def_deelname)
-    deelname_total = {}
+    query = """
+        MATCH (person:{lbl_person})-[:{person2mf}]->(:{lbl_mf} {{name: $mf}})
+        WHERE person.nr > 0
+        RETURN person.name AS name, person.points AS points, person.nr AS nr, person.nid AS nid
+        ORDER BY person.points DESC
+    """.format(lbl_person=lbl_person, lbl_mf=lbl_mf, person2mf=person2mf)
+    res = ns.model_query("results_for_mf", query, mf=mf)
+    return [[rec["name"], rec["points"], rec["nr"], rec["nid"]] for rec in res]
+
+
+def standings_update(person_nids):
+    """
+    This method will calculate the standings for the persons and keep them on the person nodes. Points for wedstrijd
+    and points for deelname are calculated separately, then added up. The method must be called when the points of
+    the participants of a race are changed.
+
+    :param person_nids: List of nids of the persons for which the standings need to be updated.
+    :return: Number of person nodes updated.
+    """
+    if not person_nids:
+        return 0
+    query = """
+        UNWIND $nids AS nid
+        MATCH (person:{lbl_person} {{nid: nid}})
+        OPTIONAL MATCH (person)-[:{person2part}]->(part:{lbl_part})-[:{part2race}]->(:{lbl_race})
+                       <-[:{org2race}]-(:{lbl_org})-[:{org2type}]->(orgtype:{lbl_ot})
+        RETURN person.nid AS nid, orgtype.name AS orgtype, collect(coalesce(part.points, 0)) AS points
+    """.format(lbl_person=lbl_person, lbl_part=lbl_participant, lbl_race=lbl_race, lbl_org=lbl_organization,
+               lbl_ot=lbl_organizationType, person2part=person2participant, part2race=participant2race,
+               org2race=organization2race, org2type=organization2type)
+    result_list = {nid: {def_wedstrijd: [], def_deelname: []} for nid in person_nids}
+    for batch in ns.model_iter("standings_points", query, nids=list(person_nids)):
+        for rec in batch:
+            # orgtype is None for a person without participations.
+            if rec["orgtype"]:
+                result_list[rec["nid"]][rec["orgtype"]] = rec["points"]
+    rows = []
     for nid in result_list:
-        params = dict(
-            deelname_nr=len(result_list[nid]),
-            deelname_points=len(result_list[nid] * points_deelname)
+        wedstrijd = result_list[nid][def_wedstrijd]
+        deelname = result_list[nid][def_deelname]
+        props = dict(
+            nid=nid,
+            wedstrijd_nr=len(wedstrijd),
+            wedstrijd_points=points_sum(wedstrijd),
+            deelname_nr=len(deelname),
+            deelname_points=len(deelname) * points_deelname
         )
-        deelname_total[nid] = params
-    # Merge wedstrijd_total and deelname_total
-    for nid in wedstrijd_total:
-        try:
-            wedstrijd_total[nid]["deelname_nr"] = deelname_total[nid]["deelname_nr"]
-            wedstrijd_total[nid]["deelname_points"] = deelname_total[nid]["deelname_points"]
-        except KeyError:
-            wedstrijd_total[nid]["deelname_nr"] = 0
-            wedstrijd_total[nid]["deelname_points"] = 0
-    # Now add participants in deelname_total and not in wedstrijd_total
-    deelname_only = [nid for nid in deelname_total if nid not in wedstrijd_total]
-    for nid in deelname_only:
-        wedstrijd_total[nid] = {}
-        wedstrijd_total[nid]["wedstrijd_nr"] = 0
-        wedstrijd_total[nid]["wedstrijd_points"] = 0
-        wedstrijd_total[nid]["deelname_nr"] = deelname_total[nid]["deelname_nr"]
-        wedstrijd_total[nid]["deelname_points"] = deelname_total[nid]["deelname_points"]
-    # Now calculate totals
-    for nid in wedstrijd_total:
-        wedstrijd_total[nid]["nr"] = wedstrijd_total[nid]["wedstrijd_nr"] + wedstrijd_total[nid]["deelname_nr"]
-        wedstrijd_total[nid]["points"] = wedstrijd_total[nid]["wedstrijd_points"] + \
-            wedstrijd_total[nid]["deelname_points"]
-    # Then convert dictionary in sorted list
-    result_total = []
-    for nid in wedstrijd_total:
-        person = Person(nid)
-        result_total.append([person.get_name(), wedstrijd_total[nid]["points"], wedstrijd_total[nid]["nr"], nid])
-    result_sorted = sorted(result_total, key=lambda x: -x[1])
-    return result_sorted
+        props["nr"] = props["wedstrijd_nr"] + props["deelname_nr"]
+        props["points"] = props["wedstrijd_points"] + props["deelname_points"]
+        rows.append(props)
+    return ns.nodes_set_attribs(rows, label=lbl_person)
+
+
+def standings_rebuild():
+    """
+    This method will calculate the standings for all persons.
+
+    :return: Number of person nodes updated.
+    """
+    query = "MATCH (person:{lbl_person}) RETURN person.nid AS nid".format(lbl_person=lbl_person)
+    return standings_update([rec["nid"] for batch in ns.model_iter("person_nids", query) for rec in batch])
+
+
+def standings_missing():
+    """
+    This method will calculate the standings for the persons that do not have standings yet. This is the case for all
+    persons on a database from before the standings were kept on the person nodes, and for persons that have been added
+    without participation.
+
+    :return: Number of person nodes updated.
+    """
+    query = """
+        MATCH (person:{lbl_person})
+        WHERE NOT EXISTS(person.nr)
+        RETURN person.nid AS nid
+    """.format(lbl_person=lbl_person)
+    person_nids = [rec["nid"] for batch in ns.model_iter("persons_without_standings", query) for rec in batch]
+    if person_nids:
+        current_app.logger.info("Calculate standings for {cnt} persons".format(cnt=len(person_nids)))
+    return standings_update(person_nids)
 
 
 def participation_points(mf, orgtype):
@@ -1776,24 +2167,61 @@ def participation_points(mf, orgtype):
     organization type
     """
     query = """
-        MATCH (person:Person)-[:mf]->(mf:MF  {name: {mf}}),
-              (person)-[:is]->(part)-[:participates]-(race:Race),
-              (race)<-[:has]-(org:Organization),
-              (org)-[:type]->(orgtype:OrgType {name: {orgtype}})
+        MATCH (person:{lbl_person})-[:{person2mf}]->(mf:{lbl_mf} {{name: $mf}}),
+              (person)-[:{person2part}]->(part)-[:{part2race}]-(race:{lbl_race}),
+              (race)<-[:{org2race}]-(org:{lbl_org}),
+              (org)-[:{org2type}]->(orgtype:{lbl_ot} {{name: $orgtype}})
         RETURN person.nid as person_nid, part.points as points
-    """
-    res = ns.get_query_data(query, mf=mf, orgtype=orgtype)
+    """.format(lbl_person=lbl_person, lbl_mf=lbl_mf, lbl_race=lbl_race, lbl_org=lbl_organization,
+               lbl_ot=lbl_organizationType, person2mf=person2mf, person2part=person2participant,
+               part2race=participant2race, org2race=organization2race, org2type=organization2type)
     result_list = defaultdict(list)
-    for rec in res:
-        result_list[rec["person_nid"]].append(rec["points"])
+    for batch in ns.model_iter("participation_points", query, mf=mf, orgtype=orgtype):
+        for rec in batch:
+            result_list[rec["person_nid"]].append(rec["points"])
     return result_list
 
 
-def remove_node_force(node_id):
+def remove_orphans():
+    """
+    This method removes all orphan Day and Location nodes.
+
+    :return: Number of nodes removed.
+    """
+    return sum(ns.remove_orphan_nodes(lbl) for lbl in [lbl_day, lbl_location])
+
+
+def start_orphan_sweeper(app, interval):
+    """
+    This method starts a background thread that removes orphan Day and Location nodes every interval seconds. Requests
+    that unlink a date or a location do not need to clean up, so the cleanup is not on the edit request path.
+    The sweeper also removes changes older than CHANGE_FEED_KEEP versions from the change feed.
+
+    :param app: Flask application, the sweeper runs in an application context of the application.
+    :param interval: Number of seconds between two sweeps.
+    :return: The sweeper thread.
+    """
+    def sweep():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    remove_orphans()
+                    ns.prune_changes(current_app.config.get("CHANGE_FEED_KEEP", 1000))
+                except Exception:
+                    current_app.logger.exception("Orphan sweep failed.")
+
+    sweeper = threading.Thread(target=sweep, name="orphan_sweeper", daemon=True)
+    sweeper.start()
+    return sweeper
+
+
+def remove_node_force(node_id, label=None):
     """
     This function will remove the node with node ID node_id, including relations with the node.
 
     :param node_id:
+    :param label: Label of the node, so that the lookup uses the unique nid constraint of the label.
     :return: True if node is deleted, False otherwise
     """
-    return ns.remove_node_force(node_id)
+    return ns.remove_node_force(node_id, label)
@@ -73,16 +73,20 @@ def get_modulename(scriptname):
     return module
 
 
-def init_loghandler(scriptname, logdir, loglevel):
+def init_loghandler(scriptname, logdir, loglevel, logger_name=None):
     """
     This function initializes the loghandler. Logfilename consists of calling module name + computername.
     Logfile directory is read from the project .ini file.
     Format of the logmessage is specified in basicConfig function.
     This is for Log Handler configuration. If basic log file configuration is required, then use init_logfile.
     Review logger, there seems to be a conflict with the flask logger.
+    If a logger name is specified, then the logfile is attached to this logger only, and messages of the logger are
+    not sent to the root logger. This is used for dedicated logfiles, e.g. the slow query log.
+    The handler for a logfile is added once, so the function can be called for every application that is created.
     :param scriptname: Name of the calling module.
     :param logdir: Directory of the logfile.
     :param loglevel: The loglevel for logging.
+    :param logger_name: Name of a dedicated logger, or None to configure the root logger.
     :return: logging handler
     """
     modulename = get_modulename(scriptname)
@@ -95,8 +99,10 @@ def init_loghandler(scriptname, logdir, loglevel):
     logging.getLogger("neo4j.bolt").setLevel(logging.WARNING)
     # logging.getLogger("neo4j.http").setLevel(logging.WARNING)
     logging.getLogger("httpstream").setLevel(logging.WARNING)
-    # Configure the root logger
-    logger = logging.getLogger()
+    # Configure the root logger, or the dedicated logger
+    logger = logging.getLogger(logger_name)
+    if logger_name:
+        logger.propagate = False
     level = logging.getLevelName(loglevel)
     logger.setLevel(level)
     # Create Console Handler
@@ -116,9 +122,12 @@ def init_loghandler(scriptname, logdir, loglevel):
     ch.setFormatter(formatter_console)
     # Add Formatter to Rotating File Handler
     rfh.setFormatter(formatter_file)
-    # Add Handler to the logger
+    # Add Handler to the logger, unless a handler for the logfile is attached already.
     # logger.addHandler(ch)
-    logger.addHandler(rfh)
+    if any(getattr(handler, "baseFilename", None) == rfh.baseFilename for handler in logger.handlers):
+        rfh.close()
+    else:
+        logger.addHandler(rfh)
     return logger
 
 
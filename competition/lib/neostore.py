@@ -1,14 +1,26 @@
 """
 This class consolidates functions and methods related to the neo4J datastore. These are specific to Neo4J store and
 independent from the application.
+The queries of the application run through methods model_query, model_iter and model_update. These get a query name
+with the Cypher query, so that the in-memory store can run its own version of the query (see module memqueries).
 """
 
+import logging
 import os
+import re
+import sys
+import threading
+import time
 import uuid
 from competition.lib.neostructure import *
+from contextlib import contextmanager
 from datetime import datetime, date
-from flask import current_app
-from py2neo import Database, Graph, Node, Relationship, NodeMatcher
+from flask import current_app, g, has_app_context
+from py2neo import Database, Graph, Node, Relationship
+
+
+# Name of the logger for statements that exceed configuration parameter SLOW_QUERY_MS.
+slow_logger = "slow_query"
 
 
 class NeoStore:
@@ -20,7 +32,10 @@ class NeoStore:
         :return: Object to handle neostore commands.
         """
         self.graph = self.connect2db()
-        self.nodematcher = NodeMatcher(self.graph)
+        # The open transaction is kept per thread, since the NeoStore object is shared by all requests.
+        self.local = threading.local()
+        # Number of changes made through this object, so that process caches know when to reload the graph version.
+        self.change_count = 0
         return
 
     @staticmethod
@@ -64,9 +79,36 @@ class NeoStore:
         props['nid'] = str(uuid.uuid4())
         current_app.logger.info("Trying to create node with params {p}".format(p=props))
         component = Node(*labels, **props)
-        self.graph.create(component)
+        with self.timed("CREATE node"):
+            self.runner().create(component)
+        self.modified(labels, [props["nid"]])
         return component
 
+    def clear_cache(self):
+        """
+        This method will clear the node cache of the request. It is called by every method that modifies the graph.
+
+        :return:
+        """
+        if has_app_context():
+            g.pop("neo_cache", None)
+        return
+
+    def changes_since(self, version):
+        """
+        This method returns the change feed: all changes after version, in order of version.
+
+        :param version: Graph version, as returned by graph_version.
+        :return: List of dictionaries with keys version, labels (list of labels) and nids (list of nids).
+        """
+        self.flush_request_changes()
+        query = """
+            MATCH (c:{lbl_change}) WHERE c.version > $version
+            RETURN c.version AS version, c.labels AS labels, c.nids AS nids
+            ORDER BY c.version
+        """.format(lbl_change=lbl_graphChange)
+        return self.get_query_data(query, version=version)
+
     def create_relation(self, from_node=None, rel=None, to_node=None):
         """
         Function to create relationship between nodes.
@@ -77,7 +119,33 @@ class NeoStore:
         :return:
         """
         rel = Relationship(from_node, rel, to_node)
-        self.graph.merge(rel)
+        with self.timed("MERGE relation"):
+            self.runner().merge(rel)
+        self.modified(node_labels(from_node) + node_labels(to_node), [from_node["nid"], to_node["nid"]])
+        return
+
+    def create_constraint(self, label, prop):
+        """
+        This method creates a unique constraint on property prop of the nodes with label. The constraint comes with an
+        index on the property. Schema statements cannot have parameters, so label and property go into the statement.
+
+        :param label: Label of the nodes.
+        :param prop: Property that must be unique.
+        :return:
+        """
+        stmt = "CREATE CONSTRAINT ON (n:{label}) ASSERT n.{prop} IS UNIQUE"
+        self.get_query(stmt.format(label=cypher_name(label), prop=cypher_name(prop)))
+        return
+
+    def create_index(self, label, prop):
+        """
+        This method creates an index on property prop of the nodes with label.
+
+        :param label: Label of the nodes.
+        :param prop: Property to index.
+        :return:
+        """
+        self.get_query("CREATE INDEX ON :{label}({prop})".format(label=cypher_name(label), prop=cypher_name(prop)))
         return
 
     def date_node(self, ds):
@@ -99,14 +167,53 @@ class NeoStore:
             props = dict(
                 key=ds.strftime('%Y-%m-%d')
             )
-            lbl = lbl_day
-            date_node = self.get_node(lbl, **props)
-            if not isinstance(date_node, Node):
-                date_node = self.create_node(lbl, **props)
-            return date_node
+            return self.get_or_create(lbl_day, props)
         else:
             return False
 
+    def flush_changes(self, labels, nids):
+        """
+        This method increments the version of the graph and the version of the labels, and adds the change to the
+        change feed. A change on unknown labels increments the version of def_any_label. Changes older than
+        configuration parameter CHANGE_FEED_KEEP versions are removed from the change feed in the same statement.
+
+        :param labels: Set of labels of the nodes that have been changed.
+        :param nids: Set of nids of the nodes that have been changed.
+        :return: The new version of the graph.
+        """
+        query = """
+            MERGE (v:{lbl_version} {{name: $graph}})
+            ON CREATE SET v.version = 0, v.nid = randomUUID()
+            SET v.version = v.version + 1, v.ts = timestamp()
+            CREATE (c:{lbl_change} {{nid: randomUUID(), version: v.version, labels: $labels, nids: $nids,
+                                    ts: timestamp()}})
+            FOREACH (label IN $labels |
+                MERGE (lv:{lbl_version} {{name: label}})
+                ON CREATE SET lv.nid = randomUUID()
+                SET lv.version = v.version)
+            WITH v
+            OPTIONAL MATCH (old:{lbl_change}) WHERE old.version <= v.version - $keep
+            DELETE old
+            RETURN DISTINCT v.version AS version
+        """.format(lbl_version=lbl_graphVersion, lbl_change=lbl_graphChange)
+        keep = current_app.config.get("CHANGE_FEED_KEEP", 1000) if has_app_context() else 1000
+        return self.get_query(query, graph=def_graph, labels=sorted(labels), nids=sorted(nids), keep=keep).evaluate()
+
+    def flush_request_changes(self):
+        """
+        This method records the changes that have been collected in the application context (request) as one change,
+        see modified. It is called when the application context ends and before the version is read, so that a request
+        sees its own changes.
+
+        :return: The new version of the graph, or None if there were no changes to record.
+        """
+        if not has_app_context():
+            return None
+        changes = g.pop("neo_changes", None)
+        if not changes or not (changes["labels"] or changes["nids"]):
+            return None
+        return self.flush_changes(changes["labels"], changes["nids"])
+
     def get_endnode(self, start_node=None, rel_type=None):
         """
         This method will calculate the end node from an start Node and a relation type. If relation type is not
@@ -121,9 +228,11 @@ class NeoStore:
         :return: End Node, or False.
         """
         res = self.get_endnodes(start_node, rel_type)
-        if (not res) or len(res) == 0:
+        if not res:
+            # get_endnodes returns False if start_node is not a node.
+            nid = start_node["nid"] if isinstance(start_node, Node) else None
             current_app.logger.warning("No end node found for start node ID: {nid} and relation: {rel}"
-                                       .format(nid=start_node["nid"], rel=rel_type))
+                                       .format(nid=nid, rel=rel_type))
             return False
         elif len(res) > 1:
             current_app.logger.warning("More than one end node found for start node ID {nid} and relation {rel},"
@@ -140,36 +249,54 @@ class NeoStore:
         :param rel_type: Relation type
         :return: List with End Nodes.
         """
-        if not rel_type:
-            rel_type = ""
         if not isinstance(start_node, Node):
             current_app.logger.error("Attribute not type Node (instead type {t})".format(t=type(start_node)))
             return False
-        query = "MATCH (sn {{nid:'{sn_nid}'}})-[:{rel}]->(en) RETURN en".format(sn_nid=start_node["nid"], rel=rel_type)
-        res = self.get_query_data(query)
+        cache = self.node_cache()
+        key = ("end", start_node["nid"], rel_type)
+        if key in cache:
+            return list(cache[key])
+        # The labels of the start node let the nid lookup use the unique nid constraint of the label.
+        query = "MATCH (sn{labels} {{nid: $nid}})-[{rel}]->(en) RETURN en"\
+            .format(labels=label_pattern(*start_node.labels), rel=rel_pattern(rel_type))
+        res = self.get_query_data(query, nid=start_node["nid"])
         node_list = [node["en"] for node in res]
         # Convert to set to remove duplicate end nodes
         node_set = set(node_list)
+        cache[key] = list(node_set)
         # Then return the result as a list
         return list(node_set)
 
+    def get_endnodes_many(self, nids, rel_type=None, label=None):
+        """
+        This method is the batch version of get_endnodes. It calculates the end nodes for a list of start nodes in a
+        single query. The result is also kept in the node cache, so get_endnodes calls for these start nodes do not
+        need a query anymore.
+
+        :param nids: List of nids of the start nodes.
+        :param rel_type: Relation type
+        :param label: Label of the start nodes, so that the nid lookup can use the index for the label.
+        :return: Dictionary with key start node nid and value list of end nodes.
+        """
+        return self.neighbours_many(nids, rel_type, label, "end")
+
     def get_node(self, *labels, **props):
         """
-        This method will select a single (or first) node that have labels and properties
+        This method will select a single (or first) node that have labels and properties. The query stops at the first
+        node found.
 
         :param labels: List of labels that are required for node match.
         :param props: Property dictionary required to match.
         :return: node that fulfills the criteria, or False if there is no node
         """
-        nodes = self.get_nodes(*labels, **props)
-        if not isinstance(nodes, list):
+        query = "MATCH (n{labels}) {where} RETURN n LIMIT 1".format(labels=label_pattern(*labels),
+                                                                    where=where_props(props))
+        node = self.get_query(query, **props).evaluate()
+        if not isinstance(node, Node):
             current_app.logger.debug("Looking for 1 node for label {lbl} and props {p}, found none."
                                      .format(lbl=labels, p=props))
             return False
-        elif len(nodes) > 1:
-            current_app.logger.error("Expected 1 node for label {lbl} and props {p}, found many {m}."
-                                     .format(lbl=labels, p=props, m=len(nodes)))
-        return nodes[0]
+        return node
 
     def get_nodes(self, *labels, **props):
         """
@@ -179,8 +306,14 @@ class NeoStore:
         :param props: Property dictionary required to match.
         :return: list of nodes that fulfill the criteria, or False if no nodes are found.
         """
-        nodes = self.nodematcher.match(*labels, **props)
-        nodelist = [node for node in nodes]
+        where = where_props(props)
+        if not labels:
+            # Metadata nodes are not part of the application graph.
+            metadata = "NOT n:{lbl_version} AND NOT n:{lbl_change}".format(lbl_version=lbl_graphVersion,
+                                                                           lbl_change=lbl_graphChange)
+            where = "{where} AND {m}".format(where=where, m=metadata) if where else "WHERE {m}".format(m=metadata)
+        query = "MATCH (n{labels}) {where} RETURN n".format(labels=label_pattern(*labels), where=where)
+        nodelist = [rec["n"] for rec in self.get_query_data(query, **props)]
         if len(nodelist) == 0:
             # No nodes found that fulfil the criteria
             return False
@@ -195,7 +328,7 @@ class NeoStore:
         :return: count of number of nodes that have been updated.
         """
         query = "MATCH (n) WHERE NOT EXISTS (n.nid) RETURN id(n) as node_id"
-        res = self.graph.run(query)
+        res = self.get_query_data(query)
         cnt = 0
         for rec in res:
             self.set_node_nid(node_id=rec["node_id"])
@@ -212,15 +345,64 @@ class NeoStore:
         res = self.get_query_data(query)
         return res[0]["cnt"]
 
+    def get_or_create(self, label, key_props, extra_props=None):
+        """
+        This method will return the node with label and key properties. If the node does not exist, then it is created
+        with the key properties, the extra properties and a nid. See merge_node.
+
+        :param label: Label of the node.
+        :param key_props: Property dictionary that identifies the node.
+        :param extra_props: Property dictionary that is set on the node only if the node is created.
+        :return: Node that has been found or created.
+        """
+        (node, _) = self.merge_node(label, key_props, extra_props)
+        return node
+
+    def graph_state(self):
+        """
+        This method returns the version of the graph and the time of the last change.
+
+        :return: Dictionary with keys version and ts (milliseconds since epoch). Both are 0 if there are no changes.
+        """
+        self.flush_request_changes()
+        query = "MATCH (v:{lbl_version} {{name: $graph}}) RETURN v.version AS version, v.ts AS ts"\
+            .format(lbl_version=lbl_graphVersion)
+        res = self.get_query_data(query, graph=def_graph)
+        if res:
+            return dict(version=res[0]["version"], ts=res[0]["ts"] or 0)
+        return dict(version=0, ts=0)
+
+    def graph_version(self, label=None):
+        """
+        This method returns the version of the graph, or the version of a label. The version increments on every change
+        in the graph. The version of a label is the graph version of the last change on nodes with the label, or on
+        unknown labels. This is a single small read, so caches can use it for validation.
+
+        :param label: Label, or None for the version of the graph.
+        :return: Version, 0 if there have been no changes.
+        """
+        self.flush_request_changes()
+        if label:
+            names = [label, def_any_label]
+        else:
+            names = [def_graph]
+        query = "MATCH (v:{lbl_version}) WHERE v.name IN $names RETURN max(v.version) AS version"\
+            .format(lbl_version=lbl_graphVersion)
+        return self.get_query(query, names=names).evaluate() or 0
+
     def get_query(self, query, **kwargs):
         """
         This method accepts a Cypher query and returns the result as a cursor.
+        Values must be passed as keyword parameters and referenced as $param in the query, never formatted into the
+        query text. This keeps the query text constant so that Neo4J can reuse the cached query plan.
 
         :param query: Cypher Query to run
         :param kwargs: Optional Keyword parameters for the query.
         :return: Result of the Cypher Query as a cursor.
         """
-        return self.graph.run(query, **kwargs)
+        with self.timed(query):
+            cursor = self.runner().run(query, **kwargs)
+        return cursor
 
     def get_query_data(self, query, **kwargs):
         """
@@ -230,7 +412,10 @@ class NeoStore:
         :param kwargs: Optional Keyword parameters for the query.
         :return: Result of the Cypher Query as a list of dictionaries.
         """
-        return self.get_query(query, **kwargs).data()
+        with self.timed(query) as stat:
+            res = self.runner().run(query, **kwargs).data()
+            stat["rows"] = len(res)
+        return res
 
     def get_query_df(self, query, **kwargs):
         """
@@ -240,7 +425,10 @@ class NeoStore:
         :param kwargs: Optional Keyword parameters for the query.
         :return: Result of the Cypher Query as a pandas dataframe.
         """
-        return self.get_query(query, **kwargs).to_data_frame()
+        with self.timed(query) as stat:
+            df = self.runner().run(query, **kwargs).to_data_frame()
+            stat["rows"] = len(df.index)
+        return df
 
     def get_startnode(self, end_node=None, rel_type=None):
         """
@@ -254,15 +442,29 @@ class NeoStore:
         :return: Start Node, or False.
         """
         res = self.get_startnodes(end_node, rel_type)
-        if len(res) == 0:
+        if not res:
+            # get_startnodes returns False if end_node is not a node.
+            nid = end_node["nid"] if isinstance(end_node, Node) else None
             current_app.logger.warning("No start node found for end node ID: {nid} and relation: {rel}"
-                                       .format(nid=end_node["nid"], rel=rel_type))
+                                       .format(nid=nid, rel=rel_type))
             return False
         elif len(res) > 1:
             current_app.logger.warning("More than one start node found for end node ID {nid} and relation {rel},"
                                        " returning first".format(nid=end_node["nid"], rel=rel_type))
         return res[0]
 
+    def get_startnodes_many(self, nids, rel_type=None, label=None):
+        """
+        This method is the batch version of get_startnodes. It calculates the start nodes for a list of end nodes in a
+        single query. The result is also kept in the node cache.
+
+        :param nids: List of nids of the end nodes.
+        :param rel_type: Relation type
+        :param label: Label of the end nodes, so that the nid lookup can use the index for the label.
+        :return: Dictionary with key end node nid and value list of start nodes.
+        """
+        return self.neighbours_many(nids, rel_type, label, "start")
+
     def get_startnodes(self, end_node=None, rel_type=None):
         """
         This method will calculate all start nodes from an end Node and a relation type. If relation type is not
@@ -273,20 +475,165 @@ class NeoStore:
         :param rel_type: Relation type
         :return: List with start nodes, or False.
         """
-        if not rel_type:
-            rel_type = ""
         if not isinstance(end_node, Node):
             current_app.logger.error("Attribute not type Node (instead type {t})".format(t=type(end_node)))
             return False
-        query = "MATCH (sn)-[:{rel}]->(en {{nid:'{en_nid}'}}) RETURN sn".format(en_nid=end_node["nid"], rel=rel_type)
-        res = self.get_query_data(query)
+        cache = self.node_cache()
+        key = ("start", end_node["nid"], rel_type)
+        if key in cache:
+            return list(cache[key])
+        # The labels of the end node let the nid lookup use the unique nid constraint of the label.
+        query = "MATCH (sn)-[{rel}]->(en{labels} {{nid: $nid}}) RETURN sn"\
+            .format(labels=label_pattern(*end_node.labels), rel=rel_pattern(rel_type))
+        res = self.get_query_data(query, nid=end_node["nid"])
         node_list = [node["sn"] for node in res]
         # Convert to set to remove duplicate end nodes
         node_set = set(node_list)
+        cache[key] = list(node_set)
         # Then return the result as a list
         return list(node_set)
 
-    def node(self, nid):
+    def iter_query(self, query, batch_size=1000, **kwargs):
+        """
+        This method accepts a Cypher query and returns a generator over the result. Records are read from the cursor
+        and yielded as lists of dictionaries of at most batch_size records, so that large results do not need to be
+        kept in memory at once.
+
+        Usage: for batch in ns.iter_query(query, mf=mf): for rec in batch: ...
+
+        :param query: Cypher Query to run
+        :param batch_size: Maximum number of records in a batch.
+        :param kwargs: Optional Keyword parameters for the query.
+        :return: Generator of lists of dictionaries.
+        """
+        with self.timed(query):
+            cursor = self.runner().run(query, **kwargs)
+        batch = []
+        for record in cursor:
+            batch.append(record.data())
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def neighbours_many(self, nids, rel_type, label, direction):
+        """
+        This method runs the UNWIND query for get_endnodes_many (direction end) and get_startnodes_many (direction
+        start).
+
+        :param nids: List of nids of the nodes.
+        :param rel_type: Relation type, or None for any relation type.
+        :param label: Label of the nodes, so that the nid lookup uses the unique nid constraint of the label. Without
+        label all nodes need to be scanned, this is logged as a warning.
+        :param direction: end - follow the relations from the nodes, start - follow the relations to the nodes.
+        :return: Dictionary with key node nid and value list of neighbour nodes.
+        """
+        if label:
+            labels = label_pattern(label)
+        else:
+            current_app.logger.warning("Neighbour lookup without label from {c}".format(c=query_caller()))
+            labels = ""
+        if direction == "end":
+            pattern = "(n{labels} {{nid: nid}})-[{rel}]->(m)"
+        else:
+            pattern = "(n{labels} {{nid: nid}})<-[{rel}]-(m)"
+        query = """
+            UNWIND $nids AS nid
+            MATCH {pattern}
+            RETURN nid, collect(DISTINCT m) AS nodes
+        """.format(pattern=pattern.format(labels=labels, rel=rel_pattern(rel_type)))
+        res = {nid: [] for nid in nids}
+        if nids:
+            for rec in self.get_query_data(query, nids=list(nids)):
+                res[rec["nid"]] = rec["nodes"]
+        cache = self.node_cache()
+        for nid in res:
+            cache[(direction, nid, rel_type)] = list(res[nid])
+        return res
+
+    def merge_node(self, label, key_props, extra_props=None):
+        """
+        This method will return the node with label and key properties, and if the node has been created. If the node
+        does not exist, then it is created with the key properties, the extra properties and a nid. This is done in a
+        single MERGE statement, so concurrent requests cannot create the same node twice.
+
+        :param label: Label of the node.
+        :param key_props: Property dictionary that identifies the node.
+        :param extra_props: Property dictionary that is set on the node only if the node is created.
+        :return: Tuple with the node that has been found or created, and True if the node has been created.
+        """
+        keys = ", ".join("{k}: $key.{k}".format(k=cypher_name(k)) for k in key_props)
+        query = """
+            MERGE (n:{label} {{{keys}}})
+            ON CREATE SET n += $extra, n.nid = $nid
+            RETURN n, n.nid = $nid AS created
+        """.format(label=cypher_name(label), keys=keys)
+        nid = str(uuid.uuid4())
+        res = self.get_query_data(query, key=key_props, extra=extra_props or {}, nid=nid)
+        if res[0]["created"]:
+            self.modified([label], [nid])
+        return res[0]["n"], res[0]["created"]
+
+    def modified(self, labels, nids):
+        """
+        This method is called by every method that modifies the graph. The node cache is cleared and the change is
+        collected, see pending_changes. The collected changes are recorded with a single statement: in a transaction
+        when the transaction is committed, otherwise when the application context ends or when the version is read.
+        Without application context the change is recorded immediately.
+
+        :param labels: List of labels of the changed nodes, or None if the labels are not known.
+        :param nids: List of nids of the changed nodes.
+        :return:
+        """
+        self.clear_cache()
+        self.change_count += 1
+        if labels is None:
+            labels = [def_any_label]
+        changes = self.pending_changes()
+        if changes is None:
+            self.flush_changes(set(labels), set(nids))
+        else:
+            changes["labels"].update(labels)
+            changes["nids"].update(nids)
+        return
+
+    def model_iter(self, query_name, query, batch_size=1000, **kwargs):
+        """
+        This method runs a query of the application and returns a generator over the result, see iter_query.
+
+        :param query_name: Name of the query, for the in-memory store.
+        :param query: Cypher Query to run
+        :param batch_size: Maximum number of records in a batch.
+        :param kwargs: Optional Keyword parameters for the query.
+        :return: Generator of lists of dictionaries.
+        """
+        return self.iter_query(query, batch_size=batch_size, **kwargs)
+
+    def model_query(self, query_name, query, **kwargs):
+        """
+        This method runs a query of the application and returns the result as a list of dictionaries. The Neo4J store
+        runs the Cypher query, the in-memory store runs the query with name query_name from module memqueries.
+
+        :param query_name: Name of the query, for the in-memory store.
+        :param query: Cypher Query to run
+        :param kwargs: Optional Keyword parameters for the query.
+        :return: Result of the query as a list of dictionaries.
+        """
+        return self.get_query_data(query, **kwargs)
+
+    def model_update(self, query_name, query, **kwargs):
+        """
+        This method runs a statement of the application that modifies the graph, see run_update.
+
+        :param query_name: Name of the statement, for the in-memory store.
+        :param query: Cypher statement to run
+        :param kwargs: Optional Keyword parameters for the statement.
+        :return: Result of the statement as a list of dictionaries.
+        """
+        return self.run_update(query, **kwargs).data()
+
+    def node(self, nid, label=None):
         """
         This method will get a node ID and return a node, or false in case no Node can be associated with the ID.
         Py2neo Release 3.1.2 throws a IndexError in case a none-existing node ID is requested.
@@ -294,41 +641,77 @@ class NeoStore:
         Note that since there seems to be no way to extract the Node ID of a node, the nid attribute is used. As a
         consequence, it is not possible to use the node(nid).
 
+        Specify the label of the node, so that the lookup uses the unique nid constraint of the label. Without label
+        all nodes need to be scanned. This is logged as a warning.
+
         :param nid: ID of the node to be found.
+        :param label: Label of the node.
         :return: Node, or False (None) in case the node could not be found.
         """
-        selected = self.nodematcher.match(nid=nid)
-        node = selected.first()
+        cache = self.node_cache()
+        key = ("node", nid)
+        if key in cache:
+            node = cache[key]
+            if label and isinstance(node, Node) and not node.has_label(label):
+                return None
+            return node
+        if label:
+            query = "MATCH (n:{label} {{nid: $nid}}) RETURN n LIMIT 1".format(label=cypher_name(label))
+        else:
+            current_app.logger.warning("Node lookup without label for nid {nid} from {c}"
+                                       .format(nid=nid, c=query_caller()))
+            query = "MATCH (n {nid: $nid}) RETURN n LIMIT 1"
+        node = self.get_query(query, nid=nid).evaluate()
+        # A lookup with label that did not return a node does not prove that the nid does not exist.
+        if isinstance(node, Node) or not label:
+            cache[key] = node
         return node
 
-    def node_props(self, nid=None):
+    def node_cache(self):
+        """
+        This method returns the node cache of the request, an identity map that is kept on Flask's g. Methods node,
+        get_endnodes and get_startnodes serve repeated lookups from the map. The map is cleared by every method that
+        modifies the graph. Outside of an application context a new (empty) dictionary is returned, so nothing is
+        cached.
+
+        :return: Dictionary with lookup key and the node or list of nodes.
+        """
+        if not has_app_context():
+            return {}
+        if "neo_cache" not in g:
+            g.neo_cache = {}
+        return g.neo_cache
+
+    def node_props(self, nid=None, label=None):
         """
         This method will get a node and return the node properties in a dictionary.
         This method can be used to add or modify one property and update the node. The application does not need to know
         all node attributes, only the attribute that is changed.
 
         :param nid: nid of the node required
+        :param label: Label of the node.
         :return: Dictionary of the node properties
         """
-        my_node = self.node(nid)
+        my_node = self.node(nid, label)
         if my_node:
             return dict(my_node)
         else:
             current_app.logger.error("Could not bind ID {node_id} to a node.".format(node_id=nid))
             return False
 
-    def node_set_attribs(self, **properties):
+    def node_set_attribs(self, label=None, **properties):
         """
         This method will set specified properties on the node. Modified properties will be updated and new properties
         will be added. Properties not in the dictionary will be left unchanged.
         Compare with method node_update, where node property set matches the **properties dictionary.
         nid needs to be part of the properties dictionary.
 
+        :param label: Label of the node.
         :param properties: Dictionary of the property set for the node. 'nid' property is mandatory.
         :return: True if successful update, False otherwise.
         """
         try:
-            my_node = self.node(properties["nid"])
+            my_node = self.node(properties["nid"], label)
         except KeyError:
             current_app.logger.error("Attribute 'nid' missing, required in dictionary.")
             return False
@@ -338,29 +721,61 @@ class NeoStore:
             for prop in properties:
                 my_node[prop] = properties[prop]
             # Now push the changes to Neo4J database.
-            self.graph.push(my_node)
+            with self.timed("PUSH node"):
+                self.runner().push(my_node)
+            self.modified(node_labels(my_node), [my_node["nid"]])
             return True
         else:
             current_app.logger.error("No node found for NID {nid}".format(nid=properties["nid"]))
             return False
 
-    def node_update(self, **properties):
+    def nodes_set_attribs(self, rows, label=None):
+        """
+        This method is the bulk version of node_set_attribs. Every row is a property dictionary for a node. The
+        properties are set on the node with the nid of the row, other properties on the node are left unchanged. All
+        rows are applied in a single UNWIND statement.
+
+        :param rows: List of property dictionaries. 'nid' property is mandatory in each dictionary.
+        :param label: Label of the nodes, so that the nid lookup can use the index for the label.
+        :return: Number of nodes that have been updated.
+        """
+        if not rows:
+            return 0
+        if label:
+            labels = label_pattern(label)
+        else:
+            labels = ""
+        query = """
+            UNWIND $rows AS row
+            MATCH (n{labels} {{nid: row.nid}})
+            SET n += row
+            RETURN count(n) AS cnt
+        """.format(labels=labels)
+        res = self.get_query_data(query, rows=rows)
+        self.modified([label] if label else None, [row["nid"] for row in rows])
+        cnt = res[0]["cnt"]
+        if cnt != len(rows):
+            current_app.logger.error("Expected to update {r} nodes, but {c} nodes updated.".format(r=len(rows), c=cnt))
+        return cnt
+
+    def node_update(self, label=None, **properties):
         """
         This method will update the node's properties with the properties specified. Modified properties will be
         updated, new properties will be added and removed properties will be deleted.
         Compare with method node_set_attribs, where node properties are never removed.
         nid needs to be part of the properties dictionary.
 
+        :param label: Label of the node.
         :param properties: Dictionary of the property set for the node. 'nid' property is mandatory.
         :return: Updated node if successful, False otherwise.
         """
         try:
-            my_node = self.node(properties["nid"])
+            my_node = self.node(properties["nid"], label)
         except KeyError:
             current_app.logger.error("Attribute 'nid' missing, required in dictionary.")
             return False
         if isinstance(my_node, Node):
-            curr_props = self.node_props(properties["nid"])
+            curr_props = dict(my_node)
             # Remove properties
             remove_props = [prop for prop in curr_props if prop not in properties]
             for prop in remove_props:
@@ -371,23 +786,84 @@ class NeoStore:
             for prop in properties:
                 my_node[prop] = properties[prop]
             # Now push the changes to Neo4J database.
-            self.graph.push(my_node)
+            with self.timed("PUSH node"):
+                self.runner().push(my_node)
+            self.modified(node_labels(my_node), [my_node["nid"]])
             return my_node
         else:
             current_app.logger.error("No node found for NID {nid}".format(nid=properties["nid"]))
             return False
 
-    def relations(self, nid):
+    def record_query(self, statement, seconds, rows=None):
+        """
+        This method records a statement that has been run on the database. The statement is added to the totals of the
+        request and logged on debug level with the calling method. Statements that took longer than configuration
+        parameter SLOW_QUERY_MS are written to the slow query log.
+
+        :param statement: Cypher statement, or description of the py2neo operation.
+        :param seconds: Duration of the statement in seconds.
+        :param rows: Number of rows returned, or None if unknown (cursor).
+        :return:
+        """
+        if not has_app_context():
+            return
+        stats = self.request_stats()
+        stats["queries"] += 1
+        stats["time"] += seconds
+        msec = seconds * 1000
+        caller = query_caller()
+        current_app.logger.debug("{c} - {ms:.1f} ms - {r} rows".format(c=caller, ms=msec, r=rows))
+        if msec >= current_app.config.get("SLOW_QUERY_MS", 250):
+            msg = "{c} - {ms:.1f} ms - {r} rows - {q}".format(c=caller, ms=msec, r=rows, q=" ".join(statement.split()))
+            logging.getLogger(slow_logger).warning(msg)
+        return
+
+    def pending_changes(self):
+        """
+        This method returns the collection of changes that are not recorded yet: the changes of the open transaction
+        of this thread, otherwise the changes of the application context (request), kept on Flask's g.
+
+        :return: Dictionary with keys labels and nids (sets), or None if the change must be recorded immediately.
+        """
+        changes = getattr(self.local, "changes", None)
+        if changes is None and has_app_context():
+            if "neo_changes" not in g:
+                g.neo_changes = dict(labels=set(), nids=set())
+            changes = g.neo_changes
+        return changes
+
+    def prune_changes(self, keep):
+        """
+        This method removes old changes from the change feed. The versions are not changed.
+
+        :param keep: Number of most recent versions to keep in the change feed.
+        :return: Number of changes removed.
+        """
+        query = """
+            MATCH (v:{lbl_version} {{name: $graph}})
+            MATCH (c:{lbl_change}) WHERE c.version <= v.version - $keep
+            DELETE c
+            RETURN count(*) AS cnt
+        """.format(lbl_version=lbl_graphVersion, lbl_change=lbl_graphChange)
+        return self.get_query(query, graph=def_graph, keep=keep).evaluate()
+
+    def relations(self, nid, label=None):
         """
         This method will check if node with ID has relations. Returns True if there are relations, returns False
         otherwise. Do not use graph.degree, because there seems to be a strange error when running on graphenedb...
 
         :param nid: ID of the object to check relations
+        :param label: Label of the node, so that the lookup uses the unique nid constraint of the label.
         :return: Number of relations - if there are relations, False - there are no relations.
         """
-        # obj_node = self.node(nid)
-        query = "MATCH (n)--(m) WHERE n.nid='{nid}' return m.nid as m_nid".format(nid=nid)
-        res = self.get_query_data(query)  # This will return the list of dictionaries with results.
+        if label:
+            labels = label_pattern(label)
+        else:
+            current_app.logger.warning("Relations lookup without label for nid {nid} from {c}"
+                                       .format(nid=nid, c=query_caller()))
+            labels = ""
+        query = "MATCH (n{labels} {{nid: $nid}})--(m) RETURN m.nid as m_nid".format(labels=labels)
+        res = self.get_query_data(query, nid=nid)  # This will return the list of dictionaries with results.
         if isinstance(res, list):
             return len(res)
         else:
@@ -403,42 +879,63 @@ class NeoStore:
         if not isinstance(node, Node):
             current_app.logger.error("Node expected, but got type {t} Input: {n}".format(t=type(node), n=node))
             return False
-        degree = self.relations(node["nid"])
+        degree = self.relations(node["nid"], next(iter(node.labels), None))
         if degree:
             msg = "Request to delete node nid {node_id}, but {x} relations found. Node not deleted"\
                 .format(node_id=node["nid"], x=degree)
             current_app.logger.warning(msg)
             return False
         else:
-            self.graph.delete(node)
+            with self.timed("DELETE node"):
+                self.runner().delete(node)
+            self.modified(node_labels(node), [node["nid"]])
             return True
 
-    def remove_node_force(self, nid):
+    def remove_node_force(self, nid, label=None):
         """
         This method will remove node with ID node_id. The node and the relations to/from the node will also be deleted.
         Note that this needs to use nid instead of node, since graph.delete has a CONSTRAINT on relations.
 
         :param nid: nid of the node
+        :param label: Label of the node, so that the lookup uses the unique nid constraint of the label.
         :return:
         """
-        query = "MATCH (n) WHERE n.nid='{nid}' DETACH DELETE n".format(nid=nid)
-        self.graph.run(query)
+        if label:
+            labels = label_pattern(label)
+        else:
+            current_app.logger.warning("Node removal without label for nid {nid} from {c}"
+                                       .format(nid=nid, c=query_caller()))
+            labels = ""
+        query = """
+            MATCH (n{labels} {{nid: $nid}})
+            WITH n, labels(n) AS labels
+            DETACH DELETE n
+            RETURN labels
+        """.format(labels=labels)
+        labels = self.get_query(query, nid=nid).evaluate()
+        self.modified(labels or [], [nid])
         return
 
     def remove_orphan_nodes(self, label):
         """
         This method removes orphan nodes of a specific Type (Location, Date). Orphan nodes have no relation to other
-        nodes.
+        nodes. All orphan nodes of the label are removed in a single statement.
 
-        :return:
+        :param label: Label of the nodes to check.
+        :return: Number of nodes removed.
         """
-        query = "MATCH (node:{label}) WHERE NOT (node)--() RETURN node".format(label=label)
-        cursor = self.get_query(query)
-        while cursor.forward():
-            rec = cursor.current
-            current_app.logger.info("Remove orphan Node type {lbl} - Node: {node}".format(lbl=label, node=rec["node"]))
-            self.remove_node(rec["node"])
-        return
+        query = """
+            MATCH (node:{label}) WHERE NOT (node)--()
+            WITH node, node.nid AS nid
+            DELETE node
+            RETURN collect(nid) AS nids
+        """.format(label=cypher_name(label))
+        nids = self.get_query(query).evaluate() or []
+        cnt = len(nids)
+        if cnt:
+            self.modified([label], nids)
+            current_app.logger.info("Removed {cnt} orphan nodes type {lbl}".format(cnt=cnt, lbl=label))
+        return cnt
 
     def remove_relation(self, start_node=None, end_node=None, rel_type=None):
         """
@@ -452,10 +949,105 @@ class NeoStore:
         # Todo: rename the method to remove_relation.
         rel = Relationship(start_node, rel_type, end_node)
         # Do I need to merge first?
-        self.graph.merge(rel)
-        self.graph.separate(rel)
+        runner = self.runner()
+        with self.timed("SEPARATE relation"):
+            runner.merge(rel)
+            runner.separate(rel)
+        self.modified(node_labels(start_node) + node_labels(end_node), [start_node["nid"], end_node["nid"]])
         return
 
+    def run_update(self, query, **kwargs):
+        """
+        This method accepts a Cypher statement that modifies the graph and returns the result as a cursor. Use this
+        method instead of get_query for all statements that modify the graph, so that the node cache is cleared and
+        the change is recorded. The labels of the changed nodes are not known, so the change is recorded on
+        def_any_label.
+
+        :param query: Cypher statement to run
+        :param kwargs: Optional Keyword parameters for the statement.
+        :return: Result of the Cypher statement as a cursor.
+        """
+        cursor = self.get_query(query, **kwargs)
+        self.modified(None, [])
+        return cursor
+
+    def request_stats(self):
+        """
+        This method returns the database statistics of the request: number of statements and total time in seconds.
+        The statistics are kept on Flask's g, so they are reset for every request.
+
+        :return: Dictionary with keys queries and time.
+        """
+        if "db_stats" not in g:
+            g.db_stats = dict(queries=0, time=0.0)
+        return g.db_stats
+
+    def runner(self):
+        """
+        This method returns the object to run statements on: the open transaction if there is one for this thread,
+        otherwise the graph (auto-commit).
+
+        :return: py2neo Transaction or Graph.
+        """
+        tx = getattr(self.local, "tx", None)
+        if tx is None:
+            return self.graph
+        return tx
+
+    @contextmanager
+    def transaction(self):
+        """
+        This method returns a context manager that runs all NeoStore reads and writes in the block as one explicit
+        transaction. The transaction is committed when the block ends, or rolled back if the block raises an exception.
+        A nested call joins the transaction that is already open, so model methods can call each other.
+
+        Usage: with ns.transaction(): ...
+
+        :return: py2neo Transaction for the block.
+        """
+        tx = getattr(self.local, "tx", None)
+        if tx is not None:
+            yield tx
+            return
+        tx = self.graph.begin()
+        self.local.tx = tx
+        self.local.changes = dict(labels=set(), nids=set())
+        try:
+            yield tx
+            # Record the changes in the transaction, so that they are committed with the changes.
+            changes = self.local.changes
+            if changes["labels"] or changes["nids"]:
+                self.flush_changes(changes["labels"], changes["nids"])
+        except Exception:
+            current_app.logger.error("Transaction failed, rolling back.")
+            tx.rollback()
+            # Nodes read in the transaction may not exist anymore.
+            self.clear_cache()
+            raise
+        else:
+            tx.commit()
+            # The changes are visible for other connections now.
+            self.change_count += 1
+        finally:
+            self.local.tx = None
+            self.local.changes = None
+
+    @contextmanager
+    def timed(self, statement):
+        """
+        This method returns a context manager that measures the duration of the block and records the statement. The
+        block can set the number of rows in the dictionary that is returned by the context manager.
+
+        :param statement: Cypher statement, or description of the py2neo operation.
+        :return: Dictionary with key rows.
+        """
+        stat = dict(rows=None)
+        start = time.perf_counter()
+        try:
+            yield stat
+        finally:
+            self.record_query(statement, time.perf_counter() - start, stat["rows"])
+
     def set_node_nid(self, node_id):
         """
         This method will set a nid for node with node_id. This should be done only for calendar functions.
@@ -463,11 +1055,51 @@ class NeoStore:
         :param node_id: Neo4J ID of the node
         :return: nothing, nid should be set.
         """
-        query = "MATCH (n) WHERE id(n)={node_id} SET n.nid='{nid}' RETURN n.nid"
-        self.graph.run(query.format(node_id=node_id, nid=str(uuid.uuid4())))
+        query = "MATCH (n) WHERE id(n) = $node_id SET n.nid = $nid RETURN n.nid"
+        self.run_update(query, node_id=node_id, nid=str(uuid.uuid4()))
         return
 
 
+def store_factory(backend="neo4j"):
+    """
+    This function returns the store object for the backend. Backend 'memory' returns the in-memory store, which does
+    not need a Neo4J server. Any other value returns the Neo4J store.
+
+    :param backend: Name of the backend, from configuration parameter NEO4J_BACKEND.
+    :return: Object to handle neostore commands.
+    """
+    if backend == "memory":
+        # Import here, since memstore imports NeoStore from this module.
+        from competition.lib.memstore import MemStore
+        return MemStore()
+    return NeoStore()
+
+
+def query_caller():
+    """
+    This function finds the method that called the store: the first frame on the stack that is not in this module or
+    in contextlib.
+
+    :return: String module.function of the caller.
+    """
+    frame = sys._getframe(1)
+    while frame.f_back and frame.f_globals.get("__name__") in (__name__, "contextlib"):
+        frame = frame.f_back
+    return "{m}.{f}".format(m=frame.f_globals.get("__name__"), f=frame.f_code.co_name)
+
+
+def node_labels(node):
+    """
+    This function returns the labels of a node.
+
+    :param node: Node
+    :return: List of labels, or empty list if node is not a Node.
+    """
+    if isinstance(node, Node):
+        return list(node.labels)
+    return []
+
+
 def validate_node(node, label):
     """
     BE CAREFUL: has_label does not always work for unknown reason.
@@ -481,3 +1113,53 @@ def validate_node(node, label):
         return node.has_label(label)
     else:
         return False
+
+
+def cypher_name(name):
+    """
+    Labels and relation types cannot be passed as query parameters, so these need to be added to the query text. This
+    function verifies that the name is a plain identifier (as the constants in neostructure) before it goes into a
+    query.
+
+    :param name: Label or relation type.
+    :return: The name, if it is a valid identifier. ValueError is raised otherwise.
+    """
+    if not isinstance(name, str) or not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+        raise ValueError("Invalid label or relation type: {n}".format(n=name))
+    return name
+
+
+def rel_pattern(rel_type=None):
+    """
+    This function returns the content of a relation pattern [...] for a relation type. If no relation type is
+    specified, then any relation type will match.
+
+    :param rel_type: Relation type, or None.
+    :return: String ':rel_type', or empty string for any relation type.
+    """
+    if not rel_type:
+        return ""
+    return ":{rel}".format(rel=cypher_name(rel_type))
+
+
+def label_pattern(*labels):
+    """
+    This function returns the label part of a node pattern.
+
+    :param labels: Labels for the node.
+    :return: String ':Label1:Label2', or empty string if there are no labels.
+    """
+    return "".join(":{lbl}".format(lbl=cypher_name(lbl)) for lbl in labels)
+
+
+def where_props(props):
+    """
+    This function returns a WHERE clause that matches node n on the properties. Property names are vetted and the
+    values are referenced as parameters with the same name, so the props dictionary is passed as query parameters.
+
+    :param props: Property dictionary required to match.
+    :return: String 'WHERE n.key = $key AND ...', or empty string if there are no properties.
+    """
+    if not props:
+        return ""
+    return "WHERE " + " AND ".join("n.{k} = ${k}".format(k=cypher_name(k)) for k in props)
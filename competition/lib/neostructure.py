@@ -9,11 +9,20 @@ lbl_person = "Person"
 lbl_race = "Race"
 lbl_raceType = "RaceType"
 
+# Metadata nodes, these are not part of the application graph.
+lbl_graphChange = "GraphChange"
+lbl_graphVersion = "GraphVersion"
+lbl_schemaVersion = "SchemaVersion"
+# Name of the GraphVersion node for the version of the graph, and for changes on unknown labels.
+def_graph = "graph"
+def_any_label = "*"
+
 # Relations
 organization2date = "On"
 organization2location = "In"
 organization2race = "has"
 organization2type = "type"
+# participant2participant is replaced by the seq property on the participant, kept for migration only.
 participant2participant = "after"
 participant2race = "participates"
 person2mf = "mf"
@@ -0,0 +1,198 @@
+"""
+This module handles caching of the public read pages. The state of the graph (version and time of last change) is read
+from the graph at most once every GRAPH_STATE_TTL seconds, or after a change made by this process. Pages validate
+against this state, so an unchanged page can be answered without a query to Neo4J or a template render.
+Rendered tables are kept in a fragment cache, keyed on the graph version. A request that cannot be answered with 304
+(other user, first visit) gets the table from the cache without running the queries and rendering the table again.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from competition.lib.models_graph import ns
+from datetime import datetime
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from functools import wraps
+from markupsafe import Markup
+
+# Graph state cache: graph state, time it has been read and the store change count at that time.
+state_cache = dict(state=None, read_at=0.0, change_count=None)
+state_lock = threading.Lock()
+
+
+class FragmentCache:
+    """
+    The fragment cache keeps rendered HTML fragments in memory. The least recently used fragments are removed when the
+    cache has more than FRAGMENT_CACHE_ENTRIES fragments or the fragments have more than FRAGMENT_CACHE_SIZE
+    characters.
+    """
+
+    def __init__(self):
+        self.fragments = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def clear(self):
+        """
+        This method removes all fragments from the cache.
+
+        :return:
+        """
+        with self.lock:
+            self.fragments.clear()
+            self.size = 0
+        return
+
+    def get(self, key):
+        """
+        This method returns the fragment for the key and marks it as most recently used.
+
+        :param key: Key of the fragment.
+        :return: Fragment, or None if the key is not in the cache.
+        """
+        with self.lock:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                self.fragments.move_to_end(key)
+            return fragment
+
+    def put(self, key, fragment):
+        """
+        This method adds the fragment to the cache, then removes the least recently used fragments until the cache is
+        within its limits. A fragment that is bigger than the cache is not added.
+
+        :param key: Key of the fragment.
+        :param fragment: Rendered fragment.
+        :return:
+        """
+        max_entries = current_app.config.get("FRAGMENT_CACHE_ENTRIES", 32)
+        max_size = current_app.config.get("FRAGMENT_CACHE_SIZE", 8 * 1024 * 1024)
+        if len(fragment) > max_size:
+            return
+        with self.lock:
+            if key in self.fragments:
+                self.size -= len(self.fragments.pop(key))
+            self.fragments[key] = fragment
+            self.size += len(fragment)
+            while len(self.fragments) > max_entries or self.size > max_size:
+                (_, old_fragment) = self.fragments.popitem(last=False)
+                self.size -= len(old_fragment)
+        return
+
+
+fragment_cache = FragmentCache()
+
+
+def cached(render, *key):
+    """
+    This function returns a rendered string (HTML fragment or JSON payload) from the fragment cache. The key is
+    extended with the graph version, so the string is rendered again after every change in the graph. The render
+    function is called only if the string is not in the cache. It must run the queries for the string, so that these
+    are skipped as well.
+
+    :param render: Function without arguments that returns the rendered string.
+    :param key: Key of the string, e.g. template name and mf.
+    :return: Rendered string.
+    """
+    key = key + (graph_state()["version"],)
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        fragment = render()
+        fragment_cache.put(key, fragment)
+    return fragment
+
+
+def cached_fragment(render, *key):
+    """
+    This function returns a rendered HTML fragment from the fragment cache, see function cached.
+
+    :param render: Function without arguments that returns the rendered fragment.
+    :param key: Key of the fragment, e.g. template name and mf.
+    :return: Fragment as Markup, so that it is not escaped in the page template.
+    """
+    return Markup(cached(render, *key))
+
+
+def graph_state():
+    """
+    This function returns the graph state from the cache. The state is read from the graph if it is older than
+    GRAPH_STATE_TTL seconds, or if the graph has been changed by this process since it has been read.
+
+    :return: Dictionary with keys version, ts (milliseconds since epoch) and read_ts (time the state has been read,
+    milliseconds since epoch).
+    """
+    ttl = current_app.config.get("GRAPH_STATE_TTL", 2)
+    with state_lock:
+        if state_cache["state"] is None \
+                or state_cache["change_count"] != ns.change_count \
+                or time.monotonic() - state_cache["read_at"] > ttl:
+            state_cache["change_count"] = ns.change_count
+            state_cache["state"] = dict(ns.graph_state(), read_ts=int(time.time() * 1000))
+            state_cache["read_at"] = time.monotonic()
+        return state_cache["state"]
+
+
+def last_modified(state):
+    """
+    This function returns the Last-Modified time for the graph state. HTTP dates have a resolution of seconds, so a
+    client that validates with If-Modified-Since cannot see a second change in the same second as the first one. The
+    time is therefore only given when the second of the last change was over at the time the state has been read, then
+    every later change is in a later second.
+
+    :param state: Graph state, as returned by graph_state.
+    :return: Time of the last change (UTC, whole seconds), or None if the second of the last change was not over.
+    """
+    second = state["ts"] // 1000
+    if state["read_ts"] < (second + 1) * 1000:
+        return None
+    return datetime.utcfromtimestamp(second)
+
+
+def user_key():
+    """
+    This function returns the user part of the cache key. Pages show edit links for logged in users, so the pages for
+    a logged in user are different from the pages for anonymous users.
+
+    :return: String with user id, or anon for anonymous users.
+    """
+    if current_user.is_authenticated:
+        return "u{uid}".format(uid=current_user.get_id())
+    return "anon"
+
+
+def conditional(view):
+    """
+    This decorator adds conditional GET support to a view. The ETag is the graph version and the user key, the
+    Last-Modified header is the time of the last change in the graph, see function last_modified. If the request has a
+    matching If-None-Match or If-Modified-Since header, then 304 Not Modified is returned without calling the view.
+    Requests with flashed messages are not cached, since the messages are shown only once.
+
+    :param view: View function
+    :return: Decorated view function.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET" or session.get("_flashes"):
+            return view(*args, **kwargs)
+        state = graph_state()
+        etag = "{v}-{u}".format(v=state["version"], u=user_key())
+        modified_at = last_modified(state)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since and modified_at:
+            not_modified = request.if_modified_since.replace(tzinfo=None) >= modified_at
+        else:
+            not_modified = False
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        if modified_at:
+            response.last_modified = modified_at
+        # Browsers must revalidate on every request, shared caches must not store the page.
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        return response
+    return wrapper
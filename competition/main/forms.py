@@ -37,7 +37,9 @@ class ParticipantAdd(Form):
     Form to Add a participant to a race. Timefield is not included. It is not part of wtforms 2 (wait for wtforms
     version 3), it is currently not used and it may not be required in the future.
     """
-    name = SelectField('Naam', coerce=str)
+    # The person is selected with the search field, the nid of the selected person is in field name.
+    search = StringField('Naam', render_kw=dict(autocomplete="off"))
+    name = HiddenField()
     pos = StringField('Plaats')
     # remark = StringField('Opm.')
     prev_runner = SelectField('Aankomst na:', coerce=str)
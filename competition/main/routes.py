@@ -1,6 +1,7 @@
 from competition.lib import my_env, models_graph as mg
-from competition.lib.neostructure import def_nevenwedstrijd
-from flask import render_template, flash, current_app, redirect, url_for, request
+from competition.lib.webcache import cached_fragment, conditional
+from competition.lib.neostructure import def_nevenwedstrijd, lbl_race
+from flask import render_template, flash, current_app, redirect, url_for, request, jsonify
 from flask_login import login_required, login_user, logout_user, current_user
 from .forms import *
 from . import main
@@ -61,7 +62,8 @@ def pwd_update():
 def initenv():
     """
     This method will initialize the environment: register a user, set the default nodes and indeces.
-    This will be done on an empty database only.
+    This will be done on an empty database only. On an existing database the graph structure is updated and the
+    standings are rebuilt.
 
     :return:
     """
@@ -101,8 +103,8 @@ def person_add(person_id=None):
             form.name.data = person.get_name()
         else:
             form = PersonAdd()
-        persons = mg.person_list()
-        return render_template('person_add.html', form=form, persons=persons)
+        (persons, next_page) = mg.person_page(limit=current_app.config["PAGE_SIZE"])
+        return render_template('person_add.html', form=form, persons=persons, next_page=next_page)
     else:
         # request.method == "POST":
         form = PersonAdd()
@@ -134,11 +136,18 @@ def person_edit(pers_id):
 
 
 @main.route('/person/list')
+@conditional
 def person_list():
-    persons = mg.person_list()
-    for person in persons:
-        current_app.logger.info(person)
-    return render_template('person_list.html', persons=persons)
+    """
+    This method shows a page of the person list. The page starts after the person in request arguments after_mf and
+    after_name.
+
+    :return:
+    """
+    (persons, next_page) = mg.person_page(after_mf=request.args.get("after_mf"),
+                                          after_name=request.args.get("after_name"),
+                                          limit=current_app.config["PAGE_SIZE"])
+    return render_template('person_list.html', persons=persons, next_page=next_page)
 
 
 @main.route('/person/<pers_id>')
@@ -154,8 +163,9 @@ def person_summary(pers_id):
     races = mg.races4person(pers_id)
     # Don't count on len(races), since this is competition races. Remove person only if not used across all
     # competitions.
-    persons = mg.person_list()
-    return render_template('person_races_list.html', person=person_dict, races=races, persons=persons)
+    (persons, next_page) = mg.person_page(limit=current_app.config["PAGE_SIZE"])
+    return render_template('person_races_list.html', person=person_dict, races=races, persons=persons,
+                           next_page=next_page)
 
 
 @main.route('/person/<pers_id>/delete')
@@ -175,9 +185,24 @@ def person_delete(pers_id):
 
 
 @main.route('/organization/list')
+@conditional
 def organization_list():
-    organizations = mg.organization_list()
-    return render_template('organization_list.html', organizations=organizations)
+    """
+    This method shows a page of the organization list. Request arguments start and end (YYYY-MM-DD) select the
+    organizations on a date window, the page starts after the organization in request arguments after_date and
+    after_id.
+
+    :return:
+    """
+    window = dict(start=request.args.get("start"), end=request.args.get("end"))
+    (organizations, next_page) = mg.organization_page(after_date=request.args.get("after_date"),
+                                                      after_id=request.args.get("after_id"),
+                                                      limit=current_app.config["PAGE_SIZE"],
+                                                      **window)
+    if next_page:
+        # Keep the date window on the next page.
+        next_page.update({k: v for (k, v) in window.items() if v})
+    return render_template('organization_list.html', organizations=organizations, next_page=next_page)
 
 
 @main.route('/organization/add', methods=['GET', 'POST'])
@@ -363,6 +388,7 @@ def race_edit(org_id, race_id):
 
 
 @main.route('/participant/<race_id>/list', methods=['GET'])
+@conditional
 def participant_list(race_id):
     """
     This method will show the participants in sequence of arrival for a race.
@@ -400,8 +426,6 @@ def participant_add(race_id):
         part_last = race.part_person_last_id()
         # Initialize Form
         form = ParticipantAdd(prev_runner=part_last)
-        next_part_nodes = race.get_next_part()
-        form.name.choices = [(x["person"]["nid"], x["person"]["name"]) for x in next_part_nodes]
         form.prev_runner.choices = race.part_person_after_list()
         param_dict = dict(
             form=form,
@@ -418,22 +442,47 @@ def participant_add(race_id):
         form = ParticipantAdd()
         # Add collected info as participant to race.
         runner_id = form.name.data
+        if not runner_id:
+            flash("Kies een deelnemer uit de lijst.")
+            return redirect(url_for('main.participant_add', race_id=race_id))
         prev_runner_id = form.prev_runner.data
-        # Create the participant node, connect to person and to race.
-        part = mg.Participant(race_id=race_id, person_id=runner_id)
-        part.add(prev_person_id=prev_runner_id)
         # Collect properties for this participant so that they can be added to the participant node.
         props = {}
         for prop in part_config_props:
             if form.data[prop]:
                 props[prop] = form.data[prop]
-        part.set_props(**props)
-        # Get organization, recalculate points
-        org = mg.Organization(org_id=race.get_org_id())
-        org.calculate_points()
+        # Participant, sequence of arrival, properties and points are added in one transaction, so that a failure
+        # does not leave a participant without position or points.
+        with mg.ns.transaction():
+            # Create the participant node, connect to person and to race.
+            part = mg.Participant(race_id=race_id, person_id=runner_id)
+            part.add(prev_person_id=prev_runner_id)
+            part.set_props(**props)
+            # Get organization, recalculate points
+            org = mg.Organization(org_id=race.get_org_id())
+            org.calculate_points()
         return redirect(url_for('main.participant_add', race_id=race_id))
 
 
+@main.route('/participant/<race_id>/search', methods=['GET'])
+@login_required
+def participant_search(race_id):
+    """
+    This method returns the persons that can be added to the race, with a name starting with request argument q. It
+    is called from the participant add form while the name is typed.
+
+    :param race_id: ID of the race.
+    :return: JSON list of persons, each person is a dictionary with nid and name. Status 404 if the race does not exist.
+    """
+    if not mg.ns.node(race_id, lbl_race):
+        return jsonify(dict(error="Race not found.")), 404
+    prefix = request.args.get("q", "").strip()
+    if not prefix:
+        return jsonify([])
+    race = mg.Race(race_id=race_id)
+    return jsonify(race.get_next_part(prefix, limit=current_app.config["SEARCH_LIMIT"]))
+
+
 @main.route('/participant/edit/<part_id>', methods=['GET', 'POST'])
 @login_required
 def participant_edit(part_id):
@@ -445,21 +494,23 @@ def participant_edit(part_id):
     """
     part = mg.Participant(part_id=part_id)
     person_nid = part.get_person_nid()
-    person = mg.Person(person_id=person_nid)
-    person_dict = person.get_dict()
     race_id = part.get_race_nid()
-    race = mg.Race(race_id=race_id)
-    race_label = race.get_label()
     if request.method == "GET":
         # Get method, initialize page.
-        org = mg.Organization(race_id=race_id)
-        org_id = org.get_nid()
+        race = mg.Race(race_id=race_id)
+        race_label = race.get_label()
+        org_id = race.get_org_id()
         # Initialize Form, populate with keyword arguments
         # (http://wtforms.readthedocs.io/en/latest/crash_course.html#how-forms-get-data)
         part_props = part.get_props()
         form = ParticipantEdit(**part_props)
         finishers = race.part_person_seq_list()
         # There must be finishers, since I can update one of them
+        person_dicts = [person for (person, part_dict) in finishers if person["nid"] == person_nid]
+        if person_dicts:
+            person_dict = person_dicts[0]
+        else:
+            person_dict = mg.Person(person_id=person_nid).get_dict()
         return render_template('participant_edit.html', form=form, race_id=race_id, finishers=finishers,
                                race_label=race_label, org_id=org_id, person=person_dict)
     else:
@@ -527,12 +578,38 @@ def participant_down(race_id, pers_id):
     return redirect(url_for('main.participant_add', race_id=race_id))
 
 
+@main.route('/participant/<race_id>/order', methods=['POST'])
+@login_required
+def participant_order(race_id):
+    """
+    This method sets the sequence of arrival for the race from the complete list of person nids, in a JSON body
+    {"order": [person nid, ...]}. The sequence is set in one transaction, then the points are calculated once.
+
+    :param race_id: ID of the race.
+    :return: JSON with the person nids in the new sequence of arrival, status 400 if the list does not match the
+    participants of the race, status 404 if the race does not exist.
+    """
+    data = request.get_json(silent=True)
+    person_nids = data.get("order") if isinstance(data, dict) else None
+    if not isinstance(person_nids, list):
+        return jsonify(dict(error="Body must be a JSON object with an order list.")), 400
+    if not mg.ns.node(race_id, lbl_race):
+        return jsonify(dict(error="Race not found.")), 404
+    race = mg.Race(race_id=race_id)
+    if not race.set_finish_order(person_nids):
+        return jsonify(dict(error="Order must have every participant of the race exactly once.")), 400
+    race.org.calculate_points()
+    return jsonify(dict(race_id=race_id, order=[person["nid"] for (person, _) in race.part_person_seq_list()]))
+
+
 @main.route('/result/<mf>', methods=['GET'])
 @main.route('/result/<mf>/<person_id>')
+@conditional
 def results(mf, person_id=None):
-    result_set = mg.results_for_mf(mf=mf)
+    def render_table():
+        return render_template("result_table.html", result_set=mg.results_for_mf(mf=mf), mf=mf)
     param_dict = dict(
-        result_set=result_set,
+        table=cached_fragment(render_table, "result_table", mf),
         mf=mf
     )
     if person_id:
@@ -545,6 +622,7 @@ def results(mf, person_id=None):
 
 
 @main.route('/overview/<mf>', methods=['GET'])
+@conditional
 def overview(mf):
     """
     This method shows the results in detail. For every person the result in every race will be shown. Note that
@@ -554,20 +632,21 @@ def overview(mf):
     :return: The Overview list receives the list of races, the result_set with participants in arrival sequence and a
     dictionary with person nid as key. Value is a dictionary the race results per person.
     """
-    org_list = mg.organization_list()
-    result_seq = mg.results_for_mf(mf)
+    def render_table():
+        result_seq = mg.results_for_mf(mf)
+        # Person nid is 4th element in the tuple
+        season = mg.season_matrix(mf)
+        table_dict = dict(
+            org_list=mg.organization_list(),
+            result_set=result_seq,
+            result4person={person_res[3]: season[person_res[3]] for person_res in result_seq},
+            mf=mf
+        )
+        return render_template("overview_table.html", **table_dict)
     param_dict = dict(
-        org_list=org_list,
-        result_set=result_seq,
+        table=cached_fragment(render_table, "overview_table", mf),
         mf=mf
     )
-    result4person = {}
-    # Person nid is 4th element in the tuple
-    for person_res in result_seq:
-        person_nid = person_res[3]
-        races = mg.races4person_org(person_nid)
-        result4person[person_nid] = races
-    param_dict['result4person'] = result4person
     return render_template("overview_list.html", **param_dict)
 
 
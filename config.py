@@ -12,9 +12,28 @@ class Config(object):
     SECRET_KEY = os.urandom(24)
     LOGDIR = os.environ["LOGDIR"]
     LOGLEVEL = os.environ["LOGLEVEL"]
-    NEO4J_USER = os.environ["NEO4J_USER"]
-    NEO4J_PWD = os.environ["NEO4J_PWD"]
-    NEO4J_DB = os.environ["NEO4J_DB"]
+    NEO4J_USER = os.environ.get("NEO4J_USER")
+    NEO4J_PWD = os.environ.get("NEO4J_PWD")
+    NEO4J_DB = os.environ.get("NEO4J_DB")
+    # Graph backend: neo4j (default) or memory (in-memory graph, no Neo4J server required).
+    NEO4J_BACKEND = os.environ.get("NEO4J_BACKEND", "neo4j")
+    # Statements that take longer than SLOW_QUERY_MS milliseconds are written to the slow query log.
+    SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", 250))
+    # Level of the slow query log, independent of LOGLEVEL. Slow queries are logged as warning.
+    SLOW_LOG_LEVEL = os.environ.get("SLOW_LOG_LEVEL", "WARNING")
+    # Orphan Day and Location nodes are removed every ORPHAN_SWEEP_INTERVAL seconds, 0 to disable.
+    ORPHAN_SWEEP_INTERVAL = int(os.environ.get("ORPHAN_SWEEP_INTERVAL", 3600))
+    # Number of graph versions to keep in the change feed.
+    CHANGE_FEED_KEEP = int(os.environ.get("CHANGE_FEED_KEEP", 1000))
+    # Public pages validate against the graph version, which is read at most once every GRAPH_STATE_TTL seconds.
+    GRAPH_STATE_TTL = float(os.environ.get("GRAPH_STATE_TTL", 2))
+    # Limits for the cache of rendered tables: number of tables and total size in characters.
+    FRAGMENT_CACHE_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_ENTRIES", 32))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 8 * 1024 * 1024))
+    # Number of rows on a page of the person list and the organization list.
+    PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 50))
+    # Maximum number of persons returned by the participant search.
+    SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 10))
     if os.environ.get("WTF_CSR_ENABLED"):
         WTF_CSRF_ENABLED = os.environ["WTF_CSR_ENABLED"]
     if os.environ.get("SERVER_NAME"):
@@ -23,3 +42,5 @@ class Config(object):
 
 class TestConfig(Config):
     TESTING = True
+    # The test client posts forms without a CSRF token.
+    WTF_CSRF_ENABLED = False
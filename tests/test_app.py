@@ -1,5 +1,7 @@
+import logging
 import unittest
 from competition import create_app
+from competition.lib import neostore
 from config import Config
 
 
@@ -19,3 +21,11 @@ class UserModelCase(unittest.TestCase):
     def test_app_context(self):
         print(self.app_context)
         print(self.app.config["TESTING"])
+
+    def test_slow_log_handler(self):
+        # The slow query log has its own level, and its handler is added once for all applications.
+        slow_log = logging.getLogger(neostore.slow_logger)
+        nr_handlers = len(slow_log.handlers)
+        create_app(TestConfig)
+        self.assertEqual(len(slow_log.handlers), nr_handlers)
+        self.assertEqual(slow_log.level, logging.getLevelName(self.app.config["SLOW_LOG_LEVEL"].upper()))
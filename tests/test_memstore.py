@@ -0,0 +1,93 @@
+"""
+This procedure will test the in-memory store. No Neo4J server is required.
+"""
+
+import unittest
+from competition.lib.memstore import MemStore
+from competition.lib.neostructure import *
+from flask import Flask
+from py2neo.data import Node
+
+
+class TestMemStore(unittest.TestCase):
+
+    def setUp(self):
+        # A bare application is sufficient, the store only needs current_app for logging.
+        self.app = Flask(__name__)
+        self.app_ctx = self.app.app_context()
+        self.app_ctx.push()
+        self.ns = MemStore()
+
+    def tearDown(self):
+        self.app_ctx.pop()
+
+    def test_nodes_and_relations(self):
+        person = self.ns.create_node(lbl_person, name="Dirk")
+        race = self.ns.create_node(lbl_race, name="Hoofdwedstrijd")
+        self.assertTrue(isinstance(person, Node))
+        self.assertEqual(self.ns.node(person["nid"])["name"], "Dirk")
+        self.assertEqual(self.ns.get_node(lbl_person, name="Dirk"), person)
+        self.assertFalse(self.ns.get_nodes(lbl_person, name="Marie"))
+        self.ns.create_relation(from_node=person, rel=person2participant, to_node=race)
+        self.ns.create_relation(from_node=person, rel=person2participant, to_node=race)
+        self.assertEqual(self.ns.get_nr_relations(), 2)
+        self.assertEqual(self.ns.get_endnode(person, person2participant), race)
+        self.assertEqual(self.ns.get_startnodes(race), [person])
+        # Node with relations cannot be removed
+        self.assertFalse(self.ns.remove_node(race))
+        self.ns.remove_relation(start_node=person, end_node=race, rel_type=person2participant)
+        self.assertEqual(self.ns.get_endnodes(person), [])
+        self.assertTrue(self.ns.remove_node(race))
+        self.ns.remove_node_force(person["nid"])
+        self.assertFalse(self.ns.get_nodes())
+
+    def test_set_attribs(self):
+        person = self.ns.create_node(lbl_person, name="Dirk", points=4)
+        self.assertTrue(self.ns.node_set_attribs(nid=person["nid"], points=10))
+        self.assertEqual(self.ns.node(person["nid"])["points"], 10)
+        self.assertEqual(self.ns.nodes_set_attribs([dict(nid=person["nid"], nr=2)], label=lbl_person), 1)
+        self.assertEqual(self.ns.node(person["nid"])["nr"], 2)
+        self.ns.node_update(nid=person["nid"], name="Marie")
+        self.assertEqual(dict(self.ns.node(person["nid"])), dict(nid=person["nid"], name="Marie"))
+
+    def test_graph_version(self):
+        self.assertEqual(self.ns.graph_version(), 0)
+        person = self.ns.create_node(lbl_person, name="Dirk")
+        self.ns.create_node(lbl_race, name="Hoofdwedstrijd")
+        self.assertEqual(self.ns.graph_version(), 2)
+        self.assertEqual(self.ns.graph_version(lbl_person), 1)
+        self.assertEqual(self.ns.changes_since(1)[0]["labels"], [lbl_race])
+        self.ns.node_set_attribs(nid=person["nid"], points=3)
+        self.assertEqual(self.ns.graph_version(lbl_person), 3)
+        self.assertEqual(self.ns.prune_changes(keep=1), 2)
+
+    def test_transaction_rollback(self):
+        person = self.ns.create_node(lbl_person, name="Dirk")
+        race = self.ns.create_node(lbl_race, name="Hoofdwedstrijd")
+        version = self.ns.graph_version()
+        with self.assertRaises(RuntimeError):
+            with self.ns.transaction():
+                self.ns.node_set_attribs(nid=person["nid"], name="Marie", points=3)
+                self.ns.create_node(lbl_person, name="Jan")
+                self.ns.create_relation(from_node=person, rel=person2participant, to_node=race)
+                self.ns.remove_node_force(race["nid"])
+                raise RuntimeError("Rollback")
+        self.assertEqual(self.ns.node_props(person["nid"]), dict(nid=person["nid"], name="Dirk"))
+        self.assertEqual(len(self.ns.get_nodes(lbl_person)), 1)
+        self.assertEqual(self.ns.node(race["nid"])["name"], "Hoofdwedstrijd")
+        self.assertFalse(self.ns.get_endnodes(person, person2participant))
+        # A failed transaction does not change the version.
+        self.assertEqual(self.ns.graph_version(), version)
+        # A committed transaction is recorded as one change.
+        with self.ns.transaction():
+            self.ns.node_set_attribs(nid=person["nid"], points=3)
+            self.ns.node_set_attribs(nid=race["nid"], points=4)
+        self.assertEqual(self.ns.graph_version(), version + 1)
+
+    def test_unknown_query(self):
+        with self.assertRaises(ValueError):
+            self.ns.model_query("does_not_exist", "MATCH (n) RETURN n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,7 @@ This procedure will test the classes of the models_graph.
 import datetime
 import unittest
 from competition import create_app
-from competition.lib import neostore, models_graph as mg
+from competition.lib import models_graph as mg
 from competition.lib.neostructure import *
 from config import TestConfig
 from pandas import DataFrame
@@ -44,6 +44,27 @@ def organization_delete(org):
     return
 
 
+def fixture_create():
+    """
+    This method will create the data that the tests expect in the Neo4J test database, for the in-memory store: the
+    organization Lilse Bergen with a main race where Dirk Vermeylen participates. The data is created once, the
+    in-memory store is kept for all tests.
+
+    :return:
+    """
+    if mg.ns.get_node(lbl_person, name="Dirk Vermeylen"):
+        return
+    org = mg.Organization()
+    org.add(name="Lilse Bergen", location="Gierle", datestamp=datetime.date(2018, 6, 17), org_type=False)
+    race = mg.Race(org_id=org.get_nid())
+    race.add(name="10k", type=def_hoofdwedstrijd)
+    person = mg.Person()
+    person.add(name="Dirk Vermeylen", mf="man")
+    mg.Participant(race_id=race.get_nid(), person_id=person.get_nid()).add(prev_person_id="-1")
+    org.calculate_points()
+    return
+
+
 # @unittest.skip("Focus on Coverage")
 class TestModelGraphClass(unittest.TestCase):
 
@@ -53,8 +74,10 @@ class TestModelGraphClass(unittest.TestCase):
         self.app = create_app(TestConfig)
         self.app_ctx = self.app.app_context()
         self.app_ctx.push()
-        self.ns = neostore.NeoStore()
+        self.ns = mg.ns
         mg.init_graph()
+        if TestConfig.NEO4J_BACKEND == "memory":
+            fixture_create()
 
     def tearDown(self):
         self.app_ctx.pop()
@@ -195,10 +218,47 @@ class TestModelGraphClass(unittest.TestCase):
         for key in ["organization", "city", "id", "date", "type"]:
             self.assertTrue(isinstance(rec[key], str))
 
+    def test_organization_page(self):
+        full = mg.organization_list()
+        (res, next_page) = mg.organization_page(limit=2)
+        self.assertEqual(res, full[:2])
+        if next_page:
+            (res, _) = mg.organization_page(limit=2, **next_page)
+            self.assertEqual(res, full[2:4])
+        (res, _) = mg.organization_page(start="2100-01-01")
+        self.assertEqual(res, [])
+
+    def test_person_page(self):
+        full = mg.person_list()
+        (res, next_page) = mg.person_page(limit=3)
+        self.assertEqual([rec["nid"] for rec in res], [rec["nid"] for rec in full[:3]])
+        if next_page:
+            (res, _) = mg.person_page(limit=3, **next_page)
+            self.assertEqual([rec["nid"] for rec in res], [rec["nid"] for rec in full[3:6]])
+
     def test_participation_points(self):
         res = mg.participation_points(mf="Heren", orgtype="Wedstrijd")
         self.assertTrue(isinstance(res, dict))
 
+    def test_results_for_mf(self):
+        mg.standings_rebuild()
+        res = mg.results_for_mf(mf="Heren")
+        self.assertTrue(isinstance(res, list))
+        for (name, points, nr, nid) in res:
+            self.assertTrue(isinstance(name, str))
+            self.assertTrue(nr > 0)
+            self.assertTrue(isinstance(nid, str))
+        # Sorted on points
+        self.assertEqual([rec[1] for rec in res], sorted([rec[1] for rec in res], reverse=True))
+
+    def test_reference_data(self):
+        mg.refdata.refresh()
+        mf_node = mg.get_mf_node("Dames")
+        self.assertEqual(mf_node["name"], "Dames")
+        self.assertEqual(mg.refdata.get_nid(lbl_mf, "Dames"), mf_node["nid"])
+        self.assertEqual(mg.get_org_type_node(def_wedstrijd)["name"], def_wedstrijd)
+        self.assertFalse(mg.refdata.get(lbl_raceType, "DoesNotExist"))
+
     def test_race(self):
         org = organization_create()
         race1 = mg.Race(org_id=org.get_nid())
@@ -221,6 +281,53 @@ class TestModelGraphClass(unittest.TestCase):
         mg.race_delete(race2.get_nid())
         organization_delete(org=org)
 
+    def test_participant_seq(self):
+        org = organization_create()
+        race = mg.Race(org_id=org.get_nid())
+        race.add(name="16k", type="Hoofdwedstrijd")
+        race_id = race.get_nid()
+        person_ids = []
+        for name in ["Test Runner A", "Test Runner B", "Test Runner C"]:
+            person = mg.Person()
+            person.add(name=name, mf="man")
+            person_ids.append(person.get_nid())
+        (pa, pb, pc) = person_ids
+        self.assertEqual([p["nid"] for p in race.get_next_part("Test Runner ")], [pa, pb, pc])
+        self.assertEqual(len(race.get_next_part("Test Runner ", limit=2)), 2)
+        self.assertEqual([p["nid"] for p in race.get_next_part("test runner ")], [pa, pb, pc])
+        # Arrival order A, C, then B first: B, A, C.
+        mg.Participant(race_id=race_id, person_id=pa).add(prev_person_id='-1')
+        mg.Participant(race_id=race_id, person_id=pc).add(prev_person_id=pa)
+        mg.Participant(race_id=race_id, person_id=pb).add(prev_person_id='-1')
+        self.assertEqual(race.get_next_part("Test Runner "), [])
+        seq_list = [person['nid'] for (person, part) in race.part_person_seq_list()]
+        self.assertEqual(seq_list, [pb, pa, pc])
+        # Move C up: B, C, A. Then move B down: C, B, A.
+        mg.Participant(race_id=race_id, person_id=pc).up()
+        mg.Participant(race_id=race_id, person_id=pb).down()
+        seq_list = [person['nid'] for (person, part) in race.part_person_seq_list()]
+        self.assertEqual(seq_list, [pc, pb, pa])
+        self.assertEqual([part['seq'] for (person, part) in race.part_person_seq_list()], [1, 2, 3])
+        # Set complete order: A, B, C. A list that does not match the participants is refused.
+        self.assertFalse(race.set_finish_order([pa, pb]))
+        self.assertFalse(race.set_finish_order([pa, pb, pb]))
+        self.assertTrue(race.set_finish_order([pa, pb, pc]))
+        seq_list = [person['nid'] for (person, part) in race.part_person_seq_list()]
+        self.assertEqual(seq_list, [pa, pb, pc])
+        self.assertEqual([part['seq'] for (person, part) in race.part_person_seq_list()], [1, 2, 3])
+        self.assertTrue(race.set_finish_order([pc, pb, pa]))
+        # Remove B: C, A.
+        mg.Participant(race_id=race_id, person_id=pb).delete()
+        seq_list = [person['nid'] for (person, part) in race.part_person_seq_list()]
+        self.assertEqual(seq_list, [pc, pa])
+        self.assertEqual([part['seq'] for (person, part) in race.part_person_seq_list()], [1, 2])
+        for person_id in [pc, pa]:
+            mg.Participant(race_id=race_id, person_id=person_id).delete()
+        for person_id in person_ids:
+            mg.Person(person_id).remove()
+        mg.race_delete(race_id)
+        organization_delete(org=org)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,261 @@
+"""
+This procedure will test the model flows of models_graph on the in-memory store. The shared store of models_graph is
+replaced by an in-memory store for every test, so no Neo4J data is used or changed. The parity test runs the same model
+flow on the in-memory store and on the Neo4J test database, if the Neo4J test database is configured.
+"""
+
+import datetime
+import os
+import re
+import unittest
+from competition import create_app
+from competition.lib import memqueries, models_graph as mg, neostore
+from competition.lib.memstore import MemStore
+from competition.lib.neostructure import *
+from config import TestConfig
+from flask import Flask
+from py2neo.data import Node
+
+nid_pattern = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def normalize(value):
+    """
+    This function replaces the nids in a result by the name of the node, so that results of different stores can be
+    compared. Nodes are converted to dictionaries.
+
+    :param value: Result of a model function.
+    :return: Result with names in place of nids.
+    """
+    if isinstance(value, Node):
+        value = dict(value)
+    if isinstance(value, dict):
+        return {normalize(key): normalize(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(val) for val in value]
+    if isinstance(value, str) and nid_pattern.match(value):
+        node = mg.ns.node(value)
+        if not isinstance(node, Node):
+            return value
+        return "{lbl}:{name}".format(lbl=sorted(node.labels)[0], name=node["name"] or node["city"] or node["key"])
+    return value
+
+
+def parity_flow():
+    """
+    This function runs a model flow on the shared store of models_graph and returns the results of the model
+    functions, with names in place of nids. The nodes of the flow are removed at the end.
+
+    :return: List of results.
+    """
+    res = []
+    org = mg.Organization()
+    org.add(name="Parity Cross", location="Parity City", datestamp=datetime.date(1963, 7, 2), org_type=False)
+    org_nid = org.get_nid()
+    race = mg.Race(org_id=org_nid)
+    race.add(name="Parity 10k", type=def_hoofdwedstrijd)
+    race_nid = race.get_nid()
+    persons = []
+    try:
+        for (name, mf) in [("Parity Anna", "vrouw"), ("Parity Bert", "man"), ("Parity Chris", "man"),
+                           ("Parity Dora", "vrouw")]:
+            person = mg.Person()
+            person.add(name=name, mf=mf)
+            persons.append(person.get_nid())
+        # Chris arrives after Anna, so before Bert. Dora does not participate.
+        for (person_nid, prev_person_id) in [(persons[0], "-1"), (persons[1], persons[0]), (persons[2], persons[0])]:
+            mg.Participant(race_id=race_nid, person_id=person_nid).add(prev_person_id=prev_person_id)
+        race = mg.Race(race_id=race_nid)
+        race.org.calculate_points()
+
+        def snapshot():
+            my_race = mg.Race(race_id=race_nid)
+            res.append(normalize(my_race.part_person_seq_list()))
+            res.append(normalize(my_race.get_next_part("parity")))
+            res.append([my_race.get_participant_cat(mf) for mf in ["Dames", "Heren"]])
+            res.append(normalize(mg.get_race_list(org_nid)))
+            res.append(normalize([mg.races4person(nid) for nid in persons]))
+            res.append(normalize([rec for rec in mg.person_list() if rec["nid"] in persons]))
+            res.append(normalize([rec for rec in mg.organization_list() if rec["id"] == org_nid]))
+            for mf in ["Dames", "Heren"]:
+                res.append(normalize([rec for rec in mg.results_for_mf(mf) if rec[3] in persons]))
+                res.append(normalize({nid: val for nid, val in mg.season_matrix(mf).items() if nid in persons}))
+                points = mg.participation_points(mf, def_wedstrijd)
+                res.append(normalize({nid: val for nid, val in points.items() if nid in persons}))
+            res.append(len(my_race.org.get_participants()))
+
+        snapshot()
+        mg.Participant(race_id=race_nid, person_id=persons[1]).up()
+        mg.Participant(race_id=race_nid, person_id=persons[0]).down()
+        snapshot()
+        res.append(race.set_finish_order(list(reversed(persons[:3]))))
+        snapshot()
+        mg.Participant(race_id=race_nid, person_id=persons[2]).delete()
+        race.org.calculate_points()
+        snapshot()
+    finally:
+        for person_nid in persons:
+            part = mg.Participant(race_id=race_nid, person_id=person_nid)
+            if part.get_nid():
+                part.delete()
+        mg.race_delete(race_id=race_nid)
+        mg.organization_delete(org_id=org_nid)
+        for person_nid in persons:
+            mg.Person(person_id=person_nid).remove()
+    return res
+
+
+class TestModelsMemory(unittest.TestCase):
+
+    def setUp(self):
+        # A bare application is sufficient, the models only need current_app for logging.
+        self.app = Flask(__name__)
+        self.app_ctx = self.app.app_context()
+        self.app_ctx.push()
+        self.neo_ns = mg.ns
+        mg.ns = MemStore()
+        mg.refdata.nodes = None
+        mg.init_graph()
+
+    def tearDown(self):
+        mg.ns = self.neo_ns
+        mg.refdata.nodes = None
+        self.app_ctx.pop()
+
+    def race_create(self, race_type=def_hoofdwedstrijd):
+        """
+        This method creates an organization with a race and three participants, in order Anna, Bert, Chris.
+
+        :param race_type: Hoofdwedstrijd or Nevenwedstrijd.
+        :return: race object and list of person nids in sequence of arrival.
+        """
+        org = mg.Organization()
+        org.add(name="Dwars door Hillesheim", location="Hillesheim", datestamp=datetime.date(1963, 7, 2),
+                org_type=False)
+        race = mg.Race(org_id=org.get_nid())
+        race.add(name="16k", type=race_type)
+        person_nids = []
+        prev_person_id = '-1'
+        for (name, mf) in [("Anna", "vrouw"), ("Bert", "man"), ("Chris", "man")]:
+            person = mg.Person()
+            person.add(name=name, mf=mf)
+            part = mg.Participant(race_id=race.get_nid(), person_id=person.get_nid())
+            part.add(prev_person_id=prev_person_id)
+            prev_person_id = person.get_nid()
+            person_nids.append(person.get_nid())
+        race = mg.Race(race_id=race.get_nid())
+        race.org.calculate_points()
+        return race, person_nids
+
+    def test_race_flow(self):
+        (race, person_nids) = self.race_create()
+        self.assertEqual([person["nid"] for (person, part) in race.part_person_seq_list()], person_nids)
+        self.assertEqual(race.get_participant_cat("Heren"), 2)
+        # Points per mf, Bert is the first man.
+        points = {person["label"]: part["points"] for (person, part) in race.part_person_seq_list()}
+        self.assertEqual(points, dict(Anna=50, Bert=50, Chris=45))
+        self.assertEqual([rec[0] for rec in mg.results_for_mf("Heren")], ["Bert", "Chris"])
+        self.assertEqual(len(mg.season_matrix("Dames")[person_nids[0]]), 1)
+        self.assertEqual(mg.participation_points("Heren", def_wedstrijd)[person_nids[2]], [45])
+        # Move Chris up, then remove Bert.
+        part = mg.Participant(race_id=race.get_nid(), person_id=person_nids[2])
+        part.up()
+        self.assertEqual(part.get_seq(), 2)
+        self.assertEqual(mg.Participant(part_id=part.get_nid()).prev_runner(),
+                         mg.Participant(race_id=race.get_nid(), person_id=person_nids[0]).get_nid())
+        mg.Participant(race_id=race.get_nid(), person_id=person_nids[1]).delete()
+        self.assertEqual(sorted(race.get_person_nids()), sorted([person_nids[0], person_nids[2]]))
+        self.assertEqual([part_node["seq"] for part_node in race.get_participant_seq_list()], [1, 2])
+
+    def test_finish_order_and_search(self):
+        (race, person_nids) = self.race_create()
+        self.assertFalse(race.set_finish_order(person_nids[:2]))
+        self.assertTrue(race.set_finish_order(list(reversed(person_nids))))
+        self.assertEqual(race.part_person_first_id(), person_nids[2])
+        person = mg.Person()
+        person.add(name="Bernadette", mf="vrouw")
+        self.assertEqual([rec["name"] for rec in race.get_next_part("be")], ["Bernadette"])
+
+    def test_lists(self):
+        (race, person_nids) = self.race_create(race_type=def_nevenwedstrijd)
+        orgs = mg.organization_list()
+        self.assertEqual(orgs[0]["date"], "02-07-1963")
+        self.assertEqual(orgs[0]["type"], def_wedstrijd)
+        (res, next_page) = mg.organization_page(limit=1)
+        self.assertEqual(res, orgs)
+        self.assertIsNone(next_page)
+        (res, next_page) = mg.person_page(limit=2)
+        self.assertEqual([rec["name"] for rec in res], ["Anna", "Bert"])
+        (res, next_page) = mg.person_page(limit=2, **next_page)
+        self.assertEqual([rec["name"] for rec in res], ["Chris"])
+        self.assertEqual(mg.person_list()[0]["races"], 1)
+        self.assertEqual(mg.get_location_list()[0][1], "Hillesheim")
+        self.assertTrue(mg.Location("Gierle").add())
+        self.assertFalse(mg.Location("Gierle").add())
+        self.assertEqual(len(mg.ns.get_nodes(lbl_location)), 2)
+        self.assertEqual(mg.get_race_list(race.get_org_id())[0]["type"]["name"], def_nevenwedstrijd)
+        self.assertEqual(len(mg.races4person(person_nids[0])), 1)
+        self.assertEqual(len(race.org.get_participants()), 3)
+
+    def test_upgrade_graph(self):
+        # init_graph has upgraded the graph, a second upgrade is not required.
+        self.assertFalse(mg.upgrade_graph())
+        schema_node = mg.ns.get_node(lbl_schemaVersion, name=def_graph)
+        self.assertEqual(schema_node["version"], mg.schema_version)
+        # A graph with an older schema version is upgraded.
+        person = mg.Person()
+        person.add(name="Anna", mf="vrouw")
+        mg.ns.node_set_attribs(label=lbl_person, nid=person.get_nid(), name_lc=None)
+        mg.ns.node_set_attribs(label=lbl_schemaVersion, nid=schema_node["nid"], version=0)
+        self.assertTrue(mg.upgrade_graph())
+        self.assertEqual(mg.ns.node(person.get_nid())["name_lc"], "anna")
+        self.assertFalse(mg.upgrade_graph())
+
+
+class TestModelsParity(unittest.TestCase):
+
+    def test_query_names(self):
+        # Every named query of models_graph has an in-memory version.
+        with open(mg.__file__) as f:
+            query_names = set(re.findall(r'model_(?:query|iter|update)\("(\w+)"', f.read()))
+        self.assertTrue(query_names)
+        self.assertEqual(query_names - set(memqueries.queries), set())
+
+    def test_parity_flow_memory(self):
+        app = Flask(__name__)
+        neo_ns = mg.ns
+        try:
+            with app.app_context():
+                mg.ns = MemStore()
+                mg.refdata.nodes = None
+                mg.init_graph()
+                nr_nodes = len(mg.ns.get_nodes())
+                res = parity_flow()
+                self.assertEqual(res[0][1][0]["label"], "Parity Chris")
+                # The nodes of the flow are removed.
+                self.assertEqual(len(mg.ns.get_nodes()), nr_nodes)
+        finally:
+            mg.ns = neo_ns
+            mg.refdata.nodes = None
+
+    @unittest.skipUnless(os.environ.get("NEO4J_USER"), "Requires the Neo4J test database.")
+    def test_parity(self):
+        app = create_app(TestConfig)
+        neo_ns = mg.ns
+        try:
+            results = {}
+            for backend in ["memory", "neo4j"]:
+                with app.app_context():
+                    mg.ns = neostore.store_factory(backend)
+                    mg.refdata.nodes = None
+                    mg.init_graph()
+                    results[backend] = parity_flow()
+                    mg.ns.flush_request_changes()
+            self.assertEqual(results["memory"], results["neo4j"])
+        finally:
+            mg.ns = neo_ns
+            mg.refdata.nodes = None
+
+
+if __name__ == "__main__":
+    unittest.main()
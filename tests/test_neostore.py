@@ -18,7 +18,7 @@ class TestNeoStore(unittest.TestCase):
         self.app = create_app(TestConfig)
         self.app_ctx = self.app.app_context()
         self.app_ctx.push()
-        self.ns = neostore.NeoStore()
+        self.ns = neostore.store_factory(TestConfig.NEO4J_BACKEND)
 
     def tearDown(self):
         self.app_ctx.pop()
@@ -52,8 +52,8 @@ class TestNeoStore(unittest.TestCase):
         self.ns.create_relation(from_node=node1_node, rel=rel, to_node=node2_node)
         # Then remove the relation
         self.ns.remove_relation(start_node=node1_node, end_node=node2_node, rel_type=rel)
-        self.ns.remove_node_force(node1_node["nid"])
-        self.ns.remove_node_force(node2_node["nid"])
+        self.ns.remove_node_force(node1_node["nid"], label)
+        self.ns.remove_node_force(node2_node["nid"], label)
         self.assertEqual(self.ns.get_nodes(), nr_nodes)
 
     def test_get_nodes(self):
@@ -80,17 +80,18 @@ class TestNeoStore(unittest.TestCase):
         res = self.ns.get_node(label)
         self.assertEqual(len(res), 2)
         # Remove res_node_1
-        self.ns.remove_node_force(res_node_1["nid"])
+        self.ns.remove_node_force(res_node_1["nid"], label)
         # Get remaining node with label Test_Get_Nodes
         res = self.ns.get_nodes(label)
         res_node_2 = res[0]
         self.assertEqual(res_node_2, node2_node)
-        self.ns.remove_node_force(res_node_2["nid"])
+        self.ns.remove_node_force(res_node_2["nid"], label)
         # Verify all nodes are removed
         self.assertFalse(self.ns.get_nodes(label))
         # Check same number of nodes at the end as on the beginning
         self.assertEqual(self.ns.get_nodes(), nr_nodes)
 
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
     def test_node_count(self):
         # 2 MF Nodes
         label = "MF"
@@ -113,6 +114,7 @@ class TestNeoStore(unittest.TestCase):
         nr = len(self.ns.get_nodes(label))
         self.assertEqual(nr, 1)
 
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
     def test_get_endnode(self):
         # First check that I can get a single end node for normal usage.
         lbl = "Person"
@@ -141,6 +143,7 @@ class TestNeoStore(unittest.TestCase):
         end_node = self.ns.get_endnode(start_node, rel_type)
         self.assertFalse(end_node)
 
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
     def test_get_endnodes(self):
         # First check that I can get a single end node.
         lbl = "Person"
@@ -170,6 +173,21 @@ class TestNeoStore(unittest.TestCase):
         end_nodes = self.ns.get_endnodes(start_node, rel_type)
         self.assertFalse(end_nodes)
 
+    def test_get_endnodes_many(self):
+        label = "TestNode"
+        start_nodes = [self.ns.create_node(label, testname=name) for name in ["Start1", "Start2"]]
+        end_node = self.ns.create_node(label, testname="End")
+        self.ns.create_relation(from_node=start_nodes[0], rel="testrel", to_node=end_node)
+        nids = [node["nid"] for node in start_nodes]
+        res = self.ns.get_endnodes_many(nids, rel_type="testrel", label=label)
+        self.assertEqual([node["nid"] for node in res[nids[0]]], [end_node["nid"]])
+        self.assertEqual(res[nids[1]], [])
+        res = self.ns.get_startnodes_many([end_node["nid"]], rel_type="testrel", label=label)
+        self.assertEqual([node["nid"] for node in res[end_node["nid"]]], [nids[0]])
+        for node in start_nodes + [end_node]:
+            self.ns.remove_node_force(node["nid"], label)
+
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
     def test_get_nodes_no_nid(self):
         res = self.ns.get_nodes_no_nid()
         lbl = "TestNode"
@@ -182,6 +200,7 @@ class TestNeoStore(unittest.TestCase):
         rem_res = self.ns.get_nodes_no_nid()
         self.assertEqual(rem_res, res)
 
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
     def test_get_startnode(self):
         # First check that I can get a single start node for normal usage.
         lbl = "Location"
@@ -206,12 +225,89 @@ class TestNeoStore(unittest.TestCase):
         start_node = self.ns.get_startnode(end_node, rel_type)
         self.assertFalse(start_node)
 
+    def test_nodes_set_attribs(self):
+        label = "TestNode"
+        nodes = [self.ns.create_node(label, testname=name) for name in ["Node1", "Node2"]]
+        rows = [dict(nid=node["nid"], points=cnt, rel_pos=cnt) for cnt, node in enumerate(nodes, start=1)]
+        self.assertEqual(self.ns.nodes_set_attribs(rows, label=label), len(rows))
+        for row in rows:
+            props = self.ns.node_props(row["nid"])
+            self.assertEqual(props["points"], row["points"])
+            self.assertEqual(props["rel_pos"], row["rel_pos"])
+            # Properties not in the row are not changed.
+            self.assertTrue(props["testname"].startswith("Node"))
+        self.assertEqual(self.ns.nodes_set_attribs([]), 0)
+        for node in nodes:
+            self.ns.remove_node_force(node["nid"], label)
+
+    def test_node_label(self):
+        label = "TestNode"
+        node = self.ns.create_node(label, testname="Node1")
+        self.assertEqual(self.ns.node(node["nid"], label)["testname"], "Node1")
+        self.assertFalse(self.ns.node(node["nid"], lbl_person))
+        self.assertEqual(self.ns.get_node(label, testname="Node1")["nid"], node["nid"])
+        # The node is removed on the label of the node only.
+        self.ns.remove_node_force(node["nid"], lbl_person)
+        self.assertTrue(self.ns.node(node["nid"], label))
+        self.ns.remove_node_force(node["nid"], label)
+        self.assertFalse(self.ns.node(node["nid"], label))
+
+    def test_get_or_create(self):
+        label = "TestNode"
+        node = self.ns.get_or_create(label, dict(testname="Node1"), dict(points=3))
+        self.assertTrue(isinstance(node, Node))
+        self.assertEqual(node["points"], 3)
+        self.assertTrue(node["nid"])
+        # Second call returns the same node, extra properties are not applied.
+        same_node = self.ns.get_or_create(label, dict(testname="Node1"), dict(points=5))
+        self.assertEqual(same_node["nid"], node["nid"])
+        self.assertEqual(same_node["points"], 3)
+        (same_node, created) = self.ns.merge_node(label, dict(testname="Node1"))
+        self.assertEqual(same_node["nid"], node["nid"])
+        self.assertFalse(created)
+        self.ns.remove_node_force(node["nid"], label)
+
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
+    def test_graph_version(self):
+        label = "TestNode"
+        version = self.ns.graph_version()
+        node = self.ns.create_node(label, testname="Node1")
+        self.assertEqual(self.ns.graph_version(), version + 1)
+        self.assertEqual(self.ns.graph_version(label), version + 1)
+        self.ns.node_set_attribs(label=label, nid=node["nid"], points=3)
+        changes = self.ns.changes_since(version)
+        self.assertEqual([change["version"] for change in changes], [version + 1, version + 2])
+        self.assertEqual(changes[1]["nids"], [node["nid"]])
+        self.assertEqual(changes[1]["labels"], [label])
+        # Changes in the application context are recorded as one change, when the version is read.
+        self.ns.node_set_attribs(label=label, nid=node["nid"], points=6)
+        self.ns.node_set_attribs(label=label, nid=node["nid"], points=7)
+        self.assertEqual(self.ns.graph_version(), version + 3)
+        # Changes in a transaction are recorded as one change.
+        with self.ns.transaction():
+            self.ns.node_set_attribs(label=label, nid=node["nid"], points=4)
+            self.ns.node_set_attribs(label=label, nid=node["nid"], points=5)
+        self.assertEqual(self.ns.graph_version(), version + 4)
+        self.ns.remove_node_force(node["nid"], label)
+
+    @unittest.skipIf(TestConfig.NEO4J_BACKEND == "memory", "Requires the Neo4J test database.")
+    def test_iter_query(self):
+        label = "TestNode"
+        nodes = [self.ns.create_node(label, testname="Node{n}".format(n=n)) for n in range(5)]
+        query = "MATCH (n:{lbl}) RETURN n.nid AS nid".format(lbl=label)
+        batches = list(self.ns.iter_query(query, batch_size=2))
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+        nids = [rec["nid"] for batch in batches for rec in batch]
+        self.assertEqual(set(nids), set(node["nid"] for node in nodes))
+        for node in nodes:
+            self.ns.remove_node_force(node["nid"], label)
+
     def test_nr_relations(self):
         self.assertTrue(isinstance(self.ns.get_nr_relations(), int))
 
     def test_remove_orphan_nodes(self):
         # Count number of nodes and relations to start with.
-        nr_nodes_start = len(self.ns.get_nodes())
+        nr_nodes_start = len(self.ns.get_nodes() or [])
         nr_rels_start = self.ns.get_nr_relations()
         lbl = "TestNode"
         testnames = ["test1", "test2"]
@@ -219,11 +315,11 @@ class TestNeoStore(unittest.TestCase):
             props = dict(name=name)
             self.ns.create_node(lbl, **props)
         # Check number of nodes = start +2, number of relations did not change.
-        self.assertEqual(len(self.ns.get_nodes()), nr_nodes_start + len(testnames))
+        self.assertEqual(len(self.ns.get_nodes() or []), nr_nodes_start + len(testnames))
         self.assertEqual(self.ns.get_nr_relations(), nr_rels_start)
-        self.ns.remove_orphan_nodes(lbl)
+        self.assertEqual(self.ns.remove_orphan_nodes(lbl), len(testnames))
         # Count number of nodes and relations at end.
-        self.assertEqual(len(self.ns.get_nodes()), nr_nodes_start)
+        self.assertEqual(len(self.ns.get_nodes() or []), nr_nodes_start)
         self.assertEqual(self.ns.get_nr_relations(), nr_rels_start)
 
 
@@ -0,0 +1,66 @@
+"""
+This procedure will test the fragment cache.
+"""
+
+import unittest
+from competition import create_app
+from competition.lib import webcache
+from config import TestConfig
+from datetime import datetime
+
+
+class TestWebCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config["FRAGMENT_CACHE_ENTRIES"] = 2
+        self.app.config["FRAGMENT_CACHE_SIZE"] = 10
+        self.app_ctx = self.app.app_context()
+        self.app_ctx.push()
+        self.cache = webcache.FragmentCache()
+
+    def tearDown(self):
+        self.app_ctx.pop()
+
+    def test_lru_entries(self):
+        self.cache.put("a", "1")
+        self.cache.put("b", "2")
+        # Use a, so b is least recently used.
+        self.assertEqual(self.cache.get("a"), "1")
+        self.cache.put("c", "3")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "1")
+        self.assertEqual(self.cache.get("c"), "3")
+
+    def test_size(self):
+        self.cache.put("a", "123456")
+        self.cache.put("b", "123456")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.size, 6)
+        # Fragment bigger than the cache is not added.
+        self.cache.put("c", "12345678901")
+        self.assertIsNone(self.cache.get("c"))
+        self.cache.clear()
+        self.assertEqual(self.cache.size, 0)
+
+    def test_cached_fragment(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            return "<p></p>"
+        first = webcache.cached_fragment(render, "test_table", "Dames")
+        second = webcache.cached_fragment(render, "test_table", "Dames")
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+    def test_last_modified(self):
+        # Last change at 10.2 seconds, state read in the same second: no Last-Modified.
+        self.assertIsNone(webcache.last_modified(dict(version=1, ts=10200, read_ts=10900)))
+        # State read after the second of the last change.
+        modified_at = webcache.last_modified(dict(version=1, ts=10200, read_ts=11000))
+        self.assertEqual(modified_at, datetime(1970, 1, 1, 0, 0, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()